@@ -0,0 +1,66 @@
+class TimeProportionalActuator:
+    """Turns a continuous control output into relay edges.
+
+    Time is cut into windows of `window` seconds.  At the start of each
+    window the latest duty (0 to 1) is taken, and the element is on for
+    the first duty * window seconds and off for the rest, so both edges
+    are known a window ahead and there's at most one on/off cycle per
+    window.  On periods shorter than min_on are dropped and off periods
+    shorter than min_off are filled in (the element stays on), so the
+    relay is never flicked on or off for a few seconds.  Times are in
+    seconds on the caller's clock.
+    """
+
+    def __init__(self, window: float = 120.0, min_on: float = 20.0, min_off: float = 20.0):
+        self.window = window
+        self.min_on = min_on
+        self.min_off = min_off
+        self.duty = None
+        self._window_start = None
+        self._on_until = None
+
+    def reset(self):
+        """Drop the duty and the current window"""
+        self.duty = None
+        self._window_start = None
+        self._on_until = None
+
+    def _on_time(self, duty) -> float:
+        on_time = min(max(duty, 0.0), 1.0) * self.window
+        if on_time < self.min_on:
+            return 0.0
+        if self.window - on_time < self.min_off:
+            return self.window
+        return on_time
+
+    def _roll(self, now):
+        """Start a new window if the current one is over"""
+        start = self._window_start
+        if start is not None and now < start + self.window:
+            return
+        # Keep to the window grid unless a whole window was missed
+        if start is None or now - (start + self.window) >= self.window:
+            start = now
+        else:
+            start += self.window
+        self._window_start = start
+        self._on_until = start + self._on_time(self.duty or 0.0)
+
+    def update(self, duty: float, now: float):
+        """Set the duty for the next window (or this one, if there's no
+        window running)"""
+        self.duty = duty
+        self._roll(now)
+
+    def state(self, now: float) -> str:
+        """'on' or 'off' at time now"""
+        self._roll(now)
+        return 'on' if now < self._on_until else 'off'
+
+    def next_edge(self, now: float) -> float:
+        """When state() may next change"""
+        if self._window_start is None:
+            return now
+        if now < self._on_until:
+            return self._on_until
+        return self._window_start + self.window
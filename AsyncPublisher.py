@@ -0,0 +1,96 @@
+import time
+import threading
+from collections import deque
+
+class AsyncPublisher:
+    """Hands readings to slow sinks (HASS, MQTT, ...) on a background
+    thread so the sampling loop never waits on the network.
+
+    The queue is bounded.  When it is full the oldest reading is
+    dropped; with coalesce=True only the newest reading is ever kept.
+    """
+
+    def __init__(self, max_depth: int = 10, coalesce: bool = False):
+        self._queue = deque(maxlen=1 if coalesce else max_depth)
+        self._sinks = []
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+
+        self._enqueued = 0
+        self._published = 0
+        self._drops = 0
+        self._errors = 0
+        self._last_lag = None
+        self._max_lag = None
+
+    def add_sink(self, sink):
+        """Register a callable that takes a single reading"""
+        self._sinks.append(sink)
+
+    def start(self):
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name='publisher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the publisher thread.  Readings still queued are discarded."""
+        with self._condition:
+            self._running = False
+            self._queue.clear()
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, reading):
+        """Queue a reading for publishing.  Never blocks."""
+        with self._condition:
+            if len(self._queue) == self._queue.maxlen:
+                self._drops += 1
+            self._queue.append((time.monotonic(), reading))
+            self._enqueued += 1
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running and not self._queue:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                queued_at, reading = self._queue.popleft()
+
+            lag = time.monotonic() - queued_at
+            for sink in list(self._sinks):
+                try:
+                    sink(reading)
+                except Exception as e:
+                    print(f'############## Error publishing reading:  {e}')
+                    self._errors += 1
+
+            with self._condition:
+                self._published += 1
+                self._last_lag = lag
+                self._max_lag = lag if self._max_lag is None else max(self._max_lag, lag)
+
+    @property
+    def depth(self) -> int:
+        return len(self._queue)
+
+    @property
+    def metrics(self) -> dict:
+        with self._condition:
+            return {
+                'depth': len(self._queue),
+                'max_depth': self._queue.maxlen,
+                'enqueued': self._enqueued,
+                'published': self._published,
+                'drops': self._drops,
+                'errors': self._errors,
+                'last_lag_s': self._last_lag,
+                'max_lag_s': self._max_lag
+            }
@@ -0,0 +1,160 @@
+import os
+import json
+import shutil
+import threading
+
+import numpy as np
+import Downsample
+
+# Column names match TempHistory.columns() and MeaterHistory.columns()
+SMOKER_FIELDS = ('index', 'timestamp_ms', 'temperature', 'set_temperature',
+                 'delta', 'one_min_temp', 'heating')
+MEATER_FIELDS = ('index', 'timestamp_ms', 'internal', 'ambient', 'target_temp')
+
+class CookArchive:
+    """Completed cooks, stored as one .npy file per column.
+
+    Each cook gets a directory holding the smoker columns and a
+    meater-<n> subdirectory per Meater cook.  index.json lists every
+    cook's id, start and end time, target temperature and Meater cook
+    names.  Columns are opened with np.load(mmap_mode='r'), so a query
+    only touches the pages it slices; nothing is parsed or loaded into
+    RAM up front.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._index_path = os.path.join(directory, 'index.json')
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._open = {}
+        self._cooks = []
+        if os.path.exists(self._index_path):
+            with open(self._index_path, encoding='utf-8') as f:
+                self._cooks = json.load(f)
+
+    @property
+    def cooks(self) -> list:
+        """The index entry of every archived cook, oldest first"""
+        with self._lock:
+            return list(self._cooks)
+
+    def cook(self, cook_id: str) -> dict:
+        with self._lock:
+            for entry in self._cooks:
+                if entry['cook_id'] == cook_id:
+                    return entry
+        raise KeyError(f'No archived cook {cook_id}')
+
+    def add(self, readings, meater_records) -> dict:
+        """Archive a cook from its CookLog reading records and Meater
+        records, and return its index entry"""
+        if len(readings) == 0:
+            return None
+
+        cook_id = str(int(readings['timestamp_ms'][0]))
+        path = os.path.join(self.directory, cook_id)
+        staging = path + '.tmp'
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+
+        self._save(staging, {
+            'index': readings['index'],
+            'timestamp_ms': readings['timestamp_ms'],
+            'temperature': readings['temp'],
+            'set_temperature': readings['target'],
+            'delta': readings['delta'],
+            'one_min_temp': readings['one_min_temp'],
+            'heating': readings['heating']
+        })
+
+        meater = {}
+        for record in meater_records:
+            meater.setdefault(record['cook_id'], []).append(record)
+        meater_cooks = []
+        for n, (meater_id, records) in enumerate(meater.items()):
+            meater_cooks.append({ 'id': meater_id, 'name': records[-1]['name'] })
+            self._save(os.path.join(staging, f'meater-{n}'), {
+                field: np.array([record[field] for record in records],
+                                dtype=np.int64 if field == 'index' else np.float64)
+                for field in MEATER_FIELDS
+            })
+
+        entry = {
+            'cook_id': cook_id,
+            'start_ms': int(readings['timestamp_ms'][0]),
+            'end_ms': int(readings['timestamp_ms'][-1]),
+            'readings': len(readings),
+            'target_temp': float(readings['target'][-1]),
+            'meater_cooks': meater_cooks
+        }
+
+        with self._lock:
+            shutil.rmtree(path, ignore_errors=True)
+            os.replace(staging, path)
+            self._open.pop(cook_id, None)
+            self._cooks = [cook for cook in self._cooks if cook['cook_id'] != cook_id]
+            self._cooks.append(entry)
+            self._cooks.sort(key=lambda cook: cook['start_ms'])
+            self._write_index()
+        return entry
+
+    def _save(self, path, columns):
+        os.makedirs(path, exist_ok=True)
+        for name, values in columns.items():
+            np.save(os.path.join(path, f'{name}.npy'), np.ascontiguousarray(values))
+
+    def _write_index(self):
+        staging = self._index_path + '.tmp'
+        with open(staging, 'w', encoding='utf-8') as f:
+            json.dump(self._cooks, f)
+        os.replace(staging, self._index_path)
+
+    def _load(self, path, fields):
+        return { name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in fields }
+
+    def _series(self, cook_id) -> dict:
+        """Memory-mapped columns of a cook: '' for the smoker, then one
+        per Meater cook id"""
+        entry = self.cook(cook_id)
+        with self._lock:
+            series = self._open.get(cook_id)
+            if series is None:
+                path = os.path.join(self.directory, cook_id)
+                series = { '': self._load(path, SMOKER_FIELDS) }
+                for n, meater_cook in enumerate(entry['meater_cooks']):
+                    series[meater_cook['id']] = self._load(os.path.join(path, f'meater-{n}'), MEATER_FIELDS)
+                self._open[cook_id] = series
+            return series
+
+    def series(self, cook_id: str, start_ms=None, end_ms=None) -> dict:
+        """Every series of a cook, limited to [start_ms, end_ms].  The
+        columns are views of the mapped files, found by binary search
+        on the timestamps."""
+        result = {}
+        for name, columns in self._series(cook_id).items():
+            timestamps = columns['timestamp_ms']
+            start = 0 if start_ms is None else int(np.searchsorted(timestamps, start_ms, side='left'))
+            end = len(timestamps) if end_ms is None else int(np.searchsorted(timestamps, end_ms, side='right'))
+            result[name] = { field: values[start:end] for field, values in columns.items() }
+        return result
+
+    def downsampled(self, cook_id: str, start_ms=None, end_ms=None, points=None, bucket_ms=None) -> dict:
+        """series() reduced to about `points` rows each (or one per
+        bucket_ms) with Largest-Triangle-Three-Buckets.  Smoker heating
+        transitions are always kept."""
+        result = {}
+        for name, columns in self.series(cook_id, start_ms, end_ms).items():
+            timestamps = columns['timestamp_ms']
+            n = points
+            if n is None:
+                n = Downsample.points_for_bucket(timestamps, bucket_ms or 0)
+
+            if name == '':
+                positions = Downsample.lttb(timestamps, columns['temperature'], n)
+                positions = np.union1d(positions, Downsample.transitions(columns['heating']))
+            else:
+                positions = Downsample.lttb(timestamps, columns['internal'], n)
+            result[name] = { field: values[positions] for field, values in columns.items() }
+        return result
@@ -0,0 +1,279 @@
+import os
+import json
+import time
+import struct
+import threading
+
+import numpy as np
+
+class CookLog:
+    """Append-only on-disk log of the current cook.
+
+    Smoker readings, start/stop markers and PID state go to a file of
+    fixed-width binary records (RECORD / RECORD_DTYPE) after an 8 byte
+    header; Meater measurements go to a JSON-lines file.  Every write is
+    flushed to the OS, so a crash of the process loses nothing, and a
+    background thread fsyncs the files every fsync_interval seconds
+    (when something was written) to bound the SD card traffic; a power
+    cut can lose up to that much.  The fsync never runs on the caller's
+    thread, which is the control engine's for readings.
+
+    Logging must never stop control, so a failed write (a full or
+    failing SD card) is logged and counted in `errors`, and the files
+    are reopened for the next write.
+
+    On startup recover() reads the files back so the monitors can
+    rebuild their history.  rotate() hands a finished cook to the
+    CookArchive (or, without one or if archiving fails, moves its files
+    into cooks/) and starts new files.
+    """
+
+    MAGIC = b'SMKLOG1\n'
+
+    READING = 1
+    START = 2
+    STOP = 3
+    PID_STATE = 4
+
+    # type, heating, index, timestamp_ms, temp, target, delta, one_min_temp.
+    # PID_STATE records store integral, previous error and previous
+    # filtered derivative in the temp, target and delta fields.
+    RECORD = struct.Struct('<Bbqqdddd')
+    RECORD_DTYPE = np.dtype([('type', 'u1'), ('heating', 'i1'),
+                             ('index', '<i8'), ('timestamp_ms', '<i8'),
+                             ('temp', '<f8'), ('target', '<f8'),
+                             ('delta', '<f8'), ('one_min_temp', '<f8')])
+
+    def __init__(self, directory: str, fsync_interval: float = 5.0, archive=None):
+        self.directory = directory
+        self.fsync_interval = fsync_interval
+        self.archive = archive
+        self.smoker_path = os.path.join(directory, 'smoker.log')
+        self.meater_path = os.path.join(directory, 'meater.jsonl')
+        self.cooks_directory = os.path.join(directory, 'cooks')
+        os.makedirs(self.cooks_directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.errors = 0
+        self._open()
+
+        self._closed = threading.Event()
+        self._sync_thread = threading.Thread(target=self._sync_periodically, name='cook-log-sync', daemon=True)
+        self._sync_thread.start()
+
+    def _open(self):
+        # Drop a torn record left by a crash mid-write, or every record
+        # appended after it would be misaligned
+        if os.path.exists(self.smoker_path):
+            size = os.path.getsize(self.smoker_path)
+            torn = (size - len(self.MAGIC)) % self.RECORD_DTYPE.itemsize
+            if size > len(self.MAGIC) and torn:
+                os.truncate(self.smoker_path, size - torn)
+
+        self._smoker = open(self.smoker_path, 'ab')
+        if self._smoker.tell() == 0:
+            self._smoker.write(self.MAGIC)
+            self._smoker.flush()
+        self._meater = open(self.meater_path, 'a', encoding='utf-8')
+
+    def close(self):
+        self._closed.set()
+        self._sync_thread.join()
+        with self._lock:
+            self._sync()
+            self._smoker.close()
+            self._meater.close()
+
+    def _sync(self):
+        self._smoker.flush()
+        self._meater.flush()
+        os.fsync(self._smoker.fileno())
+        os.fsync(self._meater.fileno())
+        self._dirty = False
+
+    def _sync_periodically(self):
+        while not self._closed.wait(self.fsync_interval):
+            with self._lock:
+                if not self._dirty or self._smoker.closed:
+                    continue
+                # fsync copies of the descriptors outside the lock, so
+                # appends don't wait on the card (or on rotate closing
+                # the files)
+                fds = [os.dup(self._smoker.fileno()), os.dup(self._meater.fileno())]
+                self._dirty = False
+            try:
+                for fd in fds:
+                    os.fsync(fd)
+            except OSError as e:
+                self._failed('syncing', e)
+            finally:
+                for fd in fds:
+                    os.close(fd)
+
+    def _failed(self, action, error):
+        self.errors += 1
+        print(f'############## Error {action} the cook log:  {error!r}')
+
+    def _write(self, f, data):
+        """Write and flush to the OS.  Called with the lock held."""
+        try:
+            f.write(data)
+            f.flush()
+            self._dirty = True
+        except (OSError, ValueError) as e:
+            self._failed('writing', e)
+            # Start over on fresh files; _open drops a partly written
+            # record so the ones after it stay aligned
+            for log in (self._smoker, self._meater):
+                try:
+                    log.close()
+                except (OSError, ValueError):
+                    pass
+            try:
+                self._open()
+            except OSError as e:
+                self._failed('reopening', e)
+
+    def _append(self, *fields):
+        with self._lock:
+            self._write(self._smoker, self.RECORD.pack(*fields))
+
+    def append_reading(self, index, timestamp_ms, temp, target, delta, one_min_temp, heating):
+        self._append(self.READING, heating, index, timestamp_ms, temp, target, delta, one_min_temp)
+
+    def append_pid_state(self, integral, previous_error, previous_filtered_derivative):
+        self._append(self.PID_STATE, 0, 0, int(time.time() * 1000),
+                     integral, previous_error, previous_filtered_derivative, 0.0)
+
+    def mark_start(self):
+        self._append(self.START, 0, 0, int(time.time() * 1000), 0.0, 0.0, 0.0, 0.0)
+        self._sync_now()
+
+    def mark_stop(self):
+        self._append(self.STOP, 0, 0, int(time.time() * 1000), 0.0, 0.0, 0.0, 0.0)
+        self._sync_now()
+
+    def _sync_now(self):
+        with self._lock:
+            try:
+                self._sync()
+            except (OSError, ValueError) as e:
+                self._failed('syncing', e)
+
+    def append_meater(self, data: dict):
+        with self._lock:
+            self._write(self._meater, json.dumps(data) + '\n')
+
+    def records(self, path=None) -> np.ndarray:
+        """Every complete record in a smoker log, memory-mapped.  A torn
+        record at the end (from a crash mid-write) is ignored."""
+        path = path or self.smoker_path
+        with self._lock:
+            if path == self.smoker_path:
+                self._smoker.flush()
+        return self._read_records(path)
+
+    def _read_records(self, path):
+        size = os.path.getsize(path) - len(self.MAGIC)
+        count = max(size, 0) // self.RECORD_DTYPE.itemsize
+        if count == 0:
+            return np.zeros(0, dtype=self.RECORD_DTYPE)
+        with open(path, 'rb') as f:
+            if f.read(len(self.MAGIC)) != self.MAGIC:
+                raise ValueError(f'{path} is not a cook log')
+        return np.memmap(path, dtype=self.RECORD_DTYPE, mode='r',
+                         offset=len(self.MAGIC), shape=(count,))
+
+    def meater_records(self, path=None) -> list:
+        """Every complete Meater measurement in a Meater log"""
+        path = path or self.meater_path
+        with self._lock:
+            if path == self.meater_path:
+                self._meater.flush()
+        return self._read_meater(path)
+
+    def _read_meater(self, path):
+        measurements = []
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    measurements.append(json.loads(line))
+                except ValueError:
+                    # A torn line from a crash mid-write
+                    pass
+        return measurements
+
+    def recover(self) -> dict:
+        """What the logs say about the current cook: its readings, the
+        last PID state, and whether it was stopped cleanly"""
+        records = self.records()
+        kinds = records['type']
+        markers = np.nonzero((kinds == self.START) | (kinds == self.STOP))[0]
+        pid_states = np.nonzero(kinds == self.PID_STATE)[0]
+
+        pid_state = None
+        if len(pid_states):
+            last = records[pid_states[-1]]
+            pid_state = (float(last['temp']), float(last['target']), float(last['delta']))
+
+        return {
+            'readings': records[kinds == self.READING],
+            'pid_state': pid_state,
+            'unfinished': len(markers) > 0 and kinds[markers[-1]] == self.START
+        }
+
+    def rotate(self):
+        """Archive the current cook and start new files.  Like a write,
+        a failure is counted rather than raised, so a full card can't
+        stop a cook from starting."""
+        with self._lock:
+            try:
+                self._sync()
+            except (OSError, ValueError) as e:
+                self._failed('syncing', e)
+            for log in (self._smoker, self._meater):
+                try:
+                    log.close()
+                except (OSError, ValueError):
+                    pass
+
+            try:
+                self._retire()
+            except (OSError, ValueError) as e:
+                # The files are left where they are, and the new cook
+                # carries on in them
+                self._failed('rotating', e)
+            try:
+                self._open()
+            except OSError as e:
+                self._failed('reopening', e)
+
+    def _retire(self):
+        """Hand the closed files to the archive, or move them into
+        cooks/ if there's no archive or archiving fails"""
+        size = os.path.getsize(self.smoker_path)
+        if size <= len(self.MAGIC):
+            os.remove(self.smoker_path)
+            os.remove(self.meater_path)
+            return
+
+        if self.archive is not None:
+            try:
+                records = self._read_records(self.smoker_path)
+                self.archive.add(records[records['type'] == self.READING],
+                                 self._read_meater(self.meater_path))
+                del records
+                os.remove(self.smoker_path)
+                os.remove(self.meater_path)
+                return
+            except (OSError, ValueError) as e:
+                # Moving the files needs no space on the card
+                self._failed('archiving', e)
+
+        with open(self.smoker_path, 'rb') as f:
+            f.seek(len(self.MAGIC))
+            first = np.frombuffer(f.read(self.RECORD_DTYPE.itemsize), dtype=self.RECORD_DTYPE)
+        cook_id = str(int(first['timestamp_ms'][0]))
+        os.replace(self.smoker_path, os.path.join(self.cooks_directory, f'{cook_id}.smoker.log'))
+        os.replace(self.meater_path, os.path.join(self.cooks_directory, f'{cook_id}.meater.jsonl'))
@@ -0,0 +1,127 @@
+import asyncio
+from abc import ABC, abstractmethod
+
+class Thermocouple(ABC):
+    """Smoker temperature sensor used by SmokerMonitor"""
+
+    @property
+    @abstractmethod
+    def temperature(self) -> float:
+        """Current temperature in °C"""
+
+    async def read(self) -> float:
+        """Take a reading without blocking the control engine's loop"""
+        return self.temperature
+
+    def details(self) -> dict:
+        return { 'type': type(self).__name__, 'temp': self.temperature }
+
+class HeaterSwitch(ABC):
+    """Switch for the smoker's heating element used by SmokerMonitor"""
+
+    def enable(self):
+        """Allow the switch to be turned on"""
+
+    def disable(self):
+        """Turn the switch off and stop it being switched"""
+
+    @property
+    @abstractmethod
+    def state(self) -> str:
+        """'on' or 'off'"""
+
+    async def get_state(self) -> str:
+        return self.state
+
+    @abstractmethod
+    async def set_state(self, state: str):
+        """Turn the element 'on' or 'off'"""
+
+class MAX31856Thermocouple(Thermocouple):
+    """Type K thermocouple on an Adafruit MAX31856 breakout (SPI, CS on D5)"""
+
+    def __init__(self):
+        # Only importable on the Pi, so imported here rather than at the
+        # top of the module
+        import board
+        import digitalio
+        import adafruit_max31856
+        from adafruit_max31856 import ThermocoupleType
+
+        spi = board.SPI()
+        cs = digitalio.DigitalInOut(board.D5)
+        cs.direction = digitalio.Direction.OUTPUT
+
+        self._module = adafruit_max31856
+        self.sensor = adafruit_max31856.MAX31856(spi, cs, thermocouple_type=ThermocoupleType.K)
+        self.sensor.averaging = 4
+
+    @property
+    def temperature(self) -> float:
+        return self.sensor.temperature
+
+    async def read(self) -> float:
+        # Reading the MAX31856 waits for a conversion, so keep it off
+        # the event loop
+        return await asyncio.to_thread(lambda: self.sensor.temperature)
+
+    def details(self) -> dict:
+        """Report back the details of the thermocouple in a dict structure"""
+        ThermocoupleType = self._module.ThermocoupleType
+        raw_type = self.sensor._read_register(self._module._MAX31856_CR1_REG, 1)[0]
+        raw_type &= 0x0F
+
+        type = 'K'
+        if raw_type == ThermocoupleType.B:
+            type = 'B'
+        elif raw_type == ThermocoupleType.E:
+            type = 'E'
+        elif raw_type == ThermocoupleType.J:
+            type = 'J'
+        elif raw_type == ThermocoupleType.K:
+            type = 'K'
+        elif raw_type == ThermocoupleType.N:
+            type = 'N'
+        elif raw_type == ThermocoupleType.R:
+            type = 'R'
+        elif raw_type == ThermocoupleType.S:
+            type = 'S'
+        elif raw_type == ThermocoupleType.T:
+            type = 'T'
+        elif raw_type == ThermocoupleType.G8:
+            type = 'G8'
+        elif raw_type == ThermocoupleType.G32:
+            type = 'G32'
+        else:
+            type = 'K'
+
+        return {
+            'type': type,
+            'temp': self.sensor.temperature,
+            'temp_thresholds': self.sensor.temperature_thresholds,
+            'ref_temp': self.sensor.reference_temperature,
+            'ref_temp_thresholds': self.sensor.reference_temperature_thresholds,
+            'faults': self.sensor.fault
+        }
+
+class HASSSwitch(HeaterSwitch):
+    """The Home Assistant switch entity of a HASSTempSender"""
+
+    def __init__(self, hass_sender):
+        self.hass_sender = hass_sender
+
+    def enable(self):
+        self.hass_sender.enable()
+
+    def disable(self):
+        self.hass_sender.disable()
+
+    @property
+    def state(self) -> str:
+        return self.hass_sender.get_switch_state()
+
+    async def get_state(self) -> str:
+        return await asyncio.to_thread(self.hass_sender.get_switch_state)
+
+    async def set_state(self, state: str):
+        await asyncio.to_thread(self.hass_sender.switch, state)
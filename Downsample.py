@@ -0,0 +1,54 @@
+import numpy as np
+
+def lttb(x, y, threshold: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets downsampling.
+
+    Returns the (sorted) positions of at most threshold points of the
+    series that keep its visual shape.  The first and last points are
+    always kept, so a threshold below 3 is taken as 3.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    threshold = max(threshold, 3)
+    if threshold >= n:
+        return np.arange(n)
+
+    # Split the points between the first and last into threshold - 2
+    # buckets and work out the average point of each one up front.
+    buckets = threshold - 2
+    edges = np.linspace(1, n - 1, buckets + 1).astype(np.int64)
+    counts = np.diff(edges)
+    avg_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1) / counts
+    avg_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1) / counts
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(buckets):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 1 < buckets:
+            cx, cy = avg_x[i + 1], avg_y[i + 1]
+        else:
+            cx, cy = x[n - 1], y[n - 1]
+
+        # Pick the point in this bucket forming the largest triangle
+        # with the previously chosen point and the next bucket's average
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+
+    return selected
+
+def transitions(values) -> np.ndarray:
+    """Positions on both sides of every change in value"""
+    changes = np.nonzero(np.diff(np.asarray(values)))[0]
+    return np.union1d(changes, changes + 1)
+
+def points_for_bucket(timestamps_ms, bucket_ms: int) -> int:
+    """Number of points that gives roughly one point per bucket_ms"""
+    if len(timestamps_ms) == 0 or bucket_ms <= 0:
+        return len(timestamps_ms)
+    span = int(timestamps_ms[-1]) - int(timestamps_ms[0])
+    return span // bucket_ms + 1
@@ -0,0 +1,86 @@
+import json
+import queue
+import threading
+
+class EventStream:
+    """Fan-out of server-sent events to every connected client.
+
+    Each event is serialized once, when it's published, and the same
+    bytes are queued for every subscriber.  A client that falls
+    max_backlog events behind is disconnected; the browser's
+    EventSource reconnects and the page catches up from the history
+    endpoints.
+
+    Each client holds a server thread for as long as it's connected, so
+    with max_clients set, subscribe() turns away clients past that many.
+    """
+
+    def __init__(self, serializer=json.dumps, max_backlog: int = 1000, max_clients: int = None):
+        self._serializer = serializer
+        self._max_backlog = max_backlog
+        self.max_clients = max_clients
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._published = 0
+
+    def subscribe(self):
+        """A queue of the client's messages, or None if there are
+        already max_clients"""
+        subscriber = queue.Queue(maxsize=self._max_backlog)
+        with self._lock:
+            if self.max_clients is not None and len(self._subscribers) >= self.max_clients:
+                return None
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: queue.Queue):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, event: str, data):
+        """Send an event to every subscriber.  Never blocks."""
+        message = f'event: {event}\ndata: {self._serializer(data)}\n\n'.encode('utf-8')
+
+        with self._lock:
+            subscribers = list(self._subscribers)
+            self._published += 1
+
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                print('Event stream client is too far behind; disconnecting it')
+                self.unsubscribe(subscriber)
+                # Make room for the end-of-stream marker
+                try:
+                    subscriber.get_nowait()
+                except queue.Empty:
+                    pass
+                subscriber.put_nowait(None)
+
+    def messages(self, subscriber: queue.Queue, keep_alive: float = 15.0):
+        """Generator of the messages for one client, suitable for a
+        streaming response.  Sends a comment line every keep_alive
+        seconds so proxies don't close an idle connection."""
+        try:
+            yield b': connected\n\n'
+            while True:
+                try:
+                    message = subscriber.get(timeout=keep_alive)
+                except queue.Empty:
+                    yield b': keep-alive\n\n'
+                    continue
+                if message is None:
+                    return
+                yield message
+        finally:
+            self.unsubscribe(subscriber)
+
+    @property
+    def clients(self) -> int:
+        with self._lock:
+            return len(self._subscribers)
+
+    @property
+    def published(self) -> int:
+        return self._published
@@ -5,30 +5,126 @@ import time
 import json
 
 import sys
+import ssl
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
-from requests import post, get
+from requests import Session
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from requests.exceptions import SSLError
 from requests.exceptions import ConnectionError
 from requests.exceptions import ReadTimeout
 from requests.exceptions import ConnectTimeout
 
+import aiohttp
+
 from Temp import TempMeasurement
 
 from pprint import pprint
 
 class HASSTempSender:
-    def __init__(self, server: str, port: int, token: str):
+    def __init__(self, server: str, port: int, token: str,
+                 ca_bundle: str = '/home/pi/cacert.pem',
+                 pool_size: int = 6,
+                 retries: int = 3,
+                 backoff_factor: float = 0.5,
+                 publish_deadline: float = 10.0,
+                 resend_after: float = 300.0,
+                 state_ttl: float = 10.0):
         self.server = server
         self.token = token
         self.port = port
         self._enabled = True
 
+        self.ca_bundle = ca_bundle
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        # Built here rather than on first use, as the publish workers
+        # would otherwise race to build one each
+        self._session = self._new_session()
+
+        # Sensor publishing
+        self.publish_deadline = publish_deadline
+        self.resend_after = resend_after
+        self._executor = None
+        self._stats_lock = threading.Lock()
+        self._last_published = {}
+        self._publish_stats = {}
+        # Each sensor's latest POST, so a sensor is never sent again
+        # while HASS is still working on the last one
+        self._in_flight = {}
+
+        # Switch state cache, kept current by the websocket
+        # subscription and refreshed by polling (at most every
+        # state_ttl seconds) while the socket is down
+        self.state_ttl = state_ttl
+        self._entity = None
+        self._switch_state = None
+        self._switch_state_at = None
+        self._state_lock = threading.Lock()
+        self._ws_connected = False
+        self._ws_thread = None
+        self._ws_loop = None
+        self._ws_task = None
+
+    def _new_session(self) -> Session:
+        # Switch and state updates are idempotent, so POSTs can be
+        # retried along with GETs.  Read timeouts aren't (and read=False
+        # raises them as a ReadTimeout): each already waits up to 120 s,
+        # and the heater waits on switch().
+        retry = Retry(total=self.retries,
+                      read=False,
+                      backoff_factor=self.backoff_factor,
+                      status_forcelist=(502, 503, 504),
+                      allowed_methods=frozenset(['GET', 'POST']),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=self.pool_size,
+                              max_retries=retry)
+
+        session = Session()
+        session.mount('https://', adapter)
+        session.headers.update(self.headers())
+        session.verify = self.ca_bundle
+        # Otherwise REQUESTS_CA_BUNDLE/CURL_CA_BUNDLE in the
+        # environment take precedence over session.verify.  HASS is
+        # on the local network, so proxies aren't wanted either.
+        session.trust_env = False
+        return session
+
+    @property
+    def session(self) -> Session:
+        """Keep-alive session shared by every call to HASS"""
+        return self._session
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """Worker threads used to publish the sensor states concurrently"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.pool_size,
+                                                thread_name_prefix='hass-publish')
+        return self._executor
+
+    def close(self):
+        """Close the pooled connections to HASS"""
+        self.stop_state_subscription()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        # A closed session opens new connections if it's used again
+        self._session.close()
+
     @property
     def entity(self) -> str:
         return self._entity
 
     @entity.setter
     def entity(self, entity_name: str):
+        if entity_name != self._entity:
+            self._set_switch_state(None)
         self._entity = entity_name
 
     def enable(self):
@@ -43,8 +139,7 @@ class HASSTempSender:
     def headers(self):
         return {
             'Authorization': f'Bearer {self.token}',
-            'content-type': 'application/json',
-            'Connection': 'close'
+            'content-type': 'application/json'
         }
 
     def switch(self, action: str):
@@ -53,12 +148,10 @@ class HASSTempSender:
             print(f'HASSTempSender {self.entity} action {action}')
             url = f'https://{self.server}:{self.port}/api/services/switch/turn_{action}'
             try:
-                response = post(url,
-                                headers=self.headers(),
-                                data=json.dumps( { "entity_id": self.entity } ),
-                                verify='/home/pi/cacert.pem',
-                                timeout=(10,120)
-                                )
+                response = self.session.post(url,
+                                             data=json.dumps( { "entity_id": self.entity } ),
+                                             timeout=(10,120)
+                                             )
                 # print(f'Response code = {response.status_code}')
                 status_code = int(response.status_code)
                 if status_code >= 300 or status_code < 200:
@@ -66,25 +159,45 @@ class HASSTempSender:
                     print('-------------')
                     print(response.text)
                     print('-------------')
-            except Exeption as e:
+                else:
+                    # Assume the call worked; the state_changed event
+                    # (or the next poll) corrects it if it didn't
+                    self._set_switch_state(action)
+            except Exception as e:
                 print(f'############## Error calling switch API:  {url}:')
                 print(e)
                 pass
 
     def get_switch_state(self):
+        """Retrieve the switch's current state, from the cache when it's fresh"""
+        with self._state_lock:
+            state, state_at = self._switch_state, self._switch_state_at
+        if state is not None:
+            if self._ws_connected or time.monotonic() - state_at < self.state_ttl:
+                return state
+
+        state = self._poll_switch_state()
+        if state is not None:
+            self._set_switch_state(state)
+        return state
+
+    def _set_switch_state(self, state):
+        with self._state_lock:
+            self._switch_state = state
+            self._switch_state_at = time.monotonic()
+
+    def _poll_switch_state(self):
         """Retrieve the switch's current state from HASS"""
         # print(f'HASSTempSender {self.entity} state')
 
         url = f'https://{self.server}:{self.port}/api/states/{self.entity}'
         try:
-            response = get(url,
-                           headers=self.headers(),
-                           verify='/home/pi/cacert.pem',
-                           timeout=(10,120)
-                           )
+            response = self.session.get(url,
+                                        timeout=(10,120)
+                                        )
             # print(f'Response code = {response.status_code}')
             status_code = int(response.status_code)
-            if status_code >= 200 or status_code < 300:
+            if status_code >= 200 and status_code < 300:
                 data = json.loads(response.text)
                 # print('Data:')
                 # pprint(data)
@@ -100,6 +213,100 @@ class HASSTempSender:
             print(e)
             pass
 
+    def start_state_subscription(self):
+        """Follow switch state changes over the HASS websocket API"""
+        if self._ws_thread is not None:
+            return
+        self._ws_thread = threading.Thread(target=self._run_state_subscription,
+                                           name='hass-websocket', daemon=True)
+        self._ws_thread.start()
+
+    def stop_state_subscription(self):
+        loop, task = self._ws_loop, self._ws_task
+        if loop is not None and task is not None:
+            try:
+                loop.call_soon_threadsafe(task.cancel)
+            except RuntimeError:
+                # The loop has already been closed
+                pass
+        if self._ws_thread is not None:
+            self._ws_thread.join()
+            self._ws_thread = None
+
+    def _run_state_subscription(self):
+        async def run():
+            self._ws_loop = asyncio.get_running_loop()
+            self._ws_task = asyncio.current_task()
+            try:
+                await self._subscribe_states()
+            except asyncio.CancelledError:
+                pass
+            finally:
+                self._ws_connected = False
+                self._ws_loop = None
+                self._ws_task = None
+
+        asyncio.run(run())
+
+    async def _subscribe_states(self):
+        """Keep a state_changed subscription open, reconnecting with backoff"""
+        url = f'wss://{self.server}:{self.port}/api/websocket'
+        delay = 1
+
+        async with aiohttp.ClientSession() as session:
+            while True:
+                # Anything going wrong, including a CA bundle that can't
+                # be read yet, ends in a reconnect rather than ending the
+                # subscription
+                try:
+                    ssl_context = ssl.create_default_context(cafile=self.ca_bundle)
+                    async with session.ws_connect(url, ssl=ssl_context, heartbeat=30) as ws:
+                        await self._authenticate_ws(ws)
+                        await ws.send_json({ 'id': 1,
+                                             'type': 'subscribe_events',
+                                             'event_type': 'state_changed' })
+
+                        # The socket only reports changes, so seed the
+                        # cache with the state as of now
+                        state = await asyncio.to_thread(self._poll_switch_state)
+                        if state is not None:
+                            self._set_switch_state(state)
+                        self._ws_connected = True
+                        delay = 1
+
+                        async for message in ws:
+                            if message.type != aiohttp.WSMsgType.TEXT:
+                                break
+                            try:
+                                self._handle_ws_message(json.loads(message.data))
+                            except (ValueError, KeyError, TypeError, AttributeError) as err:
+                                print(f'Ignoring a malformed HASS websocket message:  {err!r}')
+                except Exception as err:
+                    print(f'HASS websocket error:  {err!r}')
+
+                self._ws_connected = False
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60)
+
+    async def _authenticate_ws(self, ws):
+        message = await ws.receive_json()
+        if message.get('type') == 'auth_required':
+            await ws.send_json({ 'type': 'auth', 'access_token': self.token })
+            message = await ws.receive_json()
+        if message.get('type') != 'auth_ok':
+            raise PermissionError(f'HASS websocket authentication failed: {message}')
+
+    def _handle_ws_message(self, message):
+        if message.get('type') == 'result' and not message.get('success'):
+            print(f'HASS websocket subscription failed: {message}')
+        if message.get('type') != 'event':
+            return
+
+        data = message['event'].get('data', {})
+        new_state = data.get('new_state')
+        if data.get('entity_id') == self._entity and new_state is not None:
+            self._set_switch_state(new_state['state'])
+
     @property
     def sensor(self) -> str:
         return self._sensor
@@ -156,51 +363,104 @@ class HASSTempSender:
                 } } ]
 
             ]
-        connection_errors = 0
-        other_errors = 0
-        connect_timeouts = 0
-        read_timeouts = 0
-        os_errors = 0
-        payload_count = 0
-
-        for payload in payloads:
-            try:
-                #print('.')
-                response = post(f'https://{self.server}:{self.port}/api/states/' + payload[0],
-                                headers=self.headers(),
-                                data=json.dumps(payload[1]),
-                                verify='/home/pi/cacert.pem',
-                                timeout=(10,120))
-                if response.status_code != 200:
-                    print(f'Status Code: {response.status_code} - {response.reason}')
-                    print('----------')
-                    print(response.text)
-                    print('----------')
-                # print('Request: {}\n{}: {}'.format(json.dumps(payload[1]), response.status_code, response.text))
-                payload_count = payload_count + 1
-                # print(response.text)
-            except ConnectionError as err:
-                print('New Connection Error: {}'.format(err))
-                connection_errors = connection_errors + 1
-                pass
-            except ReadTimeout as err:
-                print('Connect Timeout: {}'.format(err))
-                connect_timeouts = connect_timeouts + 1
-                pass
-            except ConnectTimeout as err:
-                print('Read Timeout: {}'.format(err))
-                read_timeouts = read_timeouts + 1
-                pass
-            except SSLError as err:
-                print('SSL Error:  {}'.format(err))
-                ssl_errors = ssl_errors + 1
-                pass
-            except OSError as err:
-                print('OS Error:  {}'.format(err))
-                os_errors = os_errors + 1
-                pass
-            except:
-                print('########### Error encountered:  {}'.format(sys.exc_info()[0]))
-                # Continue on and try again
-                other_errors = other_errors + 1
-                pass
+
+        # Only send the sensors whose value changed, unless HASS hasn't
+        # heard about the sensor for resend_after seconds.
+        sent_at = time.monotonic()
+        futures = {}
+        for entity_id, payload in payloads:
+            last = self._last_published.get(entity_id)
+            if last is not None and last[0] == payload['state'] and sent_at - last[1] < self.resend_after:
+                self._record(entity_id, 'skipped')
+                continue
+            # While HASS is slow, wait for the sensor's last POST rather
+            # than queueing more behind it.  The next publish after it
+            # finishes sends the newest value.
+            in_flight = self._in_flight.get(entity_id)
+            if in_flight is not None and not in_flight.done():
+                self._record(entity_id, 'in_flight')
+                continue
+            future = self.executor.submit(self._post_state, entity_id, payload)
+            self._in_flight[entity_id] = future
+            futures[future] = entity_id
+
+        done, not_done = wait(futures, timeout=self.publish_deadline)
+        for future in not_done:
+            # The request carries on in the background and its outcome
+            # is recorded when it finishes; a late success still
+            # updates the last published value.
+            print(f'Publish deadline exceeded for {futures[future]}')
+
+    def _post_state(self, entity_id: str, payload: dict):
+        """Send one sensor state to HASS and record the outcome"""
+        start = time.monotonic()
+        try:
+            response = self.session.post(f'https://{self.server}:{self.port}/api/states/' + entity_id,
+                                         data=json.dumps(payload),
+                                         timeout=(10,120))
+            latency = time.monotonic() - start
+            if response.status_code not in (200, 201):
+                print(f'Status Code: {response.status_code} - {response.reason}')
+                print('----------')
+                print(response.text)
+                print('----------')
+                self._record(entity_id, 'http_errors', latency)
+                return
+
+            with self._stats_lock:
+                self._last_published[entity_id] = (payload['state'], start)
+            self._record(entity_id, 'published', latency)
+        # SSLError and ConnectTimeout are subclasses of ConnectionError,
+        # so they have to be caught first.
+        except SSLError as err:
+            print('SSL Error:  {}'.format(err))
+            self._record(entity_id, 'ssl_errors')
+        except ConnectTimeout as err:
+            print('Connect Timeout: {}'.format(err))
+            self._record(entity_id, 'connect_timeouts')
+        except ReadTimeout as err:
+            print('Read Timeout: {}'.format(err))
+            self._record(entity_id, 'read_timeouts')
+        except ConnectionError as err:
+            print('New Connection Error: {}'.format(err))
+            self._record(entity_id, 'connection_errors')
+        except OSError as err:
+            print('OS Error:  {}'.format(err))
+            self._record(entity_id, 'os_errors')
+        except:
+            print('########### Error encountered:  {}'.format(sys.exc_info()[0]))
+            self._record(entity_id, 'other_errors')
+
+    def _record(self, entity_id: str, outcome: str, latency: float = None):
+        with self._stats_lock:
+            stats = self._publish_stats.setdefault(entity_id, {
+                'published': 0,
+                'skipped': 0,
+                'in_flight': 0,
+                'errors': {},
+                'last_latency_ms': None,
+                'max_latency_ms': None,
+                'total_latency_ms': 0.0
+            })
+            if outcome in ('published', 'skipped', 'in_flight'):
+                stats[outcome] += 1
+            else:
+                stats['errors'][outcome] = stats['errors'].get(outcome, 0) + 1
+
+            if latency is not None:
+                latency_ms = latency * 1000
+                stats['last_latency_ms'] = latency_ms
+                stats['max_latency_ms'] = max(stats['max_latency_ms'] or 0.0, latency_ms)
+                stats['total_latency_ms'] += latency_ms
+
+    @property
+    def publish_stats(self) -> dict:
+        """Per-sensor publish counters and latencies"""
+        with self._stats_lock:
+            result = {}
+            for entity_id, stats in self._publish_stats.items():
+                requests = stats['published'] + stats['errors'].get('http_errors', 0)
+                result[entity_id] = dict(stats,
+                                         errors=dict(stats['errors']),
+                                         mean_latency_ms=(stats['total_latency_ms'] / requests) if requests else None)
+            return result
@@ -0,0 +1,139 @@
+import zlib
+import struct
+import threading
+from bisect import bisect_right
+
+class SerializedHistory:
+    """Append-only cache of the serialized temperature history.
+
+    Every reading is encoded to JSON once, the first time a request
+    needs it, and full-history responses are assembled by joining the
+    cached rows.  Rows are grouped into chunks of CHUNK_ROWS; once a
+    chunk is full it's also compressed once into a raw deflate segment
+    ending on a sync flush, so a gzip response is just a header, the
+    stored segments (separated by a stored ',' segment), the compressed
+    tail and a trailer.
+
+    When the history drops old readings (see TempHistory max_readings)
+    the cache drops the chunks that are entirely older, so it holds at
+    most one chunk more than the history.
+    """
+
+    CHUNK_ROWS = 256
+
+    # gzip header: magic, deflate, no flags, no mtime, no extra flags, unknown OS
+    GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+
+    def __init__(self, temp_history, serializer, compresslevel: int = 6):
+        self._temp_history = temp_history
+        self._serializer = serializer
+        self._compresslevel = compresslevel
+        self._open_segment = self._segment(b'[')
+        self._comma_segment = self._segment(b',')
+        self._lock = threading.Lock()
+        self._reset(temp_history.generation)
+
+    def _segment(self, data):
+        compressor = zlib.compressobj(self._compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def _reset(self, generation):
+        self._generation = generation
+        # When the cook's first reading was taken.  Generations start
+        # over with the process, so this keeps another cook's ETag (from
+        # before a restart) from matching.
+        self._started_ms = None
+        self._rows = []
+        self._indexes = []
+        self._chunks = []
+        # CRC-32 and length of the uncompressed bytes up to the end of
+        # the closed chunks, starting with the '['
+        self._crc = zlib.crc32(b'[')
+        self._size = 1
+
+    def sync(self):
+        """Encode the readings added since the last call"""
+        with self._lock:
+            snapshot = self._temp_history.snapshot
+            if snapshot.generation != self._generation:
+                self._reset(snapshot.generation)
+
+            since = self._indexes[-1] if self._indexes else 0
+            for row in snapshot.temp_history_since(since):
+                if self._started_ms is None:
+                    self._started_ms = row['timestamp_ms']
+                self._rows.append(self._serializer(row).encode('utf-8'))
+                self._indexes.append(row['index'])
+
+                closed_rows = len(self._chunks) * self.CHUNK_ROWS
+                if len(self._rows) - closed_rows == self.CHUNK_ROWS:
+                    self._close_chunk(closed_rows, len(self._rows))
+
+            self._drop_before(snapshot.oldest_index)
+
+    def _piece(self, start, end):
+        """Uncompressed bytes of rows [start, end), with the ',' that
+        separates them from the rows before"""
+        if start == end:
+            return b''
+        return (b'' if start == 0 else b',') + b','.join(self._rows[start:end])
+
+    def _close_chunk(self, start, end):
+        chunk = b','.join(self._rows[start:end])
+        self._chunks.append(self._segment(chunk))
+        piece = chunk if start == 0 else b',' + chunk
+        self._crc = zlib.crc32(piece, self._crc)
+        self._size += len(piece)
+
+    def _drop_before(self, oldest_index):
+        """Drop the closed chunks whose rows are all older than oldest_index"""
+        dropped = 0
+        while dropped < len(self._chunks) and self._indexes[(dropped + 1) * self.CHUNK_ROWS - 1] < oldest_index:
+            dropped += 1
+        if dropped == 0:
+            return
+
+        del self._chunks[:dropped]
+        del self._rows[:dropped * self.CHUNK_ROWS]
+        del self._indexes[:dropped * self.CHUNK_ROWS]
+        self._crc = zlib.crc32(b'[')
+        self._size = 1
+        for chunk in range(len(self._chunks)):
+            piece = self._piece(chunk * self.CHUNK_ROWS, (chunk + 1) * self.CHUNK_ROWS)
+            self._crc = zlib.crc32(piece, self._crc)
+            self._size += len(piece)
+
+    @property
+    def etag(self) -> str:
+        """Changes whenever a reading is added or the history is
+        cleared, and differs between cooks"""
+        with self._lock:
+            latest = self._indexes[-1] if self._indexes else 0
+            return f'{self._started_ms or 0}-{self._generation}-{latest}'
+
+    def body(self, since_index=None) -> bytes:
+        """The JSON array of every reading (after since_index)"""
+        with self._lock:
+            start = 0 if since_index is None else bisect_right(self._indexes, since_index)
+            if start == len(self._rows):
+                return b'[]'
+            return b'[' + b','.join(self._rows[start:]) + b']'
+
+    def gzip_body(self) -> bytes:
+        """The full history as a gzip stream, reusing the compressed chunks"""
+        with self._lock:
+            closed_rows = len(self._chunks) * self.CHUNK_ROWS
+            tail = self._piece(closed_rows, len(self._rows)) + b']'
+            compressor = zlib.compressobj(self._compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+            compressed_tail = compressor.compress(tail) + compressor.flush(zlib.Z_FINISH)
+            crc = zlib.crc32(tail, self._crc)
+            size = self._size + len(tail)
+
+            segments = [self.GZIP_HEADER, self._open_segment]
+            for i, chunk in enumerate(self._chunks):
+                if i:
+                    segments.append(self._comma_segment)
+                segments.append(chunk)
+            segments.append(compressed_tail)
+            segments.append(struct.pack('<II', crc, size & 0xffffffff))
+            return b''.join(segments)
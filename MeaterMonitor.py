@@ -1,57 +1,177 @@
 from datetime import datetime
 import pytz
 
-from meater import MeaterApi
+from meater import MeaterApi, AuthenticationError
 import aiohttp
 import asyncio
 
-import time
 import threading
+from bisect import bisect_right
 import json
 
 from pprint import pprint
 
+import numpy as np
+import Downsample
+
 # from MQTTPublisher import MQTTPublisher
 from HASSTempSender import HASSTempSender
 from Temp import TempHistory
 
-class MeaterHistory:
-    def __init__(self):
-        self._index = 0
-        self._measurements = {}
-        self._cooks = {}
+class MeaterSnapshot:
+    """A consistent, unchanging view of a MeaterHistory.
+
+    Holds each cook's measurement and index lists along with how many of
+    them it covers.  The history only appends to those lists and
+    replaces them (rather than deleting from them) when trimming or
+    clearing, so the first `count` entries never change.
+    """
+
+    def __init__(self, cooks, measurements):
+        self._cooks = cooks
+        # cook id -> (measurements, indexes, count)
+        self._measurements = measurements
 
     @property
     def cooks(self):
         return self._cooks
 
+    def _each(self, since_index=None):
+        """(cook id, measurements) for each cook, after since_index"""
+        for k, (measurements, indexes, count) in self._measurements.items():
+            # Each cook's indexes are increasing, so bisect to the first
+            # new measurement rather than filtering the whole list.
+            start = 0 if since_index is None else bisect_right(indexes, since_index, 0, count)
+            yield k, measurements[start:count]
+
+    @property
+    def history(self):
+        return { k: [x.data for x in v] for k, v in self._each() }
+
+    def history_since(self, since_index):
+        return { k: [x.data for x in v] for k, v in self._each(since_index) }
+
+    def columns(self, since_index=-1):
+        """Each cook's measurements (after since_index) as one array
+        per numeric field, for the compact wire formats"""
+        def f(v):
+            return {
+                'index': np.array([x.index for x in v], dtype=np.int64),
+                'timestamp_ms': np.array([x.timestamp_ms for x in v], dtype=np.float64),
+                'internal': np.array([x.internal for x in v], dtype=np.float64),
+                'ambient': np.array([x.ambient for x in v], dtype=np.float64),
+                'target_temp': np.array([x.target_temp for x in v], dtype=np.float64)
+            }
+
+        return { k: f(v) for k, v in self._each(since_index) }
+
+    def history_downsampled(self, points=None, bucket_ms=None):
+        """Each cook's history reduced to about `points` measurements (or
+        one per bucket_ms) with Largest-Triangle-Three-Buckets on the
+        internal temperature."""
+        def f(v):
+            timestamps = np.array([x.timestamp_ms for x in v], dtype=np.float64)
+            internal = np.array([x.internal for x in v], dtype=np.float64)
+            n = points if points is not None else Downsample.points_for_bucket(timestamps, bucket_ms or 0)
+            return [v[i].data for i in Downsample.lttb(timestamps, internal, n)]
+
+        return { k: f(v) for k, v in self._each() }
+
+class MeaterHistory:
+    """Meater measurements per cook.  With max_measurements set, each
+    cook keeps only about that many of its newest measurements.
+
+    Measurements are added by the monitor's thread and read by the HTTP
+    handlers.  After every change the history publishes a
+    MeaterSnapshot, and the reading methods go through the latest one,
+    so readers need no lock."""
+
+    def __init__(self, max_measurements=None):
+        self._max_measurements = max_measurements
+        # Optional CookLog every measurement is appended to
+        self.log = None
+        self.clear()
+
+    def _publish(self):
+        self._snapshot = MeaterSnapshot(self._cooks, {
+            k: (measurements, self._indexes[k], len(measurements))
+            for k, measurements in self._measurements.items()
+        })
+
+    @property
+    def snapshot(self) -> MeaterSnapshot:
+        """The measurements as of now, unaffected by later changes"""
+        return self._snapshot
+
+    @property
+    def cooks(self):
+        return self._snapshot.cooks
+
     def add(self, meater_measurement):
-        if not meater_measurement.cook.id in self._measurements:
-            self._cooks[meater_measurement.cook.id] = meater_measurement.cook.name
-            self._measurements[meater_measurement.cook.id] = []
+        """Add a probe reading and return its measurement, or None if the
+        probe hasn't updated since the last one (the cloud only updates
+        every 15 seconds or so)"""
+        latest = self._measurements.get(meater_measurement.cook.id)
+        if latest and latest[-1].time == meater_measurement.time_updated:
+            return None
 
         measurement = MeaterMeasurement(self._index, meater_measurement)
-        self._measurements[meater_measurement.cook.id].append(measurement)
-        self._index += 1
+        self._append(measurement)
+        self._publish()
+        if self.log is not None:
+            self.log.append_meater(measurement.record)
+        return measurement
+
+    def _append(self, measurement):
+        if not measurement.cook_id in self._measurements:
+            # A new dict, as published snapshots share it
+            self._cooks = { **self._cooks, measurement.cook_id: measurement.cook_name }
+            self._measurements[measurement.cook_id] = []
+            self._indexes[measurement.cook_id] = []
+
+        measurements = self._measurements[measurement.cook_id]
+        indexes = self._indexes[measurement.cook_id]
+        measurements.append(measurement)
+        indexes.append(measurement.index)
+        self._index = measurement.index + 1
+
+        # Trim in blocks so the cost of copying the lists is amortized.
+        # The trimmed lists are new ones; published snapshots keep the old.
+        if self._max_measurements is not None:
+            excess = len(measurements) - self._max_measurements
+            if excess > max(self._max_measurements // 8, 1):
+                self._measurements[measurement.cook_id] = measurements[excess:]
+                self._indexes[measurement.cook_id] = indexes[excess:]
+
+    def restore(self, records):
+        """Rebuild the history from CookLog Meater records, e.g. after a
+        restart in the middle of a cook"""
+        self.clear()
+        for record in records:
+            self._append(MeaterMeasurement.from_record(record))
+        self._publish()
 
     @property
     def history(self):
-        def f(v):
-            return list(map(lambda x: x.data, v))
-
-        return { k: f(v) for k, v in self._measurements.items() }
+        return self._snapshot.history
 
     def history_since(self, since_index):
-        def f(v):
-            filtered_items = filter(lambda x: x.index > since_index, v)
-            return list(map(lambda x: x.data, filtered_items))
+        return self._snapshot.history_since(since_index)
 
-        return { k: f(v) for k, v in self._measurements.items() }
+    def columns(self, since_index=-1):
+        """Each cook's measurements (after since_index) as one array
+        per numeric field, for the compact wire formats"""
+        return self._snapshot.columns(since_index)
+
+    def history_downsampled(self, points=None, bucket_ms=None):
+        return self._snapshot.history_downsampled(points, bucket_ms)
 
     def clear(self):
         self._index = 0
         self._measurements = {}
+        self._indexes = {}
         self._cooks = {}
+        self._publish()
 
 
 class MeaterMeasurement:
@@ -73,19 +193,84 @@ class MeaterMeasurement:
         if hasattr(meater_cook, 'time_elapsed'):
             self._elapsed = meater_cook.time_elapsed
 
+    @classmethod
+    def from_record(cls, record):
+        """Rebuild a measurement from its CookLog record"""
+        measurement = cls.__new__(cls)
+        measurement._index = record['index']
+        measurement._internal = record['internal']
+        measurement._ambient = record['ambient']
+        measurement._time = datetime.fromtimestamp(record['timestamp_ms'] / 1000, pytz.utc)
+        measurement._probe_id = record['probe_id']
+        measurement._cook_id = record['cook_id']
+        measurement._cook_name = record['name']
+        measurement._state = record['state']
+        measurement._target_temp = record['target_temp']
+        measurement._peak_temp = record['peak_temp']
+        if record['remaining'] is not None:
+            measurement._remaining = record['remaining']
+        if record['elapsed'] is not None:
+            measurement._elapsed = record['elapsed']
+        return measurement
+
     @property
     def index(self):
         return self._index
 
+    @property
+    def time(self):
+        return self._time
+
+    @property
+    def cook_id(self):
+        return self._cook_id
+
+    @property
+    def cook_name(self):
+        return self._cook_name
+
+    @property
+    def timestamp_ms(self):
+        return self._time.timestamp()*1000
+
+    @property
+    def internal(self):
+        return self._internal
+
+    @property
+    def ambient(self):
+        return self._ambient
+
+    @property
+    def target_temp(self):
+        return self._target_temp
+
     def __repr__(self):
         return str(self.data)
 
+    @property
+    def record(self):
+        """JSON-ready fields for the CookLog"""
+        return {
+            'index': self._index,
+            'timestamp_ms': self.timestamp_ms,
+            'cook_id': self._cook_id,
+            'probe_id': self._probe_id,
+            'internal': self._internal,
+            'ambient': self._ambient,
+            'name': self._cook_name,
+            'state': self._state,
+            'target_temp': self._target_temp,
+            'peak_temp': self._peak_temp,
+            'remaining': getattr(self, '_remaining', None),
+            'elapsed': getattr(self, '_elapsed', None) }
+
     @property
     def data(self):
         return {
             'index': self._index,
             'time': self._time,
-            'timestamp_ms': self._time.timestamp()*1000,
+            'timestamp_ms': self.timestamp_ms,
             'cook_id': self._cook_id,
             'probe_id': self._probe_id,
             'internal': self._internal,
@@ -102,16 +287,45 @@ class MeaterMonitor:
     def __init__(self,
                  meater_user: str,
                  meater_pass: str,
-                 monitoring_interval:int = 4):
+                 monitoring_interval:int = 4,
+                 cook_log = None,
+                 max_measurements: int = None,
+                 recovered: dict = None):
         self.meater_user = meater_user
         self.meater_pass = meater_pass
 
-        self._history = MeaterHistory()
+        self._history = MeaterHistory(max_measurements)
+        # Set when an unfinished cook was read back from the log, so the
+        # next start() carries on with it instead of clearing it
+        self._resume = False
+        if cook_log is not None:
+            records = cook_log.meater_records()
+            if records:
+                self._history.restore(records)
+                # cook_log.recover()'s result, if the caller has it
+                if recovered is None:
+                    recovered = cook_log.recover()
+                self._resume = recovered['unfinished']
+                print(f'Recovered {len(records)} Meater measurements from the cook log')
+            self._history.log = cook_log
+        # The poller runs as a task on an event loop of its own, kept in
+        # one thread for the life of the monitor so that the HTTP session
+        # (with its open connections) and the Meater token outlive
+        # stop() and start()
+        self._loop = None
+        self._loop_thread = None
+        self._loop_lock = threading.Lock()
+        self._poll_task = None
         self._client_session = None
         self._authenticated = False
         self._meater_api = None
+        self._monitoring = False
         self.monitoring_interval = monitoring_interval
-        self._monitor_thread = None
+        # Wait after a failed poll, doubling on each failure in a row
+        # up to max_backoff seconds
+        self.max_backoff = 300
+        self._failures = 0
+        self._listeners = []
 
     @property
     def monitoring_interval(self):
@@ -130,20 +344,16 @@ class MeaterMonitor:
     def history(self):
         return self._history
 
+    def add_listener(self, listener):
+        """Register a callable(event, data) that is told about each new
+        reading ('meater')"""
+        self._listeners.append(listener)
+
     @property
     def client_session(self):
-        async def cli_sess():
-            return aiohttp.ClientSession()
-
-        if self._client_session is None:
-            self._client_session = asyncio.run(cli_sess())
-
+        """The poller's aiohttp session, or None before the first poll"""
         return self._client_session
 
-    @client_session.setter
-    def client_session(self, session):
-        self._client_session = session
-
     @property
     def authenticated(self):
         return self._authenticated
@@ -169,43 +379,110 @@ class MeaterMonitor:
     def monitoring(self, new_value: bool):
         self._monitoring = new_value
 
+    @property
+    def backoff(self) -> float:
+        """Seconds until the next poll after the latest one"""
+        period = 60/self.monitoring_interval
+        if self._failures == 0:
+            return period
+        # Cap the exponent too, as period * 2 ** failures overflows a
+        # float after 1024 failed polls (a few days of outage)
+        return min(period * 2 ** min(self._failures, 16), self.max_backoff)
+
+    def _event_loop(self):
+        """The monitor's event loop, started in its own thread on first use"""
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(target=self._loop.run_forever, name='meater', daemon=True)
+                self._loop_thread.start()
+            return self._loop
+
+    def _call(self, coroutine):
+        """Run a coroutine on the monitor's loop and wait for it"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._event_loop()).result()
+
     def start(self):
         print('Starting the Meater monitor')
-        if self._monitor_thread is not None:
-            self.monitoring = False
-            self._monitor_thread.join()
+        self._call(self._cancel_poll())
 
-        self._history.clear()
+        if self._resume:
+            self._resume = False
+        else:
+            self._history.clear()
 
         self.monitoring = True
-        self._monitor_thread = threading.Thread(target=self.monitor_meater)
-        self._monitor_thread.start()
+        self._call(self._start_poll())
 
     def stop(self):
+        """Stop polling.  Doesn't wait out the poller's sleep or a
+        request that's under way; both are cancelled."""
         print('Stopping the Meater monitor')
         self.monitoring = False
-        if self._monitor_thread is not None:
-            self._monitor_thread.join()
-
-    def monitor_meater(self):
-        async def monitor():
-            meater_api = None
-            async with aiohttp.ClientSession() as session:
-                if meater_api is None:
-                    meater_api = MeaterApi(session)
-
-                await meater_api.authenticate(self.meater_user,
-                                              self.meater_pass)
-
-                while True:
-                    if self.monitoring == False:
-                        break
+        if self._loop is not None:
+            self._call(self._cancel_poll())
 
-                    await self.get_latest_temps(meater_api)
-
-                    time.sleep(60/self.monitoring_interval)
+    def close(self):
+        """Stop polling, close the session and end the loop's thread"""
+        self.monitoring = False
+        if self._loop is None:
+            return
+        self._call(self._close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop_thread.join()
+        self._loop.close()
+        self._loop = None
+        self._loop_thread = None
+
+    async def _close(self):
+        await self._cancel_poll()
+        if self._client_session is not None:
+            await self._client_session.close()
+            self._client_session = None
+            self._authenticated = False
+
+    async def _start_poll(self):
+        self._failures = 0
+        self._poll_task = asyncio.create_task(self.monitor_meater())
+
+    async def _cancel_poll(self):
+        task = self._poll_task
+        self._poll_task = None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def _session(self):
+        """Meater API on the long-lived session, logged in once and
+        again only if the token is refused"""
+        if self._client_session is None:
+            self._client_session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+            self._meater_api = MeaterApi(self._client_session)
+            self._authenticated = False
+        if not self._authenticated:
+            await self._meater_api.authenticate(self.meater_user,
+                                                self.meater_pass)
+            self._authenticated = True
+        return self._meater_api
 
-        asyncio.run(monitor())
+    async def monitor_meater(self):
+        """Poll the Meater cloud until cancelled, backing off
+        exponentially while it fails"""
+        while self.monitoring:
+            try:
+                await self.get_latest_temps(await self._session())
+                self._failures = 0
+            except AuthenticationError as e:
+                print(f'Meater authentication failed:  {e}')
+                self._authenticated = False
+                self._failures += 1
+            except Exception as e:
+                # Cloud errors (500, 429) and connection failures, and
+                # the MeaterApi raises plain Exceptions for the rest
+                print(f'Meater poll failed:  {e!r}')
+                self._failures += 1
+
+            await asyncio.sleep(self.backoff)
 
     async def get_latest_temps(self, meater_api):
         #     return await api.get_all_devices()
@@ -220,9 +497,15 @@ class MeaterMonitor:
             index = 0
             for probe in probes:
                 if probe.cook is not None:
-                    self._history.add(probe)
-                    print('Meater temps')
-                    pprint(probe.cook)
+                    measurement = self._history.add(probe)
+                    if measurement is not None:
+                        for listener in list(self._listeners):
+                            try:
+                                listener('meater', measurement.data)
+                            except Exception as e:
+                                print(f'############## Error notifying listener:  {e}')
+                        print('Meater temps')
+                        pprint(probe.cook)
                 index += 1
         else:
             print('No meater probes.  Is the block on and connected to WiFi?')
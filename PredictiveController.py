@@ -0,0 +1,97 @@
+import itertools
+
+import numpy as np
+
+class ResponseTables:
+    """Precomputed responses of an FOPDTModel over the horizon.
+
+    The model is linear, so the predicted temperatures for every
+    candidate switch sequence s are
+
+        decay * T_now + offset + past_inputs @ past + forced[s]
+
+    where only the first two terms' inputs change from tick to tick.
+    Everything else is computed once per model.  The sequences are the
+    inputs from the next step on; T[k+1] depends on u[k-delay], so they
+    act from step delay + 1 on, and the horizon is delay + 1 steps
+    longer than they are.
+    """
+
+    def __init__(self, model, sequences: np.ndarray):
+        self.model = model
+        a, b, c = model.a, model.b, model.c
+        known = model.delay + 1
+        steps = known + sequences.shape[1]
+
+        j = np.arange(steps)
+        self.decay = a ** (j + 1)
+        # c * (1 + a + ... + a^j)
+        self.offset = c * np.cumsum(a ** j)
+
+        # Effect on T[j] of an input acting at step i (j >= i):
+        # b * a^(j - i)
+        lag = j[None, :] - j[:, None]
+        impulse = np.where(lag >= 0, b * a ** np.maximum(lag, 0), 0.0)
+
+        # The inputs up to and including the current step's act on the
+        # first delay + 1 steps, and the sequences' after that
+        self.past = impulse[:known, :]
+        self.forced = sequences.astype(np.float64) @ impulse[known:, :]
+
+class PredictiveController:
+    """Receding-horizon on/off controller.
+
+    Every tick, predicts the temperature over the next horizon seconds
+    for each on/off sequence that switches only at block boundaries
+    (2^(horizon/block) sequences), with the cook's learned FOPDTModel.
+    Nothing decided now shows until the model's dead time has passed,
+    so the horizon is stretched to cover the dead time plus at least
+    one block.
+    It picks the one with the least mean squared error from the target
+    plus switch_penalty per switch, and applies its first block.  The
+    response tables are rebuilt only when the model is refit, so a tick
+    is a fixed amount of array work.
+    """
+
+    def __init__(self, horizon: float = 240.0, block: float = 30.0, switch_penalty: float = 0.1):
+        self.horizon = horizon
+        self.block = block
+        self.switch_penalty = switch_penalty
+        self._tables = None
+
+    def _build(self, model):
+        block_steps = max(int(round(self.block / model.step)), 1)
+        # Steps the sequences can still affect within the horizon
+        control_steps = max(int(round(self.horizon / model.step)) - model.delay - 1, block_steps)
+        blocks = -(-control_steps // block_steps)
+
+        choices = np.array(list(itertools.product((0, 1), repeat=blocks)), dtype=np.float64)
+        self._sequences = np.repeat(choices, block_steps, axis=1)[:, :control_steps]
+        self._first = choices[:, 0]
+        self._internal_switches = np.abs(np.diff(choices, axis=1)).sum(axis=1)
+        self._tables = ResponseTables(model, self._sequences)
+
+    def decide(self, temp_history, heating_state: str):
+        """'on' or 'off', or None before a model has been learned"""
+        model = temp_history.identifier.model
+        if model is None or len(temp_history) == 0:
+            return None
+        if self._tables is None or self._tables.model is not model:
+            self._build(model)
+        tables = self._tables
+
+        heating = temp_history.columns()['heating']
+        past = np.zeros(model.delay + 1)
+        recent = heating[max(len(heating) - model.delay - 1, 0):]
+        if len(recent):
+            past[len(past) - len(recent):] = recent
+
+        baseline = tables.decay * temp_history.latest_temp + tables.offset + past @ tables.past
+        predicted = baseline + tables.forced
+
+        current = 1.0 if heating_state == 'on' else 0.0
+        switches = self._internal_switches + (self._first != current)
+        error = predicted - temp_history.target_temp
+        cost = (error * error).mean(axis=1) + self.switch_penalty * switches
+
+        return 'on' if self._first[int(np.argmin(cost))] == 1 else 'off'
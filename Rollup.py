@@ -0,0 +1,150 @@
+import numpy as np
+
+class RollupTier:
+    """Fixed-width time buckets of temperature readings.
+
+    Each bucket keeps the count, min, max and sum of the temperature,
+    the number of readings with the heating on, and the last index,
+    target and delta seen.  Adding a reading touches only the newest
+    bucket, so it's O(1).  The newest bucket is kept as a tuple of plain
+    Python values and written to the columns once it closes.  With
+    max_buckets set, only about that many of the newest buckets are
+    kept.
+
+    Like TempHistory, the tier is written by one thread and read by
+    others: the columns are only written past the published count and
+    are replaced rather than shifted, and the columns, count and newest
+    bucket are published together, so readers need no lock.
+    """
+
+    INITIAL_CAPACITY = 64
+
+    COLUMNS = ('_starts_ms', '_counts', '_mins', '_maxes', '_sums',
+               '_heating', '_last_indexes', '_targets', '_deltas')
+
+    def __init__(self, width_ms: int, max_buckets=None):
+        self._width_ms = width_ms
+        self._max_buckets = max_buckets
+        self.clear()
+
+    def clear(self):
+        capacity = self.INITIAL_CAPACITY
+        if self._max_buckets is not None:
+            capacity = min(capacity, self._max_buckets + 1)
+        self._count = 0
+        self._starts_ms = np.zeros(capacity, dtype=np.int64)
+        self._counts = np.zeros(capacity, dtype=np.int64)
+        self._mins = np.zeros(capacity, dtype=np.float64)
+        self._maxes = np.zeros(capacity, dtype=np.float64)
+        self._sums = np.zeros(capacity, dtype=np.float64)
+        self._heating = np.zeros(capacity, dtype=np.int64)
+        self._last_indexes = np.zeros(capacity, dtype=np.int64)
+        self._targets = np.zeros(capacity, dtype=np.float64)
+        self._deltas = np.zeros(capacity, dtype=np.float64)
+        self._open = None
+        self._publish(columns_changed=True)
+
+    def _publish(self, columns_changed=False):
+        if columns_changed:
+            self._column_list = [getattr(self, name) for name in self.COLUMNS]
+        self._published = (self._column_list, self._count, self._open)
+
+    def _grow(self):
+        capacity = 2 * len(self._counts)
+        start = 0
+        if self._max_buckets is not None:
+            max_capacity = self._max_buckets + max(self._max_buckets // 8, 1)
+            if len(self._counts) >= max_capacity:
+                # Drop the oldest buckets, keeping the newest max_buckets - 1
+                # closed ones (plus the open one)
+                capacity = len(self._counts)
+                start = self._count - (self._max_buckets - 1)
+            else:
+                capacity = min(capacity, max_capacity)
+
+        for name in self.COLUMNS:
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self._count - start] = column[start:self._count]
+            setattr(self, name, grown)
+        self._count -= start
+        self._column_list = [getattr(self, name) for name in self.COLUMNS]
+
+    @property
+    def width_ms(self) -> int:
+        return self._width_ms
+
+    def __len__(self):
+        _, count, bucket = self._published
+        return count + (1 if bucket is not None else 0)
+
+    def add(self, index, timestamp_ms, temp, target, delta, heating):
+        start_ms = timestamp_ms - timestamp_ms % self._width_ms
+        bucket = self._open
+        if bucket is None or bucket[0] != start_ms:
+            if bucket is not None:
+                self._close(bucket)
+            self._open = (start_ms, 1, temp, temp, temp, heating, index, target, delta)
+        else:
+            _, count, low, high, total, heated, _, _, _ = bucket
+            self._open = (start_ms, count + 1,
+                          temp if temp < low else low,
+                          temp if temp > high else high,
+                          total + temp, heated + heating, index, target, delta)
+        self._publish()
+
+    def _close(self, bucket):
+        if self._count == len(self._counts):
+            self._grow()
+        i = self._count
+        (self._starts_ms[i], self._counts[i], self._mins[i], self._maxes[i], self._sums[i],
+         self._heating[i], self._last_indexes[i], self._targets[i], self._deltas[i]) = bucket
+        self._count = i + 1
+
+    def _columns(self):
+        """Every column including the open bucket"""
+        columns, n, bucket = self._published
+        if bucket is None:
+            return [column[:n] for column in columns]
+        return [np.append(column[:n], value) for column, value in zip(columns, bucket)]
+
+    @property
+    def data(self):
+        starts_ms, counts, mins, maxes, sums, heating, last_indexes, targets, deltas = self._columns()
+        rows = zip(starts_ms.tolist(),
+                   last_indexes.tolist(),
+                   counts.tolist(),
+                   mins.tolist(),
+                   maxes.tolist(),
+                   (sums / counts).tolist(),
+                   (heating / counts).tolist(),
+                   targets.tolist(),
+                   deltas.tolist())
+        return [{
+            'timestamp_ms': start_ms,
+            'index': index,
+            'count': count,
+            'min': low,
+            'max': high,
+            'temperature': mean,
+            'duty_cycle': duty_cycle,
+            'set_temperature': target,
+            'delta': delta
+        } for start_ms, index, count, low, high, mean, duty_cycle, target, delta in rows]
+
+    @property
+    def summary(self) -> dict:
+        """Totals over every bucket in the tier"""
+        starts_ms, counts, mins, maxes, sums, heating, _, _, _ = self._columns()
+        count = int(counts.sum())
+        if count == 0:
+            return { 'count': 0 }
+        return {
+            'count': count,
+            'start_ms': int(starts_ms[0]),
+            'end_ms': int(starts_ms[-1]) + self._width_ms,
+            'min': float(mins.min()),
+            'max': float(maxes.max()),
+            'mean': float(sums.sum() / count),
+            'duty_cycle': float(heating.sum() / count)
+        }
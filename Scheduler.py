@@ -0,0 +1,94 @@
+import math
+import asyncio
+import inspect
+import threading
+from collections import deque
+
+import numpy as np
+
+class PeriodicTask:
+    """Calls a function on a fixed deadline grid on the event loop's clock.
+
+    Deadlines are start, start + period, start + 2*period, ... so the
+    time spent in the callback doesn't push later ticks back the way
+    sleeping for a full period after the work does.  The callback
+    gets the measured time since the previous tick (in seconds).  If
+    a tick runs so late that whole periods were missed, those ticks
+    are skipped rather than run back to back.
+    """
+
+    def __init__(self, name: str, period, callback, history: int = 1000):
+        self.name = name
+        # period is either a number of seconds or a function returning
+        # one, so that it can follow settings changed from the UI
+        self._period = period if callable(period) else (lambda: period)
+        self._callback = callback
+        self._lock = threading.Lock()
+        self._lateness = deque(maxlen=history)
+        self._dts = deque(maxlen=history)
+        self._ticks = 0
+        self._missed = 0
+
+    @property
+    def period(self) -> float:
+        return self._period()
+
+    def _tick(self, now, next_deadline, last_tick):
+        """Record the lateness of this tick and return the measured dt"""
+        dt = self.period if last_tick is None else now - last_tick
+        with self._lock:
+            self._lateness.append(now - next_deadline)
+            self._dts.append(dt)
+            self._ticks += 1
+        return dt
+
+    def _next_deadline(self, next_deadline, now):
+        period = self.period
+        next_deadline += period
+        if next_deadline < now:
+            missed = math.ceil((now - next_deadline) / period)
+            next_deadline += missed * period
+            self._missed += missed
+        return next_deadline
+
+    async def run_async(self):
+        """Run as an asyncio task until cancelled.  The callback may be
+        a coroutine function.  Time is the loop's clock (time.monotonic()
+        unless the loop runs on virtual time)."""
+        loop = asyncio.get_running_loop()
+        next_deadline = loop.time()
+        last_tick = None
+
+        while True:
+            now = loop.time()
+            dt = self._tick(now, next_deadline, last_tick)
+            last_tick = now
+
+            result = self._callback(dt)
+            if inspect.isawaitable(result):
+                await result
+
+            now = loop.time()
+            next_deadline = self._next_deadline(next_deadline, now)
+            await asyncio.sleep(next_deadline - now)
+
+    @property
+    def jitter(self) -> dict:
+        """Tick lateness and measured period statistics, in milliseconds"""
+        with self._lock:
+            lateness = np.array(self._lateness) * 1000
+            dts = np.array(self._dts) * 1000
+        if len(lateness) == 0:
+            return {'name': self.name, 'ticks': 0, 'missed': 0}
+
+        return {
+            'name': self.name,
+            'period_ms': self.period * 1000,
+            'ticks': self._ticks,
+            'missed': self._missed,
+            'lateness_p50_ms': float(np.percentile(lateness, 50)),
+            'lateness_p99_ms': float(np.percentile(lateness, 99)),
+            'lateness_max_ms': float(lateness.max()),
+            'dt_mean_ms': float(dts.mean()),
+            'dt_p99_ms': float(np.percentile(dts, 99))
+        }
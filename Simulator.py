@@ -0,0 +1,257 @@
+"""Hardware-free smoker for exercising and benchmarking the control loops.
+
+SmokerModel is a lumped thermal model: the heating element, the cooking
+chamber and the meat are each a heat capacity, joined by conductances,
+with the chamber losing heat to the outside air.  The element's own
+heat capacity is what makes the chamber keep rising for a minute or so
+after the switch goes off (and lag after it goes on), as in the
+response polynomials of SmokerMonitor.temp_tracker_new.  Door openings
+and cold meat going in can be scheduled as disturbances.
+
+SimulatedThermocouple and SimulatedSwitch plug the model into
+SmokerMonitor in place of the MAX31856 and the Home Assistant switch,
+and VirtualTimeLoop is an asyncio event loop whose clock jumps straight
+to the next timer instead of sleeping, so the unmodified control engine
+runs as fast as the CPU allows:
+
+    result = simulate(hours=12)
+    result['monitor'].temp_history.summary
+"""
+
+import io
+import time
+import random
+import asyncio
+import selectors
+import contextlib
+
+from Devices import Thermocouple, HeaterSwitch
+
+class SmokerModel:
+    """Element, chamber and meat temperatures (C) over time (s)"""
+
+    def __init__(self,
+                 ambient: float = 20.0,
+                 element_power: float = 1500.0,
+                 element_capacity: float = 1500.0,
+                 element_conductance: float = 25.0,
+                 chamber_capacity: float = 8000.0,
+                 loss_conductance: float = 6.0,
+                 meat_capacity: float = 7000.0,
+                 meat_conductance: float = 3.0,
+                 meat_temp: float = 4.0,
+                 step: float = 0.5):
+        self.ambient = ambient
+        self.element_power = element_power
+        self.element_capacity = element_capacity
+        self.element_conductance = element_conductance
+        self.chamber_capacity = chamber_capacity
+        self.loss_conductance = loss_conductance
+        self.meat_capacity = meat_capacity
+        self.meat_conductance = meat_conductance
+        self.step = step
+
+        self.time = 0.0
+        self.element_temp = ambient
+        self.chamber_temp = ambient
+        self.meat_temp = meat_temp
+        self.heating = False
+
+        # (start, end, loss multiplier) of open-door periods, and
+        # (time, temperature, capacity) of meat put in
+        self._doors = []
+        self._meat = []
+
+    def open_door(self, at: float, duration: float = 60.0, loss_multiplier: float = 10.0):
+        """Schedule the door being open for duration seconds"""
+        self._doors.append((at, at + duration, loss_multiplier))
+
+    def add_meat(self, at: float, temp: float = 4.0, capacity: float = 7000.0):
+        """Schedule cold meat being put in (mixed with any already there)"""
+        self._meat.append((at, temp, capacity))
+        self._meat.sort()
+
+    def _loss_conductance(self, t):
+        conductance = self.loss_conductance
+        for start, end, multiplier in self._doors:
+            if start <= t < end:
+                conductance *= multiplier
+        return conductance
+
+    def advance_to(self, t: float):
+        """Integrate the model forward to time t"""
+        while self.time < t:
+            while self._meat and self._meat[0][0] <= self.time:
+                _, temp, capacity = self._meat.pop(0)
+                total = self.meat_capacity + capacity
+                self.meat_temp = (self.meat_temp * self.meat_capacity + temp * capacity) / total
+                self.meat_capacity = total
+
+            dt = min(self.step, t - self.time)
+            to_chamber = self.element_conductance * (self.element_temp - self.chamber_temp)
+            to_meat = self.meat_conductance * (self.chamber_temp - self.meat_temp)
+            to_outside = self._loss_conductance(self.time) * (self.chamber_temp - self.ambient)
+            power = self.element_power if self.heating else 0.0
+
+            self.element_temp += dt * (power - to_chamber) / self.element_capacity
+            self.chamber_temp += dt * (to_chamber - to_meat - to_outside) / self.chamber_capacity
+            self.meat_temp += dt * to_meat / self.meat_capacity
+            self.time += dt
+
+class SimulatedThermocouple(Thermocouple):
+    """Reads the model's chamber temperature at the clock's time, with
+    some measurement noise"""
+
+    def __init__(self, model: SmokerModel, clock, noise: float = 0.25, seed=None):
+        self.model = model
+        self.clock = clock
+        self.noise = noise
+        self._random = random.Random(seed)
+
+    @property
+    def temperature(self) -> float:
+        self.model.advance_to(self.clock())
+        return self.model.chamber_temp + self._random.gauss(0.0, self.noise)
+
+    def details(self) -> dict:
+        self.model.advance_to(self.clock())
+        return {
+            'type': 'simulated',
+            'temp': self.model.chamber_temp,
+            'element_temp': self.model.element_temp,
+            'meat_temp': self.model.meat_temp
+        }
+
+class SimulatedSwitch(HeaterSwitch):
+    """In-memory switch driving the model's element.  Counts the calls
+    that would have gone to Home Assistant (switching calls and state
+    polls) and the relay transitions."""
+
+    def __init__(self, model: SmokerModel, clock):
+        self.model = model
+        self.clock = clock
+        self._enabled = True
+        self.calls = 0
+        self.polls = 0
+        self.transitions = 0
+
+    def enable(self):
+        self._enabled = True
+
+    def disable(self):
+        self._switch('off')
+        self._enabled = False
+
+    @property
+    def state(self) -> str:
+        return 'on' if self.model.heating else 'off'
+
+    async def get_state(self) -> str:
+        self.polls += 1
+        return self.state
+
+    async def set_state(self, state: str):
+        if self._enabled:
+            self._switch(state)
+
+    def _switch(self, state):
+        self.calls += 1
+        heating = state == 'on'
+        if heating != self.model.heating:
+            self.model.advance_to(self.clock())
+            self.model.heating = heating
+            self.transitions += 1
+
+class _VirtualSelector(selectors.DefaultSelector):
+    """Polls instead of blocking, and moves the loop's clock on by the
+    time it would have waited"""
+
+    def __init__(self, loop):
+        super().__init__()
+        self._loop = loop
+
+    def select(self, timeout=None):
+        events = super().select(0)
+        if events or (timeout is not None and timeout <= 0):
+            return events
+        if timeout is None:
+            # No timers, so only I/O (e.g. from another thread) can
+            # wake the loop
+            return super().select(None)
+        self._loop.advance(timeout)
+        return events
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    """Event loop on virtual time.  Whenever every task is waiting on a
+    timer, the clock jumps to the earliest one.  Work handed to threads
+    still takes real time, so simulated devices shouldn't use them."""
+
+    def __init__(self, start: float = 0.0):
+        super().__init__(_VirtualSelector(self))
+        self._virtual_time = start
+
+    def time(self) -> float:
+        return self._virtual_time
+
+    def advance(self, seconds: float):
+        self._virtual_time += seconds
+
+def simulate(hours: float = 12.0,
+             target_temp: float = 107.0,
+             target_delta: float = 3.0,
+             monitoring_interval: int = 10,
+             model: SmokerModel = None,
+             configure=None,
+             quiet: bool = True,
+             seed=0) -> dict:
+    """Run SmokerMonitor's control engine against a simulated smoker for
+    `hours` of virtual time.  configure(monitor) can change gains and
+    such before the run starts.  Returns the monitor, model and switch
+    along with the wall time the run took."""
+    from SmokerMonitor import SmokerMonitor
+
+    loop = VirtualTimeLoop()
+    model = model if model is not None else SmokerModel()
+    # Readings are timestamped from the virtual clock too
+    epoch = time.time()
+    switch = SimulatedSwitch(model, loop.time)
+    thermocouple = SimulatedThermocouple(model, loop.time, seed=seed)
+
+    output = io.StringIO() if quiet else None
+    with contextlib.redirect_stdout(output) if quiet else contextlib.nullcontext():
+        monitor = SmokerMonitor(None, None,
+                                target_temp=target_temp,
+                                target_delta=target_delta,
+                                thermocouple=thermocouple,
+                                switch=switch)
+        monitor.temp_history.clock = lambda: epoch + loop.time()
+        monitor.monitoring_interval = monitoring_interval
+        monitor.enable()
+        if configure is not None:
+            configure(monitor)
+
+        async def run():
+            engine = asyncio.ensure_future(monitor._control_engine())
+            await asyncio.sleep(hours * 3600)
+            monitor.stop_monitoring = True
+            engine.cancel()
+            await asyncio.gather(engine, return_exceptions=True)
+
+        started = time.perf_counter()
+        cpu_started = time.process_time()
+        try:
+            loop.run_until_complete(run())
+        finally:
+            loop.close()
+        wall = time.perf_counter() - started
+        cpu = time.process_time() - cpu_started
+
+    return {
+        'monitor': monitor,
+        'model': model,
+        'switch': switch,
+        'hours': hours,
+        'wall_seconds': wall,
+        'cpu_seconds': cpu,
+        'speedup': hours * 3600 / wall if wall else float('inf')
+    }
@@ -3,22 +3,43 @@
 from datetime import datetime
 import pytz
 
-import board
-import digitalio
-import adafruit_max31856
-from adafruit_max31856 import ThermocoupleType
 from enum import Enum
+from numpy.polynomial import Polynomial
 
 import time
+import asyncio
 import threading
 import json
 
 # from MQTTPublisher import MQTTPublisher
 from HASSTempSender import HASSTempSender
+from AsyncPublisher import AsyncPublisher
+from Scheduler import PeriodicTask
 from Temp import TempHistory
-
+from PredictiveController import PredictiveController
+from Actuator import TimeProportionalActuator
+from Devices import MAX31856Thermocouple, HASSSwitch
+
+# Temperature change (C) over the seconds after the element is switched
+# off or on, measured on this smoker.  temp_tracker_new falls back to
+# these until the cook's own model has been learned.
+OFF_RESPONSE = Polynomial([ 4.44396492e-02,  1.72648956e-01,
+                            3.46405419e-02, -4.72060705e-03,
+                            3.33432101e-04, -1.37487099e-05,
+                            3.45755350e-07, -5.38467573e-09,
+                            5.07568719e-11, -2.65617763e-13,
+                            5.93215803e-16])
+ON_RESPONSE = Polynomial([ 4.31409459e+00, -9.48679313e-01,
+                           4.84294276e-02, -8.81005776e-04,
+                           8.25270973e-06, -4.34859945e-08,
+                           1.37213684e-10, -2.65498681e-13,
+                           3.09097128e-16, -1.98933195e-19,
+                           5.44196091e-23])
 
 class SmokerMonitor:
+    CONTROL_MODES = ('pid', 'mpc')
+    ACTUATIONS = ('onoff', 'pwm')
+
     def __init__(self,
                  # mqtt_server: str,
                  hass_server: str,
@@ -28,31 +49,80 @@ class SmokerMonitor:
                  target_temp: float=25.0,
                  target_delta: float=2.5,
                  # mqtt_port: int=1883,
-                 hass_port: int=8123):
+                 hass_port: int=8123,
+                 cook_log=None,
+                 max_readings: int=None,
+                 recovered: dict=None,
+                 thermocouple=None,
+                 switch=None):
         print('Initializing the smoker temperature monitor')
 
-        print('Initialing the HASS sender...')
-        self.init_hass_sender(hass_server, hass_token, hass_port)
+        # Told about new readings and state changes
+        self._listeners = []
+        self._last_state = None
+
+        # Without a HASS server (e.g. when simulating) there is no
+        # sender, and a switch has to be given
+        self.hass_sender = None
+        self._hass_sensor_enabled = False
+        if hass_server is not None:
+            print('Initialing the HASS sender...')
+            self.init_hass_sender(hass_server, hass_token, hass_port)
+        self._switch = switch if switch is not None else HASSSwitch(self.hass_sender)
 
         print('Initializing the thermocouple')
-        self.thermocouple_init = False
+        self.thermocouple = thermocouple
+        self.thermocouple_init = thermocouple is not None
         self.init_thermocouple()
 
         print('Creating the temp history object')
-        self._temp_history = TempHistory(target_temp, target_delta, units='C')
+        self._temp_history = TempHistory(target_temp, target_delta, units='C', max_readings=max_readings)
+
+        # Pick up a cook that was interrupted by a crash or restart.  The
+        # next start carries on with it (and the PID state it had)
+        # rather than clearing it.
+        self._cook_log = cook_log
+        self._resume = False
+        self._pid_state = None
+        if cook_log is not None:
+            # The caller may have read the log already (see
+            # SmokoTime.create), so it isn't read twice
+            if recovered is None:
+                recovered = cook_log.recover()
+            if len(recovered['readings']):
+                self._temp_history.restore(recovered['readings'])
+                print(f'Recovered {len(self._temp_history)} readings from the cook log')
+            self._resume = recovered['unfinished']
+            if self._resume:
+                self._pid_state = recovered['pid_state']
+            self._temp_history.log = cook_log
+
+        # Sensor sinks only care about the newest reading, so a reading
+        # that's still queued is replaced rather than piling up.
+        self._publisher = AsyncPublisher(coalesce=True)
+        self._publisher.add_sink(self.publish_reading)
+
+        # The sample, control and actuation stages all run as tasks on
+        # one event loop in the engine thread
+        self.engine_thread = None
+        self._loop = None
+        self._engine_task = None
+        self._new_reading = None
+        self._new_decision = None
 
         self.monitoring_state = 'Stopped'
         self.action = 'Start'
         self.stop_monitoring = False
         # Number of times per minute to operate
         self.monitoring_interval = 10
+        # The heater stage reads the switch's actual state when the
+        # engine starts; nothing is switched before then
         self.heating_state = 'off'
-        self.heating_state = self.hass_sender.get_switch_state()
         self.new_heating_state = ''
 
-        self.monitor_thread = None
-        self.tracking_thread = None
-        self.heater_thread = None
+        # Periodic stages run on drift-free schedules; kept for the
+        # jitter report
+        self._schedules = {}
 
         self.disable()
 
@@ -63,18 +133,72 @@ class SmokerMonitor:
         self._alpha = 0.1
         self._integral_windup_guard = 5.0
 
+        # 'pid', or 'mpc' for the predictive controller (which falls back
+        # to the PID until a model of the smoker has been learned)
+        self._control_mode = 'pid'
+        self._predictive = PredictiveController()
+
+        # 'onoff' switches the element straight from the sign of the PID
+        # output; 'pwm' uses the output as a duty cycle
+        self._actuation = 'onoff'
+        self._actuator = TimeProportionalActuator()
+
     def enable(self):
         self._enabled = True
-        self._hass_sender.enable()
+        self._switch.enable()
+        self._state_changed()
 
     def disable(self):
         self._enabled = False
-        self._hass_sender.disable()
+        self._switch.disable()
+        self._state_changed()
+
+    @property
+    def switch(self):
+        """The HeaterSwitch the element is driven through"""
+        return self._switch
 
     @property
     def enabled(self):
         return self._enabled
 
+    def add_listener(self, listener):
+        """Register a callable(event, data) that is told about each new
+        reading ('temp') and each change of state ('state')"""
+        self._listeners.append(listener)
+
+    def _notify_listeners(self, event, data):
+        for listener in list(self._listeners):
+            try:
+                listener(event, data)
+            except Exception as e:
+                print(f'############## Error notifying listener:  {e}')
+
+    def _state_changed(self):
+        if not self._listeners:
+            return
+        state = self.state
+        if state != self._last_state:
+            self._last_state = state
+            self._notify_listeners('state', state)
+
+    @property
+    def state(self) -> dict:
+        return {
+            'state': self.monitoring_state,
+            'action': self.action,
+            'heater_state': self.heating_state
+        }
+
+    @property
+    def action(self) -> str:
+        return self._action
+
+    @action.setter
+    def action(self, new_action: str):
+        self._action = new_action
+        self._state_changed()
+
     ########################### HASS Related #################################
     @property
     def hass_sender(self) -> HASSTempSender:
@@ -107,6 +231,7 @@ class SmokerMonitor:
 
         self.hass_sender.sensor = 'smoker_temp'
         self.hass_sender.entity = 'switch.snf_plug7'
+        self.hass_sender.start_state_subscription()
         self.disable_hass_sensor()
 
     @property
@@ -119,6 +244,15 @@ class SmokerMonitor:
     def disable_hass_sensor(self):
         self._hass_sensor_enabled = False
 
+    @property
+    def publisher(self) -> AsyncPublisher:
+        return self._publisher
+
+    def publish_reading(self, reading):
+        """Publisher sink that sends a reading to the HASS sensors"""
+        if self.hass_sensor_enabled:
+            self.hass_sender.publish(reading)
+
     ############################## Heating ##############################
     @property
     def heating_state(self) -> str:
@@ -129,6 +263,7 @@ class SmokerMonitor:
     @heating_state.setter
     def heating_state(self, state: str):
         self._heating_state = state
+        self._state_changed()
 
     @property
     def new_heating_state(self) -> str:
@@ -137,6 +272,28 @@ class SmokerMonitor:
     @new_heating_state.setter
     def new_heating_state(self, state: str):
         self._new_heating_state = state
+        # Wake the actuation stage straight away
+        self._notify(self._new_decision)
+
+    def _notify(self, event):
+        """Set an engine event from any thread"""
+        loop = self._loop
+        if loop is not None and event is not None:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # The loop has already been closed
+                pass
+
+    @property
+    def schedule_jitter(self) -> dict:
+        """Tick lateness and measured period for each control loop"""
+        return { name: task.jitter for name, task in self._schedules.items() }
+
+    async def _run_periodic(self, name, period, callback):
+        task = PeriodicTask(name, period, callback)
+        self._schedules[name] = task
+        await task.run_async()
 
     @property
     def monitoring_interval(self) -> int:
@@ -154,6 +311,7 @@ class SmokerMonitor:
     @monitoring_state.setter
     def monitoring_state(self, new_state: str):
         self._monitoring_state = new_state
+        self._state_changed()
 
     @property
     def temp_history(self):
@@ -161,13 +319,7 @@ class SmokerMonitor:
 
     def init_thermocouple(self) -> bool:
         if not self.thermocouple_init:
-            spi = board.SPI()
-            cs = digitalio.DigitalInOut(board.D5)
-            cs.direction = digitalio.Direction.OUTPUT
-
-            self.thermocouple = adafruit_max31856.MAX31856(spi, cs, thermocouple_type=ThermocoupleType.K)
-            self.thermocouple.averaging = 4
-
+            self.thermocouple = MAX31856Thermocouple()
             self.thermocouple_init = True
 
         if self.thermocouple_init == False:
@@ -179,41 +331,7 @@ class SmokerMonitor:
 
     def thermocouple_details(self):
         """Report back the details of the thermocouple in a dict structure"""
-        raw_type = self.thermocouple._read_register(adafruit_max31856._MAX31856_CR1_REG, 1)[0]
-        raw_type &= 0x0F
-
-        type = 'K'
-        if raw_type == ThermocoupleType.B:
-            type = 'B'
-        elif raw_type == ThermocoupleType.E:
-            type = 'E'
-        elif raw_type == ThermocoupleType.J:
-            type = 'J'
-        elif raw_type == ThermocoupleType.K:
-            type = 'K'
-        elif raw_type == ThermocoupleType.N:
-            type = 'N'
-        elif raw_type == ThermocoupleType.R:
-            type = 'R'
-        elif raw_type == ThermocoupleType.S:
-            type = 'S'
-        elif raw_type == ThermocoupleType.T:
-            type = 'T'
-        elif raw_type == ThermocoupleType.G8:
-            type = 'G8'
-        elif raw_type == ThermocoupleType.G32:
-            type = 'G32'
-        else:
-            type = 'K'
-
-        return {
-            'type': type,
-            'temp': self.thermocouple.temperature,
-            'temp_thresholds': self.thermocouple.temperature_thresholds,
-            'ref_temp': self.thermocouple.reference_temperature,
-            'ref_temp_thresholds': self.thermocouple.reference_temperature_thresholds,
-            'faults': self.thermocouple.fault
-        }
+        return self.thermocouple.details()
 
     def start_temp_monitor(self):
         # Don't do anything if the thermocouple isn't initialized
@@ -225,78 +343,173 @@ class SmokerMonitor:
 
         # self._temp_history = []
         # self.temp_index = 0
-        self._temp_history.clear()
+        if self._resume:
+            print('Resuming the interrupted cook')
+            self._resume = False
+        else:
+            self._temp_history.clear()
+            self._pid_state = None
+        if self._cook_log is not None:
+            self._cook_log.mark_start()
 
         self.stop_monitoring = False
         self.monitoring_state = 'Starting'
         self.action = 'Stop'
-        self.monitor_thread = threading.Thread(target=self.monitor_temp)
-        self.monitor_thread.start()
-
-        # self.tracking_thread = threading.Thread(target=self.temp_tracker)
-        self.tracking_thread = threading.Thread(target=self.pid_control)
-        self.tracking_thread.start()
-
-        self.heater_thread = threading.Thread(target=self.heater)
-        self.heater_thread.start()
+        self._publisher.start()
+        self.engine_thread = threading.Thread(target=self.run_control_engine, name='control-engine')
+        self.engine_thread.start()
 
     def stop_temp_monitor(self):
-        """Ask the monitoring thread to stop and wait for it to finish."""
+        """Cancel the control engine and wait for its thread to finish."""
         print('Stopping temperature monitoring')
         self.stop_monitoring = True
         self.monitoring_state = 'Stopping'
         self.action = 'Stop'
 
-        if self.monitor_thread is not None:
-            self.monitor_thread.join()
-        if self.tracking_thread is not None:
-            self.tracking_thread.join()
-        if self.heater_thread is not None:
-            self.heater_thread.join()
+        loop, task = self._loop, self._engine_task
+        if loop is not None and task is not None:
+            try:
+                loop.call_soon_threadsafe(task.cancel)
+            except RuntimeError:
+                # The loop has already been closed
+                pass
+        if self.engine_thread is not None:
+            self.engine_thread.join()
+            self.engine_thread = None
+        self._publisher.stop()
+        if self._cook_log is not None:
+            self._cook_log.mark_stop()
 
         self.monitoring_state = 'Stopped'
         self.action = 'Start'
 
-    def monitor_temp(self):
-        """Thread to continuously gather temperature data from the thermocouple.  No decision making."""
-        while True:
-            if self.stop_monitoring:
-                break
-            temp = 0.1 * round(self.thermocouple.temperature/0.1)
-            # print(f'{datetime.now()}:  Last temp was {temp}')
+    def run_control_engine(self):
+        """Thread running the event loop for the sample, control and actuation stages."""
+        asyncio.run(self._control_engine())
 
-            self._temp_history.add_temp_reading(temp, self.heating_state)
-            if self.hass_sensor_enabled:
-                self.hass_sender.publish(self._temp_history.latest)
+    async def _control_engine(self):
+        self._new_reading = asyncio.Event()
+        self._new_decision = asyncio.Event()
+        self._engine_task = asyncio.current_task()
+        self._loop = asyncio.get_running_loop()
 
-            time.sleep(60/self.monitoring_interval)
-            # time.sleep(1)
+        # stop_temp_monitor sets stop_monitoring before looking for the
+        # task, so a stop that came in before the task was published is
+        # seen here
+        if self.stop_monitoring:
+            return
 
-    def heater(self):
-        """Tight loop to turn the heat switch on and off"""
-        count = 1
-        while True:
-            if self.stop_monitoring:
+        stages = [asyncio.ensure_future(stage) for stage in (self.monitor_temp(),
+                                                             self.pid_control(),
+                                                             self.heater())]
+        try:
+            await asyncio.gather(*stages)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f'############## Control engine failed:  {e!r}')
+        finally:
+            # A stage failing doesn't stop the others by itself
+            for stage in stages:
+                stage.cancel()
+            await asyncio.gather(*stages, return_exceptions=True)
+            # Anything but stop_temp_monitor ending the engine leaves
+            # nothing in charge of the element, so switch it off
+            if not self.stop_monitoring:
+                await self._engine_failed()
+            self._loop = None
+            self._engine_task = None
+
+    async def _engine_failed(self):
+        self.monitoring_state = 'Failed (Engine)'
+        self.action = 'Start'
+        self.new_heating_state = 'off'
+        self._actuator.reset()
+        try:
+            await self._switch.set_state('off')
+            self.heating_state = 'off'
+        except Exception as e:
+            print(f'############## Error switching the element off:  {e!r}')
+
+    async def monitor_temp(self):
+        """Stage that continuously gathers temperature data from the thermocouple.  No decision making."""
+        async def sample(dt):
+            try:
+                raw_temp = await self.thermocouple.read()
+                temp = 0.1 * round(raw_temp/0.1)
+                # print(f'{datetime.now()}:  Last temp was {temp}')
+
+                self._temp_history.add_temp_reading(temp, self.heating_state)
+            except Exception as e:
+                # Nothing to control on without a reading, so turn the
+                # element off until the next good one
+                print(f'############## Error taking a reading:  {e!r}')
+                self._actuator.reset()
+                self.new_heating_state = 'off'
                 return
+            latest = self._temp_history.latest
+            if self.hass_sensor_enabled:
+                self._publisher.submit(latest)
+            self._notify_listeners('temp', latest.data)
+            self._new_reading.set()
 
-            # Refresh the state from HASS every 10 seconds
-            if count % 10 == 0:
-                self.heating_state = self.hass_sender.get_switch_state()
-                count = 0
+        await self._run_periodic('monitor', lambda: 60/self.monitoring_interval, sample)
 
-            count = count + 1
+    async def heater(self):
+        """Stage that turns the heat switch on and off as soon as a new
+        decision is made, or at the actuator's scheduled edges"""
+        # Refresh the state from HASS every 10 seconds
+        refresh_period = 10
+        loop = asyncio.get_running_loop()
+        # Read the state straight away
+        last_refresh = loop.time() - refresh_period
 
-            if self.new_heating_state != '':
-                if self.heating_state == 'off' and self.new_heating_state == 'on':
-                    print('+')
-                    self.hass_sender.switch('on')
-                    self.heating_state = 'on'
-                elif self.heating_state == 'on' and self.new_heating_state == 'off':
-                    print('-')
-                    self.hass_sender.switch('off')
-                    self.heating_state = 'off'
+        while True:
+            now = loop.time()
+            pwm = self._pwm_active
+            refresh_at = last_refresh + refresh_period
+            deadline = min(refresh_at, self._actuator.next_edge(now)) if pwm else refresh_at
+            try:
+                await asyncio.wait_for(self._new_decision.wait(), timeout=max(deadline - now, 0))
+                self._new_decision.clear()
+                now = loop.time()
+            except asyncio.TimeoutError:
+                # Timers can fire a little early, so go by the deadline
+                # rather than the clock
+                now = max(loop.time(), deadline)
+                if deadline >= refresh_at:
+                    last_refresh = now
+                    try:
+                        self.heating_state = await self._switch.get_state()
+                    except Exception as e:
+                        print(f'############## Error getting the switch state:  {e!r}')
+                    if not pwm:
+                        continue
+
+            if self._pwm_active:
+                new_state = self._actuator.state(now)
+            else:
+                new_state = self.new_heating_state
+
+            if new_state != '':
+                try:
+                    if self.heating_state == 'off' and new_state == 'on':
+                        print('+')
+                        await self._switch.set_state('on')
+                        self.heating_state = 'on'
+                    elif self.heating_state == 'on' and new_state == 'off':
+                        print('-')
+                        await self._switch.set_state('off')
+                        self.heating_state = 'off'
+                except Exception as e:
+                    # heating_state is left as it was, so the next
+                    # decision tries again
+                    print(f'############## Error switching the element {new_state}:  {e!r}')
 
-            time.sleep(1)
+    @property
+    def _pwm_active(self) -> bool:
+        # The actuator only has a duty while the PID is in charge
+        return self._actuation == 'pwm' and self._actuator.duty is not None
 
     @property
     def proportional_gain(self):
@@ -338,28 +551,77 @@ class SmokerMonitor:
     def integral_windup_guard(self, new_guard):
         self._integral_windup_guard = new_guard
 
+    @property
+    def control_mode(self):
+        return self._control_mode
+
+    @control_mode.setter
+    def control_mode(self, new_mode):
+        if new_mode not in self.CONTROL_MODES:
+            raise ValueError(f'Unknown control mode {new_mode}')
+        self._control_mode = new_mode
+
+    @property
+    def predictive_controller(self):
+        return self._predictive
+
+    @property
+    def actuation(self):
+        return self._actuation
 
-    def pid_control(self):
-        # Time interval
-        dt = self.monitoring_interval
+    @actuation.setter
+    def actuation(self, new_actuation):
+        if new_actuation not in self.ACTUATIONS:
+            raise ValueError(f'Unknown actuation {new_actuation}')
+        if new_actuation != self._actuation:
+            self._actuator.reset()
+        self._actuation = new_actuation
 
+    @property
+    def pwm_window(self):
+        return self._actuator.window
+
+    @pwm_window.setter
+    def pwm_window(self, seconds):
+        self._actuator.window = seconds
+
+    @property
+    def min_on_time(self):
+        return self._actuator.min_on
+
+    @min_on_time.setter
+    def min_on_time(self, seconds):
+        self._actuator.min_on = seconds
+
+    @property
+    def min_off_time(self):
+        return self._actuator.min_off
+
+    @min_off_time.setter
+    def min_off_time(self, seconds):
+        self._actuator.min_off = seconds
+
+    async def pid_control(self):
         # Initialize terms
         previous_error = 0
         integral = 0
         previous_filtered_derivative = 0
+        if self._pid_state is not None:
+            integral, previous_error, previous_filtered_derivative = self._pid_state
+            self._pid_state = None
 
         print('--- Waiting for some iterations')
-        time.sleep(20)
+        await asyncio.sleep(20)
 
         delay_on = 45
         delay_off = 60
         on_delay_buffer = [0] * delay_on
         off_delay_buffer = [0] * delay_off
 
-        while True:
-            if self.stop_monitoring:
-                self.monitoring_state = 'Stopping'
-                return
+        # dt is the measured time (in seconds) since the previous
+        # control step
+        def control(dt):
+            nonlocal previous_error, integral, previous_filtered_derivative
 
             self.monitoring_state = 'Started'
 
@@ -371,7 +633,7 @@ class SmokerMonitor:
             K_p = self.proportional_gain
             K_i = self.integral_gain
             K_d = self.derivative_gain
-            alpha = 0.1  # Smoothing factor for the derivative
+            alpha = self.alpha  # Smoothing factor for the derivative
 
             # Read the current temperature
             T_current = self._temp_history.latest_temp
@@ -397,6 +659,10 @@ class SmokerMonitor:
             # print('on_db :  ' + ''.join(str(x) for x in on_delay_buffer))
             # print('off_db:  ' + ''.join(str(x) for x in off_delay_buffer))
 
+            if self.actuation == 'pwm':
+                # Output of 1 or more is full on
+                self._actuator.update(output, asyncio.get_running_loop().time())
+
             if output > 0:
                 self.new_heating_state = 'on'
             else:
@@ -424,32 +690,57 @@ class SmokerMonitor:
             # Update the previous terms
             previous_error = error
             previous_filtered_derivative = filtered_derivative
+            if self._cook_log is not None:
+                self._cook_log.append_pid_state(integral, previous_error, previous_filtered_derivative)
 
-            # Wait for the next control loop
-            time.sleep(dt)
+        # One control step per new temperature reading
+        last_step = None
+        while True:
+            await self._new_reading.wait()
+            self._new_reading.clear()
+
+            now = asyncio.get_running_loop().time()
+            dt = 60/self.monitoring_interval if last_step is None else now - last_step
+            last_step = now
+
+            try:
+                if self.control_mode == 'mpc':
+                    state = self._predictive.decide(self._temp_history, self.heating_state)
+                    if state is not None:
+                        self._actuator.reset()
+                        self.monitoring_state = 'Started'
+                        print(f'--- {self._temp_history.target_temp:3.2f}, {self._temp_history.latest_temp:3.2f} -- mpc -- {state}')
+                        self.new_heating_state = state
+                        continue
+                control(dt)
+            except Exception as e:
+                print(f'############## Error in the control step:  {e!r}')
+                self._actuator.reset()
+                self.new_heating_state = 'off'
 
     def temp_tracker_new(self):
+        # Use the response learned from this cook when there is one
+        model = self._temp_history.identifier.model
+        heating = self._temp_history.columns()['heating']
+
+        def model_future(seconds, state) -> float:
+            temp_now = self._temp_history.latest_temp
+            past_inputs = heating[max(len(heating) - model.delay - 1, 0):]
+            return model.forecast(temp_now, past_inputs, state, seconds) - temp_now
+
         # Function to return the future temperature if the element was
         # switched off now
         def off_temp_future(seconds) -> float:
-            otf_p = Polynomial([ 4.44396492e-02,  1.72648956e-01,
-                                 3.46405419e-02, -4.72060705e-03,
-                                 3.33432101e-04, -1.37487099e-05,
-                                 3.45755350e-07, -5.38467573e-09,
-                                 5.07568719e-11, -2.65617763e-13,
-                                 5.93215803e-16])
-            return otf_p(seconds)
+            if model is not None:
+                return model_future(seconds, 0)
+            return OFF_RESPONSE(seconds)
 
         # Function to return the future temperature if the element was
         # switched on now.
         def on_temp_future(seconds) -> float:
-            on_p = Polynomial([ 4.31409459e+00, -9.48679313e-01,
-                                4.84294276e-02, -8.81005776e-04,
-                                8.25270973e-06, -4.34859945e-08,
-                                1.37213684e-10, -2.65498681e-13,
-                                3.09097128e-16, -1.98933195e-19,
-                                5.44196091e-23])
-            return on_p(seconds)
+            if model is not None:
+                return model_future(seconds, 1)
+            return ON_RESPONSE(seconds)
 
         temp_now = self.temp_history.latest_temp
 
@@ -487,8 +778,8 @@ class SmokerMonitor:
 
         # Wait for enough monitoring data to be present.  Should be
         # two minutes.
-        while len(self.temp_history.temp_history) <= (2*self.monitoring_interval):
-            pct_ready = int((len(self.temp_history.temp_history) / (2*self.monitoring_interval)) * 100)
+        while len(self.temp_history) <= (2*self.monitoring_interval):
+            pct_ready = int((len(self.temp_history) / (2*self.monitoring_interval)) * 100)
             if self.stop_monitoring:
                 return
             time.sleep(60/self.monitoring_interval)
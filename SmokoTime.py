@@ -1,9 +1,12 @@
 #!/usr/bin/env python3
 
 import os
+import logging
+import gzip
 
 from flask import Flask, redirect, url_for, request
 from flask import render_template
+from flask import Response
 
 from dotenv import load_dotenv
 
@@ -11,18 +14,114 @@ from SmokerMonitor import SmokerMonitor
 from MeaterMonitor import MeaterMonitor
 from MQTTPublisher import MQTTPublisher
 from HASSTempSender import HASSTempSender
+from EventStream import EventStream
+import WireFormat
+from HistoryCache import SerializedHistory
+from CookLog import CookLog
+from CookArchive import CookArchive
 
 import json
 
 load_dotenv()
 
 class SmokoTime:
-    def __init__(self, monitor: SmokerMonitor, meater: MeaterMonitor):
+    # Responses at least this big are gzipped for clients that accept it
+    GZIP_MIN_SIZE = 1024
+    GZIP_MIMETYPES = ('application/json', 'text/html', 'text/plain', 'text/css', 'application/javascript')
+    # They're compressed on every request, so cheaply
+    GZIP_LEVEL = 1
+
+    # waitress request threads.  Each /stream client holds one for as
+    # long as it's connected, so they're capped at all but
+    # RESERVED_THREADS, which are kept for every other request.
+    SERVER_THREADS = 16
+    RESERVED_THREADS = 4
+
+    def __init__(self, monitor: SmokerMonitor, meater: MeaterMonitor, archive: CookArchive = None, port=None):
         self.app = Flask('SmokoTime')
-        self.app.config.update(TEMPLATES_AUTO_RELOAD=True)
         self.smoker_monitor = monitor
         self.meater_monitor = meater
+        self.archive = archive
+        self.port = port
+
+        # Readings and state changes are pushed to /stream clients
+        self.event_stream = EventStream(serializer=self.app.json.dumps)
+        self.smoker_monitor.add_listener(self.event_stream.publish)
+        self.meater_monitor.add_listener(self.event_stream.publish)
+
+        # Each reading is serialized (and compressed) once for the
+        # history endpoints
+        self.history_cache = SerializedHistory(self.smoker_monitor.temp_history,
+                                               lambda row: self.app.json.dumps(row, separators=(',', ':')))
+
         self.initialize_routes()
+        self.app.after_request(self.compress_response)
+
+    def compress_response(self, response):
+        """Gzip a response if the client accepts it and it's worth it.
+        Streams (/stream) and responses that are already encoded (the
+        cached gzip history) are left alone."""
+        if (response.direct_passthrough or response.is_streamed
+                or response.status_code != 200
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in self.GZIP_MIMETYPES
+                or 'gzip' not in request.accept_encodings):
+            return response
+
+        body = response.get_data()
+        if len(body) < self.GZIP_MIN_SIZE:
+            return response
+        response.set_data(gzip.compress(body, compresslevel=self.GZIP_LEVEL))
+        response.headers['Content-Encoding'] = 'gzip'
+        response.vary.add('Accept-Encoding')
+        # The gzipped bytes differ from the identity ones, so a strong
+        # ETag can't be shared between them
+        etag, weak = response.get_etag()
+        if etag is not None and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    def positive_arg(self, name):
+        """An optional query argument that must be a positive integer
+        if it's given"""
+        value = request.args.get(name, type=int)
+        if value is not None and value <= 0:
+            raise ValueError(f'{name} must be a positive integer')
+        return value
+
+    def compact_history(self, series, single=False, **extra):
+        """Response for ?format=columnar or ?format=packed, or None if
+        the request didn't ask for a compact format.  series maps a
+        name (a Meater cook id) to its columns."""
+        wire_format = request.args.get('format')
+        if wire_format is None:
+            return None
+        if wire_format == 'columnar':
+            if single:
+                return WireFormat.columnar(next(iter(series.values())), **extra)
+            return { name: WireFormat.columnar(columns) for name, columns in series.items() }
+        if wire_format == 'packed':
+            return Response(WireFormat.pack(series), mimetype='application/octet-stream')
+        return f'Unknown format {wire_format}; use columnar or packed', 400
+
+    def cached_history(self, since_index=None):
+        """History response built from the serialized cache, with an
+        ETag so that a poll with nothing new gets a 304.  The ETag is
+        weak, as the same history is sent gzipped or not."""
+        self.history_cache.sync()
+        etag = self.history_cache.etag
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        elif since_index is None and 'gzip' in request.accept_encodings:
+            response = Response(self.history_cache.gzip_body(), mimetype='application/json')
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = Response(self.history_cache.body(since_index), mimetype='application/json')
+
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'no-cache'
+        response.vary.add('Accept-Encoding')
+        return response
 
     def initialize_routes(self):
         @self.app.route('/')
@@ -59,7 +158,10 @@ class SmokoTime:
                 integral_windup_guard       = self.smoker_monitor.integral_windup_guard,
                 derivative_gain     = self.smoker_monitor.derivative_gain,
                 listen_port         = self.port,
-                alpha               = self.smoker_monitor.alpha
+                alpha               = self.smoker_monitor.alpha,
+                control_mode        = self.smoker_monitor.control_mode,
+                actuation           = self.smoker_monitor.actuation,
+                pwm_window          = self.smoker_monitor.pwm_window
             )
 
         @self.app.route('/update_temps', methods=['POST'])
@@ -100,6 +202,9 @@ class SmokoTime:
                 self.smoker_monitor.integral_windup_guard = float(request.form['integral_windup_guard'])
                 self.smoker_monitor.derivative_gain = float(request.form['derivative_gain'])
                 self.smoker_monitor.alpha = float(request.form['alpha'])
+                self.smoker_monitor.control_mode = request.form.get('control_mode', self.smoker_monitor.control_mode)
+                self.smoker_monitor.actuation = request.form.get('actuation', self.smoker_monitor.actuation)
+                self.smoker_monitor.pwm_window = float(request.form.get('pwm_window', self.smoker_monitor.pwm_window))
 
                 # self.smoker_monitor.mqtt_switch = mqtt_switch_name
                 return redirect(url_for('__index'))
@@ -119,15 +224,56 @@ class SmokoTime:
         def __get_temp_history():
             """Get all the temperature history"""
             if request.method == 'GET':
-                return self.smoker_monitor.temp_history.temp_history
+                # ?points=N or ?bucket_ms=W returns a downsampled history
+                try:
+                    points = self.positive_arg('points')
+                    bucket_ms = self.positive_arg('bucket_ms')
+                except ValueError as e:
+                    return str(e), 400
+                if points is not None or bucket_ms is not None:
+                    return self.smoker_monitor.temp_history.temp_history_downsampled(points, bucket_ms)
+                temp_history = self.smoker_monitor.temp_history
+                compact = self.compact_history({ '': temp_history.columns() },
+                                               single=True, units=temp_history.units)
+                if compact is not None:
+                    return compact
+                return self.cached_history()
+
+        @self.app.route('/temp_history/rollup', methods=['GET'])
+        def __get_temp_history_rollup():
+            """Get bucketed history from a rollup tier (?tier_ms=W or ?points=N)"""
+            if request.method == 'GET':
+                tier_ms = request.args.get('tier_ms', type=int)
+                try:
+                    points = self.positive_arg('points')
+                    return self.smoker_monitor.temp_history.rollup(tier_ms, points)
+                except ValueError as e:
+                    return str(e), 400
+
+        @self.app.route('/temp_history/summary', methods=['GET'])
+        def __get_temp_history_summary():
+            """Get the whole-cook temperature and duty cycle summary"""
+            if request.method == 'GET':
+                return self.smoker_monitor.temp_history.summary
+
+        @self.app.route('/temp_history/model', methods=['GET'])
+        def __get_temp_history_model():
+            """Get the smoker response model fitted to this cook so far"""
+            if request.method == 'GET':
+                model = self.smoker_monitor.temp_history.identifier.fitted
+                return model.data if model is not None else {}
 
         @self.app.route('/temp_history/since/<index>', methods=['GET'])
         def __get_temp_history_since(index):
             """Get the temperature since the specified index"""
             if request.method == 'GET':
                 since = int(index)
-                values = self.smoker_monitor.temp_history.temp_history_since(since)
-                return values
+                temp_history = self.smoker_monitor.temp_history
+                compact = self.compact_history({ '': temp_history.columns(since) },
+                                               single=True, units=temp_history.units)
+                if compact is not None:
+                    return compact
+                return self.cached_history(since)
 
         @self.app.route('/meater/cooks', methods=['GET'])
         def __get_meater_cooks():
@@ -139,6 +285,17 @@ class SmokoTime:
         def __get_meater_history():
             """Get all the meater history"""
             if request.method == 'GET':
+                # ?points=N or ?bucket_ms=W returns a downsampled history
+                try:
+                    points = self.positive_arg('points')
+                    bucket_ms = self.positive_arg('bucket_ms')
+                except ValueError as e:
+                    return str(e), 400
+                if points is not None or bucket_ms is not None:
+                    return self.meater_monitor.history.history_downsampled(points, bucket_ms)
+                compact = self.compact_history(self.meater_monitor.history.columns())
+                if compact is not None:
+                    return compact
                 return self.meater_monitor.history.history
 
         @self.app.route('/meater/history/since/<index>', methods=['GET'])
@@ -147,18 +304,82 @@ class SmokoTime:
             if request.method == 'GET':
                 since = int(index)
                 print(f'Index = {index} :: Since = {since}')
+                compact = self.compact_history(self.meater_monitor.history.columns(since))
+                if compact is not None:
+                    return compact
                 values = self.meater_monitor.history.history_since(since)
                 return values
 
+        @self.app.route('/cooks', methods=['GET'])
+        def __get_cooks():
+            """Get the index of archived cooks"""
+            if request.method == 'GET':
+                if self.archive is None:
+                    return []
+                return self.archive.cooks
+
+        @self.app.route('/cooks/<cook_id>', methods=['GET'])
+        def __get_cook(cook_id):
+            """Get an archived cook's smoker ('') and Meater series as
+            columns, optionally limited to ?start_ms=&end_ms= and
+            downsampled with ?points=N or ?bucket_ms=W"""
+            if request.method == 'GET':
+                if self.archive is None:
+                    return 'No cook archive', 404
+                start_ms = request.args.get('start_ms', type=int)
+                end_ms = request.args.get('end_ms', type=int)
+                try:
+                    points = self.positive_arg('points')
+                    bucket_ms = self.positive_arg('bucket_ms')
+                except ValueError as e:
+                    return str(e), 400
+                try:
+                    if points is not None or bucket_ms is not None:
+                        series = self.archive.downsampled(cook_id, start_ms, end_ms, points, bucket_ms)
+                    else:
+                        series = self.archive.series(cook_id, start_ms, end_ms)
+                except KeyError as e:
+                    return str(e), 404
+                compact = self.compact_history(series)
+                if compact is not None:
+                    return compact
+                return { name: WireFormat.columnar(columns) for name, columns in series.items() }
+
         @self.app.route('/state', methods=['GET'])
         def __get_state():
             """Get all the temperature history"""
             if request.method == 'GET':
-                return {
-                    'state': self.smoker_monitor.monitoring_state,
-                    'action': self.smoker_monitor.action,
-                    'heater_state': self.smoker_monitor.heating_state
-                }
+                return self.smoker_monitor.state
+
+        @self.app.route('/stream', methods=['GET'])
+        def __get_stream():
+            """Server-sent events for new readings and state changes"""
+            subscriber = self.event_stream.subscribe()
+            if subscriber is None:
+                # The page falls back to polling
+                return Response('Too many event stream clients', status=503, headers={ 'Retry-After': '30' })
+            return Response(self.event_stream.messages(subscriber),
+                            mimetype='text/event-stream',
+                            headers={ 'Cache-Control': 'no-cache',
+                                      'X-Accel-Buffering': 'no' })
+
+        @self.app.route('/hass/publish_stats', methods=['GET'])
+        def __get_hass_publish_stats():
+            """Get the per-sensor publish counters and latencies"""
+            if request.method == 'GET':
+                return self.smoker_monitor.hass_sender.publish_stats
+
+        @self.app.route('/publish_queue', methods=['GET'])
+        def __get_publish_queue():
+            """Get the publish queue depth, drops and lag"""
+            if request.method == 'GET':
+                return self.smoker_monitor.publisher.metrics
+
+        @self.app.route('/scheduler/jitter', methods=['GET'])
+        def __get_scheduler_jitter():
+            """Get the tick lateness (p50/p99) of the control loops"""
+            if request.method == 'GET':
+                return self.smoker_monitor.schedule_jitter
 
         @self.app.route('/toggle_element', methods=['POST'])
         def __toggle_element():
@@ -187,12 +408,36 @@ class SmokoTime:
 
 
     def run(self, **kwargs):
+        """Serve with Flask's development server, reloading templates
+        as they change"""
         self.port = kwargs.get("port", -1)
         if self.port == -1:
             print("Unable to get port from args");
             return;
+        self.app.config.update(TEMPLATES_AUTO_RELOAD=True)
         self.app.run(**kwargs)
 
+    def limit_streams(self, threads: int):
+        """Cap the /stream clients for a server with `threads` request
+        threads"""
+        self.event_stream.max_clients = max(threads - self.RESERVED_THREADS, 1)
+
+    def make_server(self, host: str, port, threads: int = SERVER_THREADS):
+        """A waitress server for the app, not yet running"""
+        from waitress import create_server
+        self.port = port
+        self.limit_streams(threads)
+        return create_server(self.app, host=host, port=port, threads=threads, ident='SmokoTime')
+
+    def serve(self, host: str, port, threads: int = SERVER_THREADS):
+        """Serve with waitress, a production WSGI server: one process
+        (so one SmokerMonitor) with a pool of `threads` request threads
+        and HTTP keep-alive."""
+        logging.basicConfig()
+        server = self.make_server(host, port, threads)
+        server.print_listen('Serving on http://{}:{}')
+        server.run()
+
     def index(self):
         temp_data = self.smoker_monitor.temp_history.temp_history
         if len(temp_data) != 0:
@@ -205,25 +450,51 @@ class SmokoTime:
             }
         return f'<p>Hello</p><p>Last temp was {latest_data["temperature"]}</p>'
 
-mqtt_server = os.getenv('MQTT_SERVER')
-mqtt_user = os.getenv('MQTT_USER')
-mqtt_pass = os.getenv('MQTT_PASS')
-hass_server = os.getenv('HASS_SERVER')
-hass_token = os.getenv('HASS_TOKEN')
-listen_port = os.getenv('LISTEN_PORT')
-listen_host = os.getenv('LISTEN_HOST')
-
-# Related to Meater
-meater_user = os.getenv('MEATER_USER')
-meater_pass = os.getenv('MEATER_PASS')
-
-# sm = SmokerMonitor(mqtt_server, hass_server, hass_token, mqtt_user, mqtt_pass, target_temp = 51.66, target_delta = 1.388)
-sm = SmokerMonitor(hass_server, hass_token, target_temp = 128.055555, target_delta = 5.55555555)
-# sm.start_temp_monitor()
-mm = MeaterMonitor(meater_user, meater_pass)
-sw = SmokoTime(sm, mm)
-
-sw.run(host=listen_host, port=listen_port)
+def create(port=None) -> SmokoTime:
+    """Build the monitors and the web app from the environment"""
+    hass_server = os.getenv('HASS_SERVER')
+    hass_token = os.getenv('HASS_TOKEN')
+
+    # Related to Meater
+    meater_user = os.getenv('MEATER_USER')
+    meater_pass = os.getenv('MEATER_PASS')
+    cook_log_dir = os.getenv('COOK_LOG_DIR', 'cook_log')
+    # Raw readings kept in memory per series; older ones survive in the
+    # rollups and the cook log.  The default is two days at 10 per minute.
+    history_retention = int(os.getenv('HISTORY_RETENTION', 28800))
+
+    # sm = SmokerMonitor(mqtt_server, hass_server, hass_token, mqtt_user, mqtt_pass, target_temp = 51.66, target_delta = 1.388)
+    archive = CookArchive(os.path.join(cook_log_dir, 'archive'))
+    cook_log = CookLog(cook_log_dir, archive=archive)
+    # Read back once for both monitors
+    recovered = cook_log.recover()
+    sm = SmokerMonitor(hass_server, hass_token, target_temp = 128.055555, target_delta = 5.55555555, cook_log = cook_log, recovered = recovered, max_readings = history_retention)
+    # sm.start_temp_monitor()
+    mm = MeaterMonitor(meater_user, meater_pass, cook_log = cook_log, max_measurements = history_retention, recovered = recovered)
+    del recovered
+    return SmokoTime(sm, mm, archive, port=port)
+
+def create_app():
+    """App factory for a WSGI server, e.g.
+
+        SERVER_THREADS=16 waitress-serve --threads=16 --port=5001 --call SmokoTime:create_app
+
+    The monitors live in the server's process, so it must run only one
+    (threads, not worker processes).  Set SERVER_THREADS to the server's
+    thread count so /stream clients can't take every thread."""
+    sw = create(os.getenv('LISTEN_PORT'))
+    sw.limit_streams(int(os.getenv('SERVER_THREADS', SmokoTime.SERVER_THREADS)))
+    return sw.app
+
+if __name__ == '__main__':
+    listen_port = os.getenv('LISTEN_PORT')
+    listen_host = os.getenv('LISTEN_HOST')
+
+    sw = create(listen_port)
+    if os.getenv('DEV_SERVER'):
+        sw.run(host=listen_host, port=listen_port)
+    else:
+        sw.serve(listen_host, listen_port, threads=int(os.getenv('SERVER_THREADS', SmokoTime.SERVER_THREADS)))
 
 # app = Flask(__name__)
 
@@ -0,0 +1,235 @@
+import numpy as np
+
+class FOPDTModel:
+    """First order plus dead time model of the smoker,
+
+        tau * dT/dt = ambient + gain * u(t - dead_time) - T
+
+    where u is 1 with the element on and 0 with it off.  Held in its
+    discrete form T[k+1] = a*T[k] + b*u[k-delay] + c for a time step of
+    `step` seconds.
+    """
+
+    def __init__(self, a, b, c, delay, step, rms=None, rows=0, segments=0):
+        self.a = float(a)
+        self.b = float(b)
+        self.c = float(c)
+        self.delay = int(delay)
+        self.step = float(step)
+        self.rms = rms
+        self.rows = rows
+        self.segments = int(segments)
+
+    @property
+    def tau(self) -> float:
+        return float(-self.step / np.log(self.a))
+
+    @property
+    def gain(self) -> float:
+        return self.b / (1 - self.a)
+
+    @property
+    def ambient(self) -> float:
+        return self.c / (1 - self.a)
+
+    @property
+    def dead_time(self) -> float:
+        return self.delay * self.step
+
+    @property
+    def data(self) -> dict:
+        return {
+            'gain': self.gain,
+            'tau': self.tau,
+            'dead_time': self.dead_time,
+            'ambient': self.ambient,
+            'step': self.step,
+            'rms': self.rms,
+            'rows': self.rows,
+            'segments': self.segments
+        }
+
+    def predict(self, temp, past_inputs, future_inputs) -> np.ndarray:
+        """Temperatures after each future step.
+
+        past_inputs are the element states of the most recent steps
+        (oldest first, the last being the current step).  As in the fit,
+        T[k+1] depends on u[k-delay], so the last delay + 1 of them
+        drive the next delay + 1 steps.  future_inputs are the element
+        states from the next step on, either one sequence or a 2-D
+        array of candidate sequences, one per row, which are predicted
+        together."""
+        future = np.asarray(future_inputs, dtype=np.float64)
+        single = future.ndim == 1
+        future = np.atleast_2d(future)
+        sequences, steps = future.shape
+
+        # Input acting on step j is the one applied delay steps earlier
+        known = self.delay + 1
+        past = np.zeros(known, dtype=np.float64)
+        recent = np.asarray(past_inputs, dtype=np.float64)[-known:]
+        if len(recent):
+            past[-len(recent):] = recent
+        inputs = np.concatenate((np.broadcast_to(past, (sequences, known)), future), axis=1)
+
+        temps = np.empty((sequences, steps), dtype=np.float64)
+        current = np.full(sequences, float(temp))
+        for j in range(steps):
+            current = self.a * current + self.b * inputs[:, j] + self.c
+            temps[:, j] = current
+        return temps[0] if single else temps
+
+    def forecast(self, temp, past_inputs, heating, seconds) -> float:
+        """Temperature `seconds` from now if the element is held at
+        `heating` from the next step on.  past_inputs are as for
+        predict()."""
+        # A plain loop; for one short sequence it's quicker than predict()
+        steps = max(int(round(seconds / self.step)), 1)
+        known = self.delay + 1
+        recent = [float(u) for u in past_inputs[max(len(past_inputs) - known, 0):]]
+        inputs = [0.0] * (known - len(recent)) + recent
+        a, b, c = self.a, self.b, self.c
+        temp = float(temp)
+        for j in range(steps):
+            temp = a * temp + b * (inputs[j] if j < known else heating) + c
+        return temp
+
+class SystemIdentifier:
+    """Fits an FOPDTModel to a TempHistory as the cook goes.
+
+    The readings come in as alternating heating and cooling segments
+    (runs with the element on or off); the fit waits until it has seen
+    at least two of each.  Every reading after the first max_delay
+    contributes one least squares row T[k+1] ~ [T[k], u[k-d], 1] for each candidate delay d.
+    Only the 3x3 normal equations per delay are kept, and new readings
+    are added to them in one vectorized batch, so nothing is re-read.
+    The model is refit (one batched 3x3 solve, picking the delay with
+    the least residual) once refit_every new readings have come in, and
+    cached until then.  A new cook (TempHistory.clear) starts afresh.
+    """
+
+    def __init__(self, temp_history, max_delay: int = 20, refit_every: int = 30, min_rows: int = 60):
+        self._temp_history = temp_history
+        self.max_delay = max_delay
+        self.refit_every = refit_every
+        self.min_rows = min_rows
+        self._reset()
+
+    def _reset(self):
+        self._generation = self._temp_history.generation
+        self._last_index = None
+        self._step = None
+        # The last max_delay + 1 readings, for the lags of the next batch
+        self._tail_temps = np.zeros(0)
+        self._tail_heating = np.zeros(0)
+        self._tail_timestamps = np.zeros(0)
+        delays = self.max_delay + 1
+        self._xtx = np.zeros((delays, 3, 3))
+        self._xty = np.zeros((delays, 3))
+        self._yty = 0.0
+        self._rows = 0
+        self._segments = 0
+        self._model = None
+
+    @property
+    def model(self):
+        """The latest fit, or None until there's enough heating and
+        cooling data to fit one"""
+        if self._temp_history.generation != self._generation:
+            self._reset()
+        latest = self._temp_history.latest_index
+        if self._last_index is None or latest - self._last_index >= self.refit_every:
+            self._sync()
+            self._fit()
+        return self._model
+
+    @property
+    def fitted(self):
+        """The latest fit without fetching new readings or refitting, for
+        reading from other threads than the one adding readings"""
+        if self._temp_history.generation != self._generation:
+            return None
+        return self._model
+
+    def _sync(self):
+        """Add the readings since the last sync to the normal equations"""
+        columns = self._temp_history.columns(self._last_index)
+        if len(columns['index']) == 0:
+            return
+        self._last_index = int(columns['index'][-1])
+
+        temps = np.concatenate((self._tail_temps, columns['temperature']))
+        heating = np.concatenate((self._tail_heating, columns['heating'].astype(np.float64)))
+        timestamps = np.concatenate((self._tail_timestamps, columns['timestamp_ms'].astype(np.float64)))
+        keep = self.max_delay + 1
+        self._tail_temps = temps[-keep:]
+        self._tail_heating = heating[-keep:]
+        self._tail_timestamps = timestamps[-keep:]
+
+        n = len(temps)
+        first = n - len(columns['index']) - 1
+        # Each change of heating state starts a new segment
+        changes = np.count_nonzero(np.diff(heating[max(first, 0):]))
+        self._segments += changes + (1 if first < 0 else 0)
+        k = np.arange(max(first, self.max_delay), n - 1)
+        if len(k) == 0:
+            return
+
+        steps = np.diff(timestamps) / 1000
+        if self._step is None:
+            self._step = float(np.median(steps))
+        # Leave out rows spanning a gap (a stop and restart) or a change
+        # of monitoring interval
+        k = k[np.abs(steps[k] - self._step) <= 0.5 * self._step]
+        if len(k) == 0:
+            return
+
+        delays = np.arange(self.max_delay + 1)
+        t = temps[k]
+        y = temps[k + 1]
+        u = heating[k[None, :] - delays[:, None]]
+
+        sum_t, sum_tt, sum_y = t.sum(), (t * t).sum(), y.sum()
+        sum_u = u.sum(axis=1)
+        sum_tu = u @ t
+        sum_uu = (u * u).sum(axis=1)
+        self._xtx[:, 0, 0] += sum_tt
+        self._xtx[:, 0, 1] += sum_tu
+        self._xtx[:, 1, 0] += sum_tu
+        self._xtx[:, 0, 2] += sum_t
+        self._xtx[:, 2, 0] += sum_t
+        self._xtx[:, 1, 1] += sum_uu
+        self._xtx[:, 1, 2] += sum_u
+        self._xtx[:, 2, 1] += sum_u
+        self._xtx[:, 2, 2] += len(k)
+        self._xty[:, 0] += t @ y
+        self._xty[:, 1] += u @ y
+        self._xty[:, 2] += sum_y
+        self._yty += float(y @ y)
+        self._rows += len(k)
+
+    def _fit(self):
+        if self._rows < self.min_rows:
+            return
+        # Needs a couple of heating and cooling segments to tell the
+        # element's effect from the drift
+        if self._segments < 4:
+            return
+
+        try:
+            theta = np.linalg.solve(self._xtx, self._xty[:, :, None])[:, :, 0]
+        except np.linalg.LinAlgError:
+            return
+        residual = (self._yty
+                    - 2 * np.einsum('di,di->d', theta, self._xty)
+                    + np.einsum('di,dij,dj->d', theta, self._xtx, theta))
+
+        a, b = theta[:, 0], theta[:, 1]
+        valid = (a > 0) & (a < 1) & (b > 0)
+        if not valid.any():
+            return
+        residual = np.where(valid, residual, np.inf)
+        delay = int(np.argmin(residual))
+        rms = float(np.sqrt(max(residual[delay], 0.0) / self._rows))
+        self._model = FOPDTModel(*theta[delay], delay, self._step, rms=rms,
+                                 rows=self._rows, segments=self._segments)
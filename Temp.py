@@ -1,15 +1,24 @@
 import numpy as np
 from numpy.polynomial import Polynomial
+import Downsample
+from Rollup import RollupTier
+from SystemId import SystemIdentifier
 from typing import Optional
 
 from datetime import datetime
 import pytz
+import time
 
 class TempMeasurement:
-    def __init__(self, index, temp, target_temp, temp_delta, units, one_min_temp, heating_state: str):
+    def __init__(self, index, temp, target_temp, temp_delta, units, one_min_temp, heating_state: str,
+                 timestamp_ms: Optional[int] = None):
         self._index = index
-        self._time = datetime.now(pytz.utc).astimezone()
-        self._timestamp_ms = int(self._time.timestamp() * 1000)
+        if timestamp_ms is None:
+            self._time = datetime.now(pytz.utc).astimezone()
+            self._timestamp_ms = int(self._time.timestamp() * 1000)
+        else:
+            self._timestamp_ms = timestamp_ms
+            self._time = datetime.fromtimestamp(timestamp_ms / 1000, pytz.utc).astimezone()
         self._temp = temp
         self._target_temp = target_temp
         self._delta = temp_delta
@@ -70,28 +79,430 @@ class TempMeasurement:
             'heating': self.heating
         }
 
+class LinearTrend:
+    """Least-squares line over a sliding window of the most recent values.
+
+    Equivalent to a degree 1 Polynomial.fit over x = 0..window_size-1,
+    but the sums are updated in O(1) per value.  They are recomputed
+    from the window every window_size pushes so rounding error cannot
+    build up over a long cook.
+    """
+
+    def __init__(self, window_size):
+        self._window_size = window_size
+        self.clear()
+
+    def clear(self):
+        self._values = [0.0] * self._window_size
+        self._head = 0
+        self._count = 0
+        self._sum_y = 0.0
+        self._sum_xy = 0.0
+        self._pushes = 0
+
+    @property
+    def window_size(self):
+        return self._window_size
+
+    @property
+    def full(self) -> bool:
+        return self._count == self._window_size
+
+    def push(self, y):
+        w = self._window_size
+        y = float(y)
+        if self._count < w:
+            self._values[self._count] = y
+            self._sum_xy += self._count * y
+            self._sum_y += y
+            self._count += 1
+            return
+
+        # Drop the oldest value (x = 0) and shift every other x down by one
+        oldest = self._values[self._head]
+        self._values[self._head] = y
+        self._head = (self._head + 1) % w
+        self._sum_y -= oldest
+        self._sum_xy += (w - 1) * y - self._sum_y
+        self._sum_y += y
+
+        self._pushes += 1
+        if self._pushes == w:
+            self._resum()
+
+    def _resum(self):
+        ordered = self._values[self._head:] + self._values[:self._head]
+        self._sum_y = sum(ordered)
+        self._sum_xy = sum(x * y for x, y in enumerate(ordered))
+        self._pushes = 0
+
+    def predict(self, x):
+        """Value of the fitted line at x, where 0 is the oldest value in the window."""
+        n = self._count
+        sum_x = n * (n - 1) / 2
+        sum_xx = (n - 1) * n * (2 * n - 1) / 6
+        denominator = n * sum_xx - sum_x * sum_x
+        if denominator == 0:
+            return self._sum_y / n
+
+        slope = (n * self._sum_xy - sum_x * self._sum_y) / denominator
+        intercept = (self._sum_y - slope * sum_x) / n
+        return intercept + slope * x
+
+class TempSnapshot:
+    """A consistent, unchanging view of a TempHistory's readings.
+
+    The history only ever writes past the end of the readings it has
+    published, and drops or clears readings by switching to new arrays,
+    so the column views held here never change underneath a reader.
+    Readers on other threads take one with TempHistory.snapshot and
+    need no lock, however long they hold on to it.
+    """
+
+    __slots__ = ('_indexes', '_timestamps_ms', '_temps', '_targets', '_deltas',
+                 '_one_min_temps', '_heating', '_count', '_units', '_generation')
+
+    def __init__(self, columns, count, units, generation):
+        (self._indexes, self._timestamps_ms, self._temps, self._targets,
+         self._deltas, self._one_min_temps, self._heating) = [column[:count] for column in columns]
+        self._count = count
+        self._units = units
+        self._generation = generation
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def generation(self):
+        return self._generation
+
+    @property
+    def units(self):
+        return self._units
+
+    def _measurement(self, i) -> TempMeasurement:
+        """Materialize the reading at position i as a TempMeasurement."""
+        return TempMeasurement(int(self._indexes[i]),
+                               float(self._temps[i]),
+                               float(self._targets[i]),
+                               float(self._deltas[i]),
+                               self._units,
+                               float(self._one_min_temps[i]),
+                               'on' if self._heating[i] == 1 else 'off',
+                               timestamp_ms=int(self._timestamps_ms[i]))
+
+    def _measurements_between(self, start, end):
+        return [self._measurement(i) for i in range(start, end)]
+
+    def _data_between(self, start, end):
+        """Build the data dicts for positions [start, end) straight from the columns."""
+        return self._data_at(slice(start, end))
+
+    def _data_at(self, positions):
+        """Build the data dicts for a slice or array of positions."""
+        units = self._units
+        rows = zip(self._indexes[positions].tolist(),
+                   self._timestamps_ms[positions].tolist(),
+                   self._temps[positions].tolist(),
+                   self._targets[positions].tolist(),
+                   self._deltas[positions].tolist(),
+                   self._one_min_temps[positions].tolist(),
+                   self._heating[positions].tolist())
+        return [{
+            'index': index,
+            'time': datetime.fromtimestamp(timestamp_ms / 1000, pytz.utc).astimezone(),
+            'timestamp_ms': timestamp_ms,
+            'temperature': temp,
+            'set_temperature': target,
+            'delta': delta,
+            'units': units,
+            'one_min_temp': one_min_temp,
+            'heating': heating
+        } for index, timestamp_ms, temp, target, delta, one_min_temp, heating in rows]
+
+    @property
+    def latest_index(self):
+        """Index of the newest reading, or 0 if there are none"""
+        return int(self._indexes[-1]) if self._count else 0
+
+    @property
+    def oldest_index(self):
+        """Index of the oldest reading still held, or 0 if there are none"""
+        return int(self._indexes[0]) if self._count else 0
+
+    @property
+    def latest_temp(self):
+        if self._count == 0:
+            raise IndexError('no temperature readings')
+        return float(self._temps[-1])
+
+    @property
+    def latest(self):
+        if self._count == 0:
+            raise IndexError('no temperature readings')
+        return self._measurement(self._count - 1)
+
+    @property
+    def temp_history(self):
+        return self._data_between(0, self._count)
+
+    def _position_after(self, since_index):
+        # Indexes are assigned in increasing order, so a binary search
+        # finds the first new reading without scanning the whole cook.
+        return int(np.searchsorted(self._indexes, since_index, side='right'))
+
+    def temp_history_since(self, since_index):
+        return self._data_between(self._position_after(since_index), self._count)
+
+    def columns(self, since_index=None) -> dict:
+        """The history (or the readings after since_index) as one
+        array per field, for the compact wire formats"""
+        start = 0 if since_index is None else self._position_after(since_index)
+        return {
+            'index': self._indexes[start:],
+            'timestamp_ms': self._timestamps_ms[start:],
+            'temperature': self._temps[start:],
+            'set_temperature': self._targets[start:],
+            'delta': self._deltas[start:],
+            'one_min_temp': self._one_min_temps[start:],
+            'heating': self._heating[start:]
+        }
+
+    def temp_history_downsampled(self, points: Optional[int] = None, bucket_ms: Optional[int] = None):
+        """The history reduced to about `points` readings (or one per
+        bucket_ms) with Largest-Triangle-Three-Buckets on the
+        temperature.  Readings on either side of a heating change are
+        always kept so the on/off transitions are exact."""
+        if points is None:
+            points = Downsample.points_for_bucket(self._timestamps_ms, bucket_ms or 0)
+
+        positions = Downsample.lttb(self._timestamps_ms, self._temps, points)
+        positions = np.union1d(positions, Downsample.transitions(self._heating))
+        return self._data_at(positions)
+
+    def last_heating_cycle(self):
+        """Retrieve all the measurements in the last heating cycle."""
+        end_index = -1
+        length = 0
+
+        for i in range(self._count - 1, -1, -1):
+            if self._heating[i] == 1:
+                if length == 0:
+                    end_index = i
+                length += 1
+            elif length > 0:
+                # heating off was found after seeing heating on
+                break
+
+        if length == 0:
+            return []
+
+        return self._measurements_between(end_index - length + 1, end_index + 1)
+
+    def last_heating_tail(self):
+        """Retrieve the sixty measurements following the end of the last heating cycle."""
+        # Find the end of the last heating cycle
+        on = np.nonzero(self._heating == 1)[0]
+        if len(on) == 0:
+            return []
+        beg_index = int(on[-1]) + 1
+
+        # retrieve the sixty after it, at most
+        end_index = min(beg_index + 60, self._count)
+        return self._measurements_between(beg_index, end_index)
+
 class TempHistory:
-    def __init__(self, target_temp, delta, units='C'):
-        self._measurements = []
+    """Temperature readings for a cook.
+
+    Readings are stored column-wise in preallocated NumPy arrays that
+    grow by doubling, rather than as a list of TempMeasurement objects.
+    TempMeasurement instances are only built when a caller asks for
+    one (e.g. via latest).
+
+    With max_readings set, the columns stop growing at max_readings
+    plus a little slack; when they fill up the newest max_readings
+    readings are copied to new columns and the rest dropped.  Indexes
+    stay increasing, so since-queries are unaffected, and the dropped
+    readings live on in the rollup tiers (which keep up to max_readings
+    buckets each).
+
+    One thread (the control engine) adds readings.  After every change
+    it publishes a TempSnapshot, and all the reading methods go through
+    the latest one, so other threads (the HTTP handlers) can read while
+    readings are added, dropped or cleared.  A handler making several
+    calls should take one snapshot and make them on that.
+    """
+
+    INITIAL_CAPACITY = 1024
+
+    COLUMNS = ('_indexes', '_timestamps_ms', '_temps', '_targets',
+               '_deltas', '_one_min_temps', '_heating')
+
+    # Widths of the rollup tiers: 10 s, 1 min, 5 min and 1 h
+    ROLLUP_TIERS_MS = (10_000, 60_000, 300_000, 3_600_000)
+
+    def __init__(self, target_temp, delta, units='C', interval=10, max_readings: Optional[int] = None):
         self._index = 0
         self._target_temp = target_temp
         self._delta = delta
         self._units = units
+        self._max_readings = max_readings
+        self._rollups = { width: RollupTier(width, max_buckets=max_readings) for width in self.ROLLUP_TIERS_MS }
+        # Bumped on clear() so caches can tell one cook from the next
+        self._generation = 0
+        # Optional CookLog every reading is appended to
+        self.log = None
+        # Wall clock for reading timestamps; replaced when simulating
+        self.clock = time.time
+        self._allocate(self.INITIAL_CAPACITY)
+        self._publish()
+        self.interval = interval
+        # Learns the smoker's response for the one minute forecast
+        self.identifier = SystemIdentifier(self)
+
+    def _allocate(self, capacity):
+        if self._max_readings is not None:
+            capacity = min(capacity, self._max_capacity())
+        self._count = 0
+        self._indexes = np.zeros(capacity, dtype=np.int64)
+        self._timestamps_ms = np.zeros(capacity, dtype=np.int64)
+        self._temps = np.zeros(capacity, dtype=np.float64)
+        self._targets = np.zeros(capacity, dtype=np.float64)
+        self._deltas = np.zeros(capacity, dtype=np.float64)
+        self._one_min_temps = np.zeros(capacity, dtype=np.float64)
+        self._heating = np.zeros(capacity, dtype=np.int8)
+        self._columns = [getattr(self, name) for name in self.COLUMNS]
+
+    def _publish(self):
+        self._snapshot = TempSnapshot(self._columns, self._count, self._units, self._generation)
+
+    def _max_capacity(self):
+        if self._max_readings is None:
+            return None
+        return self._max_readings + max(self._max_readings // 8, 1)
+
+    def _grow(self):
+        """Double the capacity of every column, up to the retention
+        limit.  At the limit, drop the oldest readings instead."""
+        capacity = 2 * len(self._temps)
+        start = 0
+        max_capacity = self._max_capacity()
+        if max_capacity is not None:
+            if len(self._temps) >= max_capacity:
+                # Keep only the newest max_readings readings
+                capacity = len(self._temps)
+                start = self._count - min(self._max_readings, self._count)
+            else:
+                capacity = min(capacity, max_capacity)
+
+        # Always into new columns; published snapshots keep the old ones
+        for name in self.COLUMNS:
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self._count - start] = column[start:self._count]
+            setattr(self, name, grown)
+        self._count -= start
+        self._columns = [getattr(self, name) for name in self.COLUMNS]
 
     def add_temp_reading(self, temp, heating_state='off'):
         one_min_temp = self.one_min_temp()
-        measurement = TempMeasurement(self.current_index,
-                                      temp,
-                                      self._target_temp,
-                                      self._delta,
-                                      self._units,
-                                      one_min_temp,
-                                      heating_state)
-        self._measurements.append(measurement)
+        if self._count == len(self._temps):
+            self._grow()
+
+        index = self.current_index
+        timestamp_ms = int(self.clock() * 1000)
+        heating = 1 if heating_state == 'on' else 0
+
+        i = self._count
+        self._indexes[i] = index
+        self._timestamps_ms[i] = timestamp_ms
+        self._temps[i] = temp
+        self._targets[i] = self._target_temp
+        self._deltas[i] = self._delta
+        self._one_min_temps[i] = one_min_temp
+        self._heating[i] = heating
+        self._count = i + 1
+        self._publish()
+        self._trend.push(temp)
+
+        for rollup in self._rollups.values():
+            rollup.add(index, timestamp_ms, temp, self._target_temp, self._delta, heating)
+
+        if self.log is not None:
+            self.log.append_reading(index, timestamp_ms, temp, self._target_temp,
+                                    self._delta, one_min_temp, heating)
 
     def clear(self):
-        self._measurements = []
+        self._allocate(self.INITIAL_CAPACITY)
         self._index = 0
+        self._generation += 1
+        self._publish()
+        self._trend.clear()
+        for rollup in self._rollups.values():
+            rollup.clear()
+        if self.log is not None:
+            self.log.rotate()
+
+    def restore(self, readings):
+        """Rebuild the history from CookLog reading records, e.g. after a
+        restart in the middle of a cook"""
+        self._allocate(max(self.INITIAL_CAPACITY, len(readings)))
+        self._generation += 1
+        for rollup in self._rollups.values():
+            rollup.clear()
+
+        # Only the newest readings are kept raw, but every reading goes
+        # into the rollups
+        retained = readings[-min(len(readings), len(self._temps)):] if len(readings) else readings
+        n = len(retained)
+        self._indexes[:n] = retained['index']
+        self._timestamps_ms[:n] = retained['timestamp_ms']
+        self._temps[:n] = retained['temp']
+        self._targets[:n] = retained['target']
+        self._deltas[:n] = retained['delta']
+        self._one_min_temps[:n] = retained['one_min_temp']
+        self._heating[:n] = retained['heating']
+        self._count = n
+        self._publish()
+
+        if n:
+            self._index = int(self._indexes[n - 1])
+            self._target_temp = float(self._targets[n - 1])
+            self._delta = float(self._deltas[n - 1])
+        self.interval = self._interval
+
+        rows = zip(readings['index'].tolist(), readings['timestamp_ms'].tolist(),
+                   readings['temp'].tolist(), readings['target'].tolist(),
+                   readings['delta'].tolist(), readings['heating'].tolist())
+        for index, timestamp_ms, temp, target, delta, heating in rows:
+            for rollup in self._rollups.values():
+                rollup.add(index, timestamp_ms, temp, target, delta, heating)
+
+    @property
+    def snapshot(self) -> TempSnapshot:
+        """The readings as of now, unaffected by later changes"""
+        return self._snapshot
+
+    def __len__(self):
+        return len(self._snapshot)
+
+    @property
+    def generation(self):
+        return self._generation
+
+    @property
+    def latest_index(self):
+        """Index of the newest reading, or 0 if there are none"""
+        return self._snapshot.latest_index
+
+    @property
+    def oldest_index(self):
+        """Index of the oldest reading still held, or 0 if there are none"""
+        return self._snapshot.oldest_index
+
+    @property
+    def max_readings(self):
+        return self._max_readings
 
     @property
     def current_index(self):
@@ -116,15 +527,15 @@ class TempHistory:
 
     @property
     def latest_temp(self):
-        return self._measurements[-1].temp
+        return self._snapshot.latest_temp
 
     @property
     def latest(self):
-        return self._measurements[-1]
+        return self._snapshot.latest
 
     @property
     def temp_history(self):
-        return list(map(lambda x: x.data, self._measurements))
+        return self._snapshot.temp_history
 
     @property
     def interval(self):
@@ -133,30 +544,59 @@ class TempHistory:
     @interval.setter
     def interval(self, new_interval):
         self._interval = new_interval
+        # Refill the trend window from the readings already taken
+        trend = LinearTrend(new_interval)
+        for temp in self._snapshot.columns()['temperature'][-new_interval:]:
+            trend.push(temp)
+        self._trend = trend
 
     def temp_history_since(self, since_index):
-        filtered_items = filter(lambda x: x.index > since_index, self._measurements)
-        return list(map(lambda x: x.data, filtered_items))
+        return self._snapshot.temp_history_since(since_index)
 
-    def one_min_temp(self):
-        window_size = self.interval
-        if len(self._measurements) >= window_size:
-            # find the expected temp after one minute.  Must
-            # be one min of readings.
-            x_vals = np.arange(0, window_size)
-            # print(f'len(self._measurements) = {len(self._measurements)} && self.interval == {self.interval}')
-            last_readings = list(map(lambda x: x.temp, self._measurements[-(window_size):]))
+    def columns(self, since_index=None) -> dict:
+        """The history (or the readings after since_index) as one
+        array per field, for the compact wire formats"""
+        return self._snapshot.columns(since_index)
 
-            poly_order = 1
+    @property
+    def units(self):
+        return self._units
 
-            # Get the polynomial for the last minute
-            p = Polynomial.fit(x_vals,
-                               last_readings,
-                               poly_order,
-                               window=[0,window_size])
+    def temp_history_downsampled(self, points: Optional[int] = None, bucket_ms: Optional[int] = None):
+        return self._snapshot.temp_history_downsampled(points, bucket_ms)
 
-            latest_reading = self._measurements[-1]
+    def rollup(self, tier_ms: Optional[int] = None, points: Optional[int] = None):
+        """Bucketed history from one rollup tier.  Either name the tier
+        width, or give a number of points and get the finest tier that
+        fits in it (the coarsest if none do)."""
+        if tier_ms is not None:
+            if tier_ms not in self._rollups:
+                raise ValueError(f'No rollup tier of {tier_ms} ms; tiers are {list(self._rollups)}')
+            return self._rollups[tier_ms].data
+
+        tiers = sorted(self._rollups.values(), key=lambda tier: tier.width_ms)
+        for tier in tiers:
+            if points is None or len(tier) <= points:
+                return tier.data
+        return tiers[-1].data
+
+    @property
+    def summary(self) -> dict:
+        """Whole-cook min/max/mean temperature and heating duty cycle"""
+        return self._rollups[max(self._rollups)].summary
 
+    def one_min_temp(self):
+        # Once the identifier has learned how this smoker responds,
+        # forecast with that model (the element staying as it is)
+        model = self.identifier.model
+        if model is not None and self._count > 0:
+            last = self._count - 1
+            past_inputs = self._heating[max(0, self._count - model.delay - 1):self._count]
+            return model.forecast(self._temps[last], past_inputs, self._heating[last], 60)
+
+        # find the expected temp after one minute.  Must
+        # be one min of readings.
+        if self._trend.full:
             # each multiplier of self.interval == 1 minute
             # 0 would be the start of the look back window, so
             # look ahead should be greater than that at least
@@ -165,55 +605,32 @@ class TempHistory:
             look_ahead = 2 * self.interval
 
             # If the heating element is on, look ahead 3 minutes
-            if latest_reading.heating == 1:
+            if self._heating[self._count - 1] == 1:
                 # look three minutes ahead
                 look_ahead = 2 * self.interval
 
             # Get the future value and return it
-            future_value = p(look_ahead)
-
-            return future_value
+            return self._trend.predict(look_ahead)
         else:
             return -1
 
     def last_heating_cycle(self):
         """Retrieve all the measurements in the last heating cycle."""
-        end_index = -1
-        length = 0
-
-        for i in range(len(self._measurements) - 1, -1, -1):
-            if self._measurements[i].heating == 1:
-                if length == 0:
-                    end_index = i
-                length += 1
-            elif length > 0:
-                # heating off was found after seeing heating on
-                break
-
-        if length == 0:
-            return []
-
-        return self._measurements[end_index - length + 1:end_index + 1]
+        return self._snapshot.last_heating_cycle()
 
     def last_heating_tail(self):
         """Retrieve the sixty measurements following the end of the last heating cycle."""
-        beg_index = -1
-        length = 0
-
-        # Find the end of the last heating cycle
-        for i in range(len(self._measurements) - 1, -1, -1):
-            if self._measurements[i].heating == 1:
-                beg_index = i
-
-        # retrieve the last minute, at most
-        end_index = (beg_index + 60) if (beg_index + 60) <= len(self._measurements) else len(self._measurements)
-        return self._measurement[beg_index:end_index]
+        return self._snapshot.last_heating_tail()
 
-    def generate_polynomial(self, measurements) -> Polynomial:
-        x = [x for x in range(0,len(measurements))]
-        y = [(x.temperature - cycle[0]['temperature']) for x in measurements]
+    def generate_polynomial(self, measurements, degree=10) -> Optional[Polynomial]:
+        """Fit the temperature change from the first measurement against
+        the measurement number"""
+        if len(measurements) <= degree:
+            return None
+        x = np.arange(len(measurements))
+        y = np.array([m.temp for m in measurements]) - measurements[0].temp
 
-        p = Polynomial.fit(x, y, 10, window=[min(y),max(y)])
+        p = Polynomial.fit(x, y, degree)
         p = p.convert()
 
         return p
@@ -0,0 +1,220 @@
+"""Evaluate and tune the PID controller on virtual time.
+
+evaluate() runs SmokerMonitor's control engine for a cook against the
+simulated smoker (closed loop) or replays a recorded temperature trace
+(open loop: the controller's decisions don't change the temperatures,
+so only the switching and CPU figures depend on the gains), and scores
+it.  sweep() evaluates every combination of a grid of gains across a
+process pool.
+
+    python Tuning.py --hours 12 --proportional_gain 0.25,0.5,1 --integral_gain 0.005,0.01
+"""
+
+import os
+import time
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import Simulator
+from Devices import Thermocouple
+
+# The SmokerMonitor settings a sweep can vary
+GAINS = ('proportional_gain', 'integral_gain', 'derivative_gain', 'alpha', 'integral_windup_guard',
+         'pwm_window', 'min_on_time', 'min_off_time')
+
+# Settings for the pwm actuation, from a sweep on the default SmokerModel.
+# The output is a duty cycle there, so the gains are far lower than for
+# switching on its sign.
+PWM_SETTINGS = {
+    'actuation': 'pwm',
+    'pwm_window': 120,
+    'proportional_gain': 0.03,
+    'integral_gain': 0.0003,
+    'integral_windup_guard': 1500
+}
+
+class ReplayThermocouple(Thermocouple):
+    """Plays back a recorded trace, interpolated at the clock's time"""
+
+    def __init__(self, seconds, temps, clock):
+        self.seconds = np.asarray(seconds, dtype=np.float64)
+        self.temps = np.asarray(temps, dtype=np.float64)
+        self.clock = clock
+
+    @property
+    def temperature(self) -> float:
+        return float(np.interp(self.clock(), self.seconds, self.temps))
+
+def load_trace(archive_directory: str, cook_id: str):
+    """(seconds from the start, temperatures) of an archived cook"""
+    from CookArchive import CookArchive
+    smoker = CookArchive(archive_directory).series(cook_id)['']
+    timestamps = np.asarray(smoker['timestamp_ms'], dtype=np.float64)
+    return (timestamps - timestamps[0]) / 1000, np.asarray(smoker['temperature'])
+
+def cook_metrics(seconds, temps, target, delta, hold=1800.0) -> dict:
+    """Overshoot, settling time and steady-state error of a cook.
+
+    Overshoot is the peak above target after first coming within delta
+    of it.  Settling time is when the temperature first stays within
+    delta of target for `hold` seconds.  Steady-state error is the mean
+    and RMS error over the last quarter of the cook."""
+    seconds = np.asarray(seconds, dtype=np.float64)
+    error = np.asarray(temps, dtype=np.float64) - target
+
+    reached = np.nonzero(error >= -delta)[0]
+    overshoot = float(error[reached[0]:].max()) if len(reached) else None
+
+    settling = None
+    outside = np.abs(error) > delta
+    # Start of each run of in-band readings, and how long it lasts
+    starts = np.nonzero(~outside & np.concatenate(([True], outside[:-1])))[0]
+    for start in starts:
+        leaves = np.nonzero(outside[start:])[0]
+        end = seconds[start + leaves[0]] if len(leaves) else seconds[-1]
+        if end - seconds[start] >= hold:
+            settling = float(seconds[start])
+            break
+
+    tail = error[len(error) * 3 // 4:]
+    return {
+        'overshoot': overshoot,
+        'settling_seconds': settling,
+        'steady_state_error': float(tail.mean()) if len(tail) else None,
+        'steady_state_rms': float(np.sqrt((tail ** 2).mean())) if len(tail) else None
+    }
+
+def evaluate(gains: dict = None,
+             hours: float = 12.0,
+             target_temp: float = 107.0,
+             target_delta: float = 3.0,
+             trace=None,
+             model_params: dict = None,
+             doors=(),
+             meat=(),
+             seed=0) -> dict:
+    """Run one cook with the given gains and return its metrics.
+    trace is (seconds, temps) to replay instead of simulating; doors
+    and meat are (at, ...) argument tuples for SmokerModel.open_door
+    and add_meat."""
+    gains = dict(gains or {})
+    model = Simulator.SmokerModel(**(model_params or {}))
+    for door in doors:
+        model.open_door(*door)
+    for addition in meat:
+        model.add_meat(*addition)
+
+    def configure(monitor):
+        for name, value in gains.items():
+            setattr(monitor, name, value)
+        if trace is not None:
+            monitor.thermocouple = ReplayThermocouple(trace[0], trace[1], monitor.thermocouple.clock)
+
+    if trace is not None:
+        hours = min(hours, float(trace[0][-1]) / 3600)
+
+    result = Simulator.simulate(hours=hours,
+                                target_temp=target_temp,
+                                target_delta=target_delta,
+                                model=model,
+                                configure=configure,
+                                seed=seed)
+
+    columns = result['monitor'].temp_history.columns()
+    timestamps = np.asarray(columns['timestamp_ms'], dtype=np.float64)
+    seconds = (timestamps - timestamps[0]) / 1000 if len(timestamps) else timestamps
+    ticks = len(timestamps)
+
+    metrics = cook_metrics(seconds, columns['temperature'], target_temp, target_delta)
+    metrics.update({
+        'gains': gains,
+        'hours': hours,
+        'switch_cycles_per_hour': result['switch'].transitions / 2 / hours,
+        'switch_calls_per_hour': result['switch'].calls / hours,
+        'transitions_per_hour': result['switch'].transitions / hours,
+        'state_polls_per_hour': result['switch'].polls / hours,
+        'cpu_us_per_tick': result['cpu_seconds'] / ticks * 1e6 if ticks else None,
+        'wall_seconds': result['wall_seconds']
+    })
+    return metrics
+
+def score(metrics: dict, switch_weight: float = 0.05) -> float:
+    """Lower is better: steady-state RMS error and overshoot, plus a
+    penalty per switch cycle per hour"""
+    overshoot = max(metrics['overshoot'] or 0.0, 0.0)
+    rms = metrics['steady_state_rms'] or 0.0
+    return rms + 0.5 * overshoot + switch_weight * metrics['switch_cycles_per_hour']
+
+def _evaluate(args):
+    gains, kwargs = args
+    return evaluate(gains, **kwargs)
+
+def sweep(grid: dict, processes: int = None, **kwargs) -> list:
+    """Evaluate every combination of the gain values in grid (name ->
+    list of values) in a process pool, best score first"""
+    names = list(grid)
+    combinations = [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        results = list(executor.map(_evaluate, [(gains, kwargs) for gains in combinations]))
+    for metrics in results:
+        metrics['score'] = score(metrics)
+    return sorted(results, key=lambda metrics: metrics['score'])
+
+def compare_actuation(hours: float = 12.0, **kwargs) -> list:
+    """Metrics of a cook switched on the sign of the PID output (with
+    the default gains) and one with the pwm actuation"""
+    return [evaluate({'actuation': 'onoff'}, hours, **kwargs), evaluate(PWM_SETTINGS, hours, **kwargs)]
+
+def main():
+    parser = argparse.ArgumentParser(description='Sweep PID gains on a simulated (or replayed) cook')
+    parser.add_argument('--hours', type=float, default=12.0)
+    parser.add_argument('--target', type=float, default=107.0, help='Target temperature (C)')
+    parser.add_argument('--delta', type=float, default=3.0, help='Allowed band either side (C)')
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--archive', help='Cook archive directory to replay a cook from')
+    parser.add_argument('--cook', help='Archived cook id to replay')
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument('--actuation', choices=('onoff', 'pwm'), help='Actuation for every run')
+    parser.add_argument('--compare-actuation', action='store_true',
+                        help='Compare on/off switching with pwm instead of sweeping')
+    for name in GAINS:
+        parser.add_argument(f'--{name}', help='Comma-separated values to try')
+    args = parser.parse_args()
+
+    grid = { name: [float(v) for v in getattr(args, name).split(',')]
+             for name in GAINS if getattr(args, name) }
+    if args.actuation:
+        grid['actuation'] = [args.actuation]
+    trace = load_trace(args.archive, args.cook) if args.archive and args.cook else None
+
+    if args.compare_actuation:
+        for metrics in compare_actuation(args.hours, target_temp=args.target, target_delta=args.delta, trace=trace):
+            print(f"{metrics['gains']['actuation']:5}  "
+                  f"transitions/h {metrics['transitions_per_hour']:5.1f}  "
+                  f"HA switch calls/h {metrics['switch_calls_per_hour']:5.1f}  "
+                  f"HA state polls/h {metrics['state_polls_per_hour']:5.1f}  "
+                  f"overshoot {metrics['overshoot'] or 0:5.2f}  "
+                  f"ss err {metrics['steady_state_error']:+5.2f} (rms {metrics['steady_state_rms']:4.2f})")
+        return
+
+    started = time.perf_counter()
+    results = sweep(grid, args.processes, hours=args.hours, target_temp=args.target,
+                    target_delta=args.delta, trace=trace)
+    elapsed = time.perf_counter() - started
+
+    print(f'{len(results)} runs of {args.hours} h in {elapsed:.1f} s on {args.processes or os.cpu_count()} processes')
+    for metrics in results[:args.top]:
+        settling = metrics['settling_seconds']
+        print(f"score {metrics['score']:6.2f}  "
+              f"overshoot {metrics['overshoot'] or 0:5.2f}  "
+              f"settling {'-' if settling is None else f'{settling / 60:5.1f} min'}  "
+              f"ss err {metrics['steady_state_error']:+5.2f} (rms {metrics['steady_state_rms']:4.2f})  "
+              f"cycles/h {metrics['switch_cycles_per_hour']:5.1f}  "
+              f"cpu/tick {metrics['cpu_us_per_tick']:5.0f} us  "
+              f"{metrics['gains']}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""Compact encodings of history columns for the history endpoints.
+
+columnar: a JSON object with one array per field instead of a list of
+row dicts, so field names and constants aren't repeated per reading.
+
+packed: a little-endian binary layout,
+
+    magic    4 bytes   b'SMK1'
+    series   uint16    number of series that follow
+
+and for each series:
+
+    name     uint16 length + UTF-8 bytes  (cook id, or '' for the smoker)
+    count    uint32    number of rows
+    fields   uint16    number of columns
+    columns  one block per field
+
+Each column block is
+
+    name     uint16 length + UTF-8 bytes
+    kind     1 byte    'b' bits, 'h' int16 deltas, 'i' int32 deltas
+    scale    uint16    values were multiplied by this before rounding
+    first    int64     the first (scaled) value
+    data     count - 1 deltas of the given width, or packed bits
+
+Temperatures are sent in hundredths of a degree and change little
+between readings, so their deltas almost always fit in an int16; a
+column falls back to int32 deltas when they don't.
+"""
+
+import struct
+
+import numpy as np
+
+MAGIC = b'SMK1'
+
+# Multipliers applied before a column is rounded to integers
+SCALES = {
+    'index': 1,
+    'timestamp_ms': 1,
+    'temperature': 100,
+    'set_temperature': 100,
+    'delta': 100,
+    'one_min_temp': 100,
+    'internal': 100,
+    'ambient': 100,
+    'target_temp': 100
+}
+
+BIT_FIELDS = ('heating',)
+
+def columnar(columns: dict, **extra) -> dict:
+    """JSON-ready dict with one list per column"""
+    result = { name: values.tolist() for name, values in columns.items() }
+    result.update(extra)
+    return result
+
+def _pack_string(value: str) -> bytes:
+    encoded = value.encode('utf-8')
+    return struct.pack('<H', len(encoded)) + encoded
+
+def _pack_column(name: str, values: np.ndarray) -> bytes:
+    header = _pack_string(name)
+    if name in BIT_FIELDS:
+        return header + struct.pack('<cHq', b'b', 1, 0) + np.packbits(values.astype(np.uint8)).tobytes()
+
+    scale = SCALES.get(name, 1)
+    scaled = np.rint(np.asarray(values, dtype=np.float64) * scale).astype(np.int64)
+    first = int(scaled[0]) if len(scaled) else 0
+    deltas = np.diff(scaled)
+    if len(deltas) == 0 or (deltas.min() >= -32768 and deltas.max() <= 32767):
+        kind, data = b'h', deltas.astype('<i2')
+    else:
+        kind, data = b'i', deltas.astype('<i4')
+    return header + struct.pack('<cHq', kind, scale, first) + data.tobytes()
+
+def pack(series: dict) -> bytes:
+    """Encode {name: {field: column}} in the packed layout"""
+    parts = [MAGIC, struct.pack('<H', len(series))]
+    for series_name, columns in series.items():
+        count = len(next(iter(columns.values()))) if columns else 0
+        parts.append(_pack_string(str(series_name)))
+        parts.append(struct.pack('<IH', count, len(columns)))
+        for name, values in columns.items():
+            parts.append(_pack_column(name, values))
+    return b''.join(parts)
+
+def unpack(payload: bytes) -> dict:
+    """Decode a packed payload back into {name: {field: numpy array}}"""
+    view = memoryview(payload)
+    if bytes(view[:4]) != MAGIC:
+        raise ValueError('Not a packed history payload')
+    offset = 4
+
+    def read(fmt):
+        nonlocal offset
+        values = struct.unpack_from(fmt, view, offset)
+        offset += struct.calcsize(fmt)
+        return values
+
+    def read_string():
+        nonlocal offset
+        (length,) = read('<H')
+        value = bytes(view[offset:offset + length]).decode('utf-8')
+        offset += length
+        return value
+
+    series = {}
+    (series_count,) = read('<H')
+    for _ in range(series_count):
+        series_name = read_string()
+        count, field_count = read('<IH')
+        columns = {}
+        for _ in range(field_count):
+            name = read_string()
+            kind, scale, first = read('<cHq')
+            if kind == b'b':
+                size = (count + 7) // 8
+                bits = np.frombuffer(view[offset:offset + size], dtype=np.uint8)
+                columns[name] = np.unpackbits(bits)[:count].astype(np.int8)
+                offset += size
+                continue
+
+            dtype = '<i2' if kind == b'h' else '<i4'
+            size = max(count - 1, 0) * np.dtype(dtype).itemsize
+            deltas = np.frombuffer(view[offset:offset + size], dtype=dtype)
+            offset += size
+            values = np.concatenate(([first], first + np.cumsum(deltas, dtype=np.int64))) if count else np.zeros(0, dtype=np.int64)
+            columns[name] = values if scale == 1 else values / scale
+        series[series_name] = columns
+    return series
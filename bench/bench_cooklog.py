@@ -0,0 +1,65 @@
+"""Time CookLog appends and fsyncs on a given filesystem, e.g. the Pi's
+SD card:
+
+    python bench/bench_cooklog.py /home/pi/smokotime/cook_log_bench --seconds 60
+
+Appends a reading (and a PID state, as the control engine does) every
+`period` seconds and reports the append latency seen by the caller
+along with how long a bare fsync of the log takes on that card.
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from CookLog import CookLog
+
+def main():
+    parser = argparse.ArgumentParser(description='Time CookLog appends and fsyncs')
+    parser.add_argument('directory', help='Scratch directory on the filesystem to test (removed afterwards)')
+    parser.add_argument('--seconds', type=float, default=30.0)
+    parser.add_argument('--period', type=float, default=0.05, help='Seconds between readings')
+    parser.add_argument('--fsync-interval', type=float, default=5.0)
+    args = parser.parse_args()
+
+    if os.path.exists(args.directory):
+        sys.exit(f'{args.directory} already exists')
+    log = CookLog(args.directory, fsync_interval=args.fsync_interval)
+    try:
+        latencies = []
+        index = 0
+        end = time.monotonic() + args.seconds
+        while time.monotonic() < end:
+            started = time.perf_counter()
+            log.append_reading(index, int(time.time() * 1000), 107.0, 107.0, 3.0, 106.5, 1)
+            log.append_pid_state(12.0, 0.5, -0.1)
+            latencies.append(time.perf_counter() - started)
+            index += 1
+            time.sleep(args.period)
+
+        fsyncs = []
+        for _ in range(20):
+            log.append_reading(index, int(time.time() * 1000), 107.0, 107.0, 3.0, 106.5, 1)
+            index += 1
+            started = time.perf_counter()
+            os.fsync(log._smoker.fileno())
+            fsyncs.append(time.perf_counter() - started)
+        log.close()
+    finally:
+        shutil.rmtree(args.directory)
+
+    latencies = np.array(latencies) * 1e6
+    fsyncs = np.array(fsyncs) * 1e3
+    print(f'{len(latencies)} appends: p50 {np.percentile(latencies, 50):.1f} us, '
+          f'p99 {np.percentile(latencies, 99):.1f} us, max {latencies.max():.1f} us')
+    print(f'fsync: p50 {np.percentile(fsyncs, 50):.2f} ms, max {fsyncs.max():.2f} ms')
+    print(f'write errors: {log.errors}')
+
+if __name__ == '__main__':
+    main()
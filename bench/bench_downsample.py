@@ -0,0 +1,65 @@
+"""Time the downsampled history endpoint, from query to JSON body, for
+a synthetic cook (the element cycling every 15 minutes), and check that
+every heating change survives:
+
+    python bench/bench_downsample.py --hours 12 --per-minute 60
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Simulator
+from MeaterMonitor import MeaterMonitor
+from SmokoTime import SmokoTime
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the downsampled history endpoint')
+    parser.add_argument('--hours', type=float, default=12)
+    parser.add_argument('--per-minute', type=int, default=60)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    # A monitor for the app to serve, with its history replaced by the
+    # synthetic cook
+    monitor = Simulator.simulate(hours=0.1)['monitor']
+    history = monitor.temp_history
+    history.clear()
+    rng = np.random.default_rng(0)
+    clock = [1.7e9]
+    history.clock = lambda: clock[0]
+    readings = int(args.hours * 60 * args.per_minute)
+    cycle = 15 * args.per_minute
+    for k in range(readings):
+        on = (k // cycle) % 2 == 1
+        phase = (k % cycle) / cycle
+        history.add_temp_reading(107.0 + (3 * phase - 1.5 if on else 1.5 - 3 * phase) + rng.normal(0, 0.25),
+                                 'on' if on else 'off')
+        clock[0] += 60 / args.per_minute
+
+    client = SmokoTime(monitor, MeaterMonitor(None, None)).app.test_client()
+    heating = monitor.temp_history.columns()['heating']
+    indexes = monitor.temp_history.columns()['index']
+    # The readings on both sides of each heating change
+    changes = np.nonzero(np.diff(heating))[0]
+    edges = set(indexes[changes].tolist()) | set(indexes[changes + 1].tolist())
+    print(f'{len(indexes)} readings, {len(changes)} heating changes')
+
+    for query in ('', '?points=1000', '?points=2000', '?bucket_ms=60000'):
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            response = client.get('/temp_history' + query, headers={ 'Accept-Encoding': 'identity' })
+        elapsed = (time.perf_counter() - started) / args.repeat
+        rows = json.loads(response.data)
+        kept = edges <= { row['index'] for row in rows }
+        print(f'/temp_history{query:<17} {elapsed * 1e3:6.0f} ms {len(response.data) / 1e6:6.2f} MB '
+              f'{len(rows):>6} rows, heating changes {"all kept" if kept else "LOST"}')
+
+if __name__ == '__main__':
+    main()
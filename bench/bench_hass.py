@@ -0,0 +1,69 @@
+"""Time HASSTempSender publishes against the stand-in Home Assistant in
+checks/hass_standin.py, and count the TCP (and so TLS) connections they
+open.  Runs once with the pooled keep-alive session and once sending
+'Connection: close', so every request opens a new connection as it did
+before the session.  Needs openssl to make a throwaway certificate.
+
+    python bench/bench_hass.py --publishes 50 --per-minute 10
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'checks'))
+
+from hass_standin import HASSStandIn
+from check_hass_state import make_certificate
+from HASSTempSender import HASSTempSender
+from Temp import TempHistory
+
+def run(name, cert, key, publishes, per_minute, keep_alive):
+    standin = HASSStandIn(cert, key)
+    port = standin.start()
+    sender = HASSTempSender('localhost', port, 'token', ca_bundle=cert)
+    sender.sensor = 'smoker'
+    if not keep_alive:
+        sender.session.headers['Connection'] = 'close'
+
+    history = TempHistory(100.0, 2.0)
+    latencies = []
+    for i in range(publishes):
+        # A new temperature each time, so the sensors that follow it
+        # are sent
+        history.add_temp_reading(100.0 + i / 10, 'off')
+        started = time.perf_counter()
+        sender.publish(history.latest)
+        latencies.append(time.perf_counter() - started)
+    sender.close()
+    standin.stop()
+
+    posts = standin.requests.get('state_post', 0)
+    handshakes = len(standin.connections) / publishes
+    # With keep-alive the connections are opened once, so their share
+    # per minute falls the longer the sender runs
+    print(f'{name:>10}: {publishes} publishes ({posts} POSTs), {sum(latencies) / publishes * 1e3:.1f} ms/publish, '
+          f'{len(standin.connections)} connections, {handshakes:.2f} handshakes/publish, '
+          f'{handshakes * per_minute:.1f} handshakes/min at {per_minute:g} readings/min')
+
+def main():
+    parser = argparse.ArgumentParser(description='Time HASSTempSender publishes')
+    parser.add_argument('--publishes', type=int, default=50)
+    parser.add_argument('--per-minute', type=float, default=10, help='Readings a minute, for handshakes/min')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        cert, key = make_certificate(directory)
+        run('close', cert, key, args.publishes, args.per_minute, keep_alive=False)
+        run('keep-alive', cert, key, args.publishes, args.per_minute, keep_alive=True)
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
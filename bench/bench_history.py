@@ -0,0 +1,126 @@
+"""Time TempHistory appends and measure the memory each reading takes,
+against the list of TempMeasurement objects it replaced:
+
+    python bench/bench_history.py --readings 200000
+
+Readings are 10 s apart on a fake clock, as the monitor takes them.
+The list baseline is run with its per-reading Polynomial.fit of the
+one-minute trend, as it was, and without it (storage alone).  The
+column-backed TempHistory also feeds its rollups, the system
+identifier and the incremental trend on every append.
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pytz
+from numpy.polynomial import Polynomial
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Temp import TempHistory
+
+class ListMeasurement:
+    """One reading as the list-backed history stored it"""
+
+    def __init__(self, index, temp, target_temp, temp_delta, units, one_min_temp, heating_state):
+        self._index = index
+        self._time = datetime.now(pytz.utc).astimezone()
+        self._timestamp_ms = int(self._time.timestamp() * 1000)
+        self._temp = temp
+        self._target_temp = target_temp
+        self._delta = temp_delta
+        self._units = units
+        self._one_min_temp = one_min_temp
+        self._heating = 1 if heating_state == 'on' else 0
+
+    @property
+    def data(self):
+        return {
+            'index': self._index,
+            'time': self._time,
+            'timestamp_ms': self._timestamp_ms,
+            'temperature': self._temp,
+            'set_temperature': self._target_temp,
+            'delta': self._delta,
+            'units': self._units,
+            'one_min_temp': self._one_min_temp,
+            'heating': self._heating
+        }
+
+class ListTempHistory:
+    """The list-of-objects TempHistory, cut down to appends and reads"""
+
+    def __init__(self, target_temp, delta, units='C', interval=10, fit=True):
+        self._measurements = []
+        self._index = 0
+        self._target_temp = target_temp
+        self._delta = delta
+        self._units = units
+        self.interval = interval
+        self.fit = fit
+
+    def add_temp_reading(self, temp, heating_state='off'):
+        self._index += 1
+        self._measurements.append(ListMeasurement(self._index, temp, self._target_temp, self._delta,
+                                                  self._units, self.one_min_temp(), heating_state))
+
+    def one_min_temp(self):
+        window_size = self.interval
+        if not self.fit or len(self._measurements) < window_size:
+            return -1
+        last_readings = [x._temp for x in self._measurements[-window_size:]]
+        p = Polynomial.fit(np.arange(0, window_size), last_readings, 1, window=[0, window_size])
+        return p(2 * self.interval)
+
+    @property
+    def temp_history(self):
+        return [x.data for x in self._measurements]
+
+def fill(make, readings):
+    clock = [1.7e9]
+    history = make()
+    history.clock = lambda: clock[0]
+    for i in range(readings):
+        history.add_temp_reading(100 + random.random(), 'on' if i % 3 else 'off')
+        clock[0] += 10
+    return history
+
+def measure(name, make, readings):
+    started = time.perf_counter()
+    history = fill(make, readings)
+    elapsed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    history.temp_history
+    full = time.perf_counter() - started
+
+    # Traced separately, as tracing slows the appends down
+    del history
+    tracemalloc.start()
+    history = fill(make, readings)
+    traced = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del history
+
+    print(f'{name:>26}: {elapsed / readings * 1e6:6.2f} us/append, '
+          f'{traced / readings:6.1f} bytes/reading, full history as rows {full * 1e3:5.0f} ms')
+
+def main():
+    parser = argparse.ArgumentParser(description='Time TempHistory appends')
+    parser.add_argument('--readings', type=int, default=200000)
+    args = parser.parse_args()
+
+    print(f'{args.readings} readings')
+    measure('list of objects', lambda: ListTempHistory(100.0, 2.0), args.readings)
+    measure('list of objects, no fit', lambda: ListTempHistory(100.0, 2.0, fit=False), args.readings)
+    measure('columns', lambda: TempHistory(100.0, 2.0), args.readings)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Time PredictiveController: one decide() per tick, and rebuilding its
+response tables after a refit, for a range of reading intervals.  Then
+compare a simulated cook under the PID and the predictive mode.
+
+    python bench/bench_mpc.py --hours 12
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Temp import TempHistory
+from SystemId import FOPDTModel
+from PredictiveController import PredictiveController
+import Tuning
+
+def time_decide(step, delay, ticks):
+    model = FOPDTModel(0.98, 0.5, 0.4, delay=delay, step=step)
+    clock = [1.7e9]
+    history = TempHistory(107.0, 3.0)
+    history.clock = lambda: clock[0]
+    for k in range(200):
+        history.add_temp_reading(105.0 + (k % 7) * 0.5, 'on' if (k // 10) % 2 else 'off')
+        clock[0] += step
+    # A fixed model, rather than whatever the identifier makes of these
+    history.identifier._model = model
+    history.identifier._last_index = history.latest_index
+
+    controller = PredictiveController()
+    started = time.perf_counter()
+    controller._build(model)
+    build = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in range(ticks):
+        controller.decide(history, 'off')
+    tick = (time.perf_counter() - started) / ticks
+    sequences, steps = controller._tables.forced.shape
+    print(f'step {step:>4.0f} s, delay {delay:>2}: {sequences:>4} sequences x {steps:>2} steps, '
+          f'decide {tick * 1e6:.0f} us/tick, rebuild {build * 1e3:.2f} ms')
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the predictive controller')
+    parser.add_argument('--hours', type=float, default=12)
+    parser.add_argument('--ticks', type=int, default=2000)
+    args = parser.parse_args()
+
+    for step, delay in ((6.0, 3), (10.0, 2), (10.0, 20), (60.0, 0), (60.0, 5)):
+        time_decide(step, delay, args.ticks)
+
+    for mode in ('pid', 'mpc'):
+        metrics = Tuning.evaluate({ 'control_mode': mode }, hours=args.hours)
+        print(f"{args.hours:.0f} h cook, {mode}: overshoot {metrics['overshoot']:.1f} C, "
+              f"steady-state RMS {metrics['steady_state_rms']:.2f} C, "
+              f"{metrics['switch_cycles_per_hour']:.0f} switch cycles/h, "
+              f"{metrics['cpu_us_per_tick']:.0f} us CPU/tick")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Load the web app with keep-alive clients and report throughput and
+latency, served by waitress or (with --dev) Flask's development server.
+The server runs in a child process over a day of simulated readings.
+
+    python bench/bench_server.py --clients 8 --seconds 10 /state /temp_history/since/0
+"""
+
+import os
+import sys
+import time
+import socket
+import argparse
+import threading
+import subprocess
+import http.client
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def serve(port, dev):
+    import io
+    import logging
+    import contextlib
+    import Simulator
+    from MeaterMonitor import MeaterMonitor
+    from SmokoTime import SmokoTime
+
+    monitor = Simulator.simulate(hours=24)['monitor']
+    app = SmokoTime(monitor, MeaterMonitor(None, None), port=port)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    logging.getLogger('waitress.queue').setLevel(logging.ERROR)
+    with contextlib.redirect_stdout(io.StringIO()):
+        if dev:
+            app.app.run(host='127.0.0.1', port=port, threaded=True)
+        else:
+            app.serve('127.0.0.1', port)
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def wait_for_server(port, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('server did not start')
+
+def load(port, path, clients, seconds, gzip):
+    headers = { 'Accept-Encoding': 'gzip' } if gzip else {}
+    latencies = []
+    sizes = []
+    lock = threading.Lock()
+    end = time.perf_counter() + seconds
+
+    def client():
+        connection = http.client.HTTPConnection('127.0.0.1', port)
+        mine, my_sizes = [], []
+        while time.perf_counter() < end:
+            started = time.perf_counter()
+            connection.request('GET', path, headers=headers)
+            response = connection.getresponse()
+            body = response.read()
+            mine.append(time.perf_counter() - started)
+            my_sizes.append(len(body))
+            if response.will_close:
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port)
+        connection.close()
+        with lock:
+            latencies.extend(mine)
+            sizes.extend(my_sizes)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies = np.array(latencies) * 1e3
+    print(f'{path}: {len(latencies) / elapsed:.0f} req/s, p50 {np.percentile(latencies, 50):.1f} ms, '
+          f'p99 {np.percentile(latencies, 99):.1f} ms, {np.mean(sizes) / 1e3:.1f} KB')
+
+def main():
+    parser = argparse.ArgumentParser(description='Load the web app')
+    parser.add_argument('paths', nargs='*', default=['/state', '/temp_history/since/0'])
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--dev', action='store_true', help="Use Flask's development server")
+    parser.add_argument('--no-gzip', action='store_true', help="Don't accept gzip")
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve is not None:
+        serve(args.serve, args.dev)
+        return
+
+    port = free_port()
+    command = [sys.executable, os.path.abspath(__file__), '--serve', str(port)] + (['--dev'] if args.dev else [])
+    server = subprocess.Popen(command)
+    try:
+        wait_for_server(port)
+        print(f"{'development server' if args.dev else 'waitress'}, {args.clients} clients")
+        for path in args.paths:
+            load(port, path, args.clients, args.seconds, not args.no_gzip)
+    finally:
+        server.terminate()
+        server.wait()
+
+if __name__ == '__main__':
+    main()
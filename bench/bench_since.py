@@ -0,0 +1,38 @@
+"""Time an incremental temp_history_since poll (the last five readings)
+against histories of increasing length:
+
+    python bench/bench_since.py
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Temp import TempHistory
+
+def main():
+    parser = argparse.ArgumentParser(description='Time temp_history_since polls')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000])
+    parser.add_argument('--calls', type=int, default=100)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        clock = [1.7e9]
+        history = TempHistory(100.0, 2.0)
+        history.clock = lambda: clock[0]
+        for _ in range(size):
+            history.add_temp_reading(100.0, 'off')
+            clock[0] += 10
+
+        since = history.latest_index - 5
+        started = time.perf_counter()
+        for _ in range(args.calls):
+            history.temp_history_since(since)
+        elapsed = time.perf_counter() - started
+        print(f'{size:>8} readings: {elapsed / args.calls * 1e6:.1f} us/poll')
+
+if __name__ == '__main__':
+    main()
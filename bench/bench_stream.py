@@ -0,0 +1,115 @@
+"""Time /stream fan-out: publish events at a steady rate to a number of
+connected server-sent event clients and measure how long each takes to
+arrive, and how long /state takes meanwhile.  The app is served by
+waitress with its default thread count on a free local port, so
+clients past the stream cap are turned away with a 503.  The clients
+are threads in this process.
+
+    python bench/bench_stream.py --clients 1 4 12 20
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import http.client
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Simulator
+from MeaterMonitor import MeaterMonitor
+from SmokoTime import SmokoTime
+
+def listen(port, events, received, refused, connected):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    connection.request('GET', '/stream')
+    response = connection.getresponse()
+    if response.status != 200:
+        refused.append(response.status)
+        connection.close()
+        connected.release()
+        return
+    connected.release()
+    event = None
+    while len(received) < events:
+        line = response.fp.readline()
+        if not line:
+            break
+        if line.startswith(b'event: '):
+            event = line[7:].strip()
+        elif line.startswith(b'data: ') and event == b'bench':
+            received.append(time.perf_counter() - json.loads(line[6:])['sent'])
+    connection.close()
+
+def poll_state(port, stop, latencies):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    while not stop.is_set():
+        started = time.perf_counter()
+        connection.request('GET', '/state')
+        connection.getresponse().read()
+        latencies.append(time.perf_counter() - started)
+        time.sleep(0.05)
+    connection.close()
+
+def run(app, port, clients, events, rate):
+    connected = threading.Semaphore(0)
+    received = [[] for _ in range(clients)]
+    refused = []
+    threads = [threading.Thread(target=listen, args=(port, events, received[i], refused, connected), daemon=True)
+               for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for _ in range(clients):
+        connected.acquire()
+    accepted = clients - len(refused)
+    while app.event_stream.clients < accepted:
+        time.sleep(0.01)
+
+    stop = threading.Event()
+    state_latencies = []
+    poller = threading.Thread(target=poll_state, args=(port, stop, state_latencies), daemon=True)
+    poller.start()
+
+    cpu = time.process_time()
+    for _ in range(events):
+        app.event_stream.publish('bench', { 'sent': time.perf_counter() })
+        time.sleep(1 / rate)
+    for thread in threads:
+        thread.join(10)
+    cpu = time.process_time() - cpu
+    stop.set()
+    poller.join()
+
+    latencies = np.concatenate([np.array(r) for r in received if r]) * 1e3
+    delivered = sum(len(r) for r in received)
+    state = np.array(state_latencies) * 1e3
+    print(f'{clients:>3} clients ({len(refused)} refused): {delivered}/{accepted * events} events delivered, '
+          f'p50 {np.percentile(latencies, 50):.1f} ms, p99 {np.percentile(latencies, 99):.1f} ms, '
+          f'{cpu / events * 1e3:.2f} ms CPU/event; /state p99 {np.percentile(state, 99):.1f} ms')
+    while app.event_stream.clients:
+        time.sleep(0.01)
+
+def main():
+    parser = argparse.ArgumentParser(description='Time /stream fan-out')
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 4, 12, 20])
+    parser.add_argument('--events', type=int, default=500)
+    parser.add_argument('--rate', type=float, default=100, help='Events per second')
+    args = parser.parse_args()
+
+    monitor = Simulator.simulate(hours=1)['monitor']
+    app = SmokoTime(monitor, MeaterMonitor(None, None))
+    server = app.make_server('127.0.0.1', 0)
+    threading.Thread(target=server.run, daemon=True).start()
+    print(f'{SmokoTime.SERVER_THREADS} threads, at most {app.event_stream.max_clients} streams')
+    try:
+        for clients in args.clients:
+            run(app, server.effective_port, clients, args.events, args.rate)
+    finally:
+        server.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""Time the one-minute trend, LinearTrend, against the Polynomial.fit
+over the whole window that it replaced, for a few window sizes:
+
+    python bench/bench_trend.py
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+from numpy.polynomial import Polynomial
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Temp import LinearTrend
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the one-minute trend')
+    parser.add_argument('--windows', type=int, nargs='+', default=[10, 60, 600])
+    parser.add_argument('--readings', type=int, default=5000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    temps = 100 + np.cumsum(rng.normal(0, 0.2, args.readings))
+    for window in args.windows:
+        look_ahead = 2 * window
+        trend = LinearTrend(window)
+        started = time.perf_counter()
+        predictions = []
+        for temp in temps:
+            trend.push(temp)
+            if trend.full:
+                predictions.append(trend.predict(look_ahead))
+        incremental = time.perf_counter() - started
+
+        started = time.perf_counter()
+        fitted = []
+        for k in range(window, len(temps) + 1):
+            fitted.append(Polynomial.fit(np.arange(window), temps[k - window:k], 1)(look_ahead))
+        fit = time.perf_counter() - started
+
+        error = np.max(np.abs(np.array(predictions) - np.array(fitted)))
+        print(f'window {window:>4}: {incremental / len(temps) * 1e6:.1f} us/reading, '
+              f'Polynomial.fit {fit / len(fitted) * 1e6:.1f} us/reading, max difference {error:.1e}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""Compare the size and encoding time of the history wire formats (JSON
+rows, columnar JSON and packed) for a synthetic cook:
+
+    python bench/bench_wire.py --hours 12 --per-minute 60
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Temp import TempHistory
+import WireFormat
+
+def timed(encode):
+    started = time.perf_counter()
+    payload = encode()
+    return payload, time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the history wire formats')
+    parser.add_argument('--hours', type=float, default=12)
+    parser.add_argument('--per-minute', type=int, default=60)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    interval = 60 / args.per_minute
+    clock = [1.7e9]
+    history = TempHistory(107.0, 3.0)
+    history.clock = lambda: clock[0]
+    readings = int(args.hours * 60 * args.per_minute)
+    for k in range(readings):
+        history.add_temp_reading(107.0 + 3 * np.sin(k / 200) + rng.normal(0, 0.25),
+                                 'on' if (k // 40) % 2 else 'off')
+        clock[0] += interval
+
+    rows, rows_time = timed(lambda: json.dumps(history.temp_history, default=str).encode('utf-8'))
+    columnar, columnar_time = timed(lambda: json.dumps(WireFormat.columnar(history.columns())).encode('utf-8'))
+    packed, packed_time = timed(lambda: WireFormat.pack({ '': history.columns() }))
+
+    print(f'{readings} readings')
+    for name, payload, elapsed in (('JSON rows', rows, rows_time),
+                                   ('columnar JSON', columnar, columnar_time),
+                                   ('packed', packed, packed_time)):
+        print(f'{name:>14}: {len(payload) / 1e6:6.2f} MB {elapsed * 1e3:7.1f} ms')
+
+    columns = history.columns()
+    unpacked = WireFormat.unpack(packed)['']
+    for name in ('index', 'timestamp_ms', 'heating'):
+        assert np.array_equal(unpacked[name], columns[name]), name
+    error = np.max(np.abs(unpacked['temperature'] - columns['temperature']))
+    print(f'packed round trip exact for index, timestamp_ms and heating; temperature within {error:.4f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Check HASSTempSender's switch state cache and websocket subscription
+against the stand-in Home Assistant in hass_standin.py.  Needs openssl
+to make a throwaway certificate.
+
+    python checks/check_hass_state.py
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hass_standin import HASSStandIn
+from HASSTempSender import HASSTempSender
+from Devices import HASSSwitch
+from SmokerMonitor import SmokerMonitor
+import Simulator
+
+ENTITY = 'switch.smoker'
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('timed out')
+        time.sleep(0.02)
+
+def make_certificate(directory):
+    cert, key = os.path.join(directory, 'cert.pem'), os.path.join(directory, 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                    '-keyout', key, '-out', cert, '-subj', '/CN=localhost',
+                    '-addext', 'subjectAltName=DNS:localhost'],
+                   check=True, capture_output=True)
+    return cert, key
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        cert, key = make_certificate(directory)
+        standin = HASSStandIn(cert, key)
+        port = standin.start()
+        standin.states[ENTITY] = 'off'
+
+        sender = HASSTempSender('localhost', port, 'token', ca_bundle=cert)
+        sender.entity = ENTITY
+        sender.start_state_subscription()
+        wait_for(lambda: sender._ws_connected)
+
+        for _ in range(50):
+            assert sender.get_switch_state() == 'off'
+        print(f"50 reads made {standin.requests.get('state_get', 0)} REST GET")
+        assert standin.requests.get('state_get', 0) <= 1
+
+        gets = standin.requests.get('state_get', 0)
+        standin.set_state(ENTITY, 'on')
+        wait_for(lambda: sender.get_switch_state() == 'on', 1.0)
+        assert standin.requests.get('state_get', 0) == gets
+        print('a state change pushed over the websocket was seen without a GET')
+
+        standin.send_raw('not json')
+        standin.send_raw('{"type": "event"}')
+        standin.set_state(ENTITY, 'off')
+        wait_for(lambda: sender.get_switch_state() == 'off', 1.0)
+        assert standin.requests['websocket'] == 1
+        print('malformed messages were skipped on the same connection')
+
+        standin.drop_sockets()
+        wait_for(lambda: standin.requests['websocket'] == 2 and sender._ws_connected)
+        print('reconnected after the server closed the socket')
+        sender.close()
+
+        # A CA bundle that isn't there yet is retried rather than ending
+        # the subscription
+        late_bundle = os.path.join(directory, 'late.pem')
+        late = HASSTempSender('localhost', port, 'token', ca_bundle=late_bundle)
+        late.entity = ENTITY
+        late.start_state_subscription()
+        time.sleep(1.5)
+        assert not late._ws_connected
+        shutil.copy(cert, late_bundle)
+        wait_for(lambda: late._ws_connected)
+        print('connected once the CA bundle appeared')
+        late.close()
+
+        # Creating a SmokerMonitor doesn't read the switch over REST
+        sender = HASSTempSender('localhost', port, 'token', ca_bundle=cert)
+        sender.entity = ENTITY
+        gets = standin.requests.get('state_get', 0)
+        model = Simulator.SmokerModel()
+        SmokerMonitor(None, None,
+                      thermocouple=Simulator.SimulatedThermocouple(model, time.monotonic),
+                      switch=HASSSwitch(sender))
+        assert standin.requests.get('state_get', 0) == gets
+        print('SmokerMonitor started without a REST GET')
+        sender.close()
+
+        standin.stop()
+        print('ok')
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
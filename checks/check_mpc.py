@@ -0,0 +1,85 @@
+"""Check that PredictiveController's response tables match
+FOPDTModel.predict and that it makes a real decision whatever the
+model's dead time, including dead times longer than the horizon.
+
+    python checks/check_mpc.py
+"""
+
+import os
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from SystemId import FOPDTModel
+from PredictiveController import PredictiveController
+import Simulator
+
+class History:
+    """The parts of a TempHistory that PredictiveController reads"""
+
+    def __init__(self, model, temp, target, heating):
+        self.identifier = SimpleNamespace(model=model)
+        self.latest_temp = temp
+        self.target_temp = target
+        self._heating = np.asarray(heating, dtype=np.int8)
+
+    def __len__(self):
+        return len(self._heating)
+
+    def columns(self):
+        return { 'heating': self._heating }
+
+def check_tables(model, rng):
+    controller = PredictiveController()
+    history = History(model, 100.0, 107.0, rng.integers(0, 2, 30))
+    controller.decide(history, 'off')
+    tables = controller._tables
+    known = model.delay + 1
+
+    assert tables.forced.shape[1] >= known + 1, 'no step is left for the decision to act on'
+    assert np.ptp(tables.forced, axis=0).max() > 0, 'every sequence predicts the same'
+
+    past = history.columns()['heating'][-known:]
+    sequences = controller._sequences
+    # predict() returns one step per input, so pad the sequences out to
+    # the tables' horizon; the padding acts after it
+    future = np.hstack((sequences, np.zeros((len(sequences), known))))
+    expected = model.predict(history.latest_temp, past, future)
+    tabled = tables.decay * history.latest_temp + tables.offset + past @ tables.past + tables.forced
+    return float(np.abs(expected - tabled).max())
+
+def main():
+    rng = np.random.default_rng(0)
+    worst = 0.0
+    for step in (6.0, 10.0, 60.0):
+        for delay in range(21):
+            model = FOPDTModel(0.98, 0.5, 0.4, delay=delay, step=step)
+            worst = max(worst, check_tables(model, rng))
+
+            # Far below the target it heats, far above it doesn't
+            controller = PredictiveController()
+            assert controller.decide(History(model, 20.0, 107.0, [0] * 30), 'off') == 'on', (step, delay)
+            assert controller.decide(History(model, 200.0, 107.0, [1] * 30), 'on') == 'off', (step, delay)
+    print(f'tables match predict() to {worst:.1e} for steps of 6-60 s and delays of 0-20')
+    assert worst < 1e-9
+
+    # One reading a minute, where a dead time of a few steps is longer
+    # than the 240 s horizon
+    result = Simulator.simulate(hours=8, monitoring_interval=1,
+                                configure=lambda monitor: setattr(monitor, 'control_mode', 'mpc'))
+    monitor = result['monitor']
+    model = monitor.temp_history.identifier.model
+    temps = monitor.temp_history.columns()['temperature']
+    settled = temps[len(temps) // 2:]
+    rms = float(np.sqrt(np.mean((settled - monitor.temp_history.target_temp) ** 2)))
+    print(f'1/min cook in mpc mode: delay {model.delay} steps, state {monitor.monitoring_state}, '
+          f'second half RMS {rms:.2f} C')
+    assert monitor.monitoring_state == 'Started'
+    assert rms < 5
+    print('ok')
+
+if __name__ == '__main__':
+    main()
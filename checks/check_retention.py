@@ -0,0 +1,92 @@
+"""Check that a TempHistory with max_readings set holds constant memory
+over a simulated 7-day cook, and that polling temp_history_since across
+its compactions sees every reading exactly once.
+
+    python checks/check_retention.py
+"""
+
+import os
+import sys
+import gzip
+import json
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Temp import TempHistory
+from HistoryCache import SerializedHistory
+
+DAYS = 7
+INTERVAL = 6.0
+READINGS_PER_DAY = int(86400 / INTERVAL)
+# Eight hours raw, so the 1 minute rollup tier is full by day 4 and
+# every buffer has been compacted many times by day 7.  The 5 minute and
+# 1 hour tiers are still filling at day 7, so their columns are checked
+# against max_buckets rather than for flat memory.
+MAX_READINGS = 4800
+
+def rollup_bytes(history):
+    return sum(getattr(tier, name).nbytes for tier in history._rollups.values() for name in tier.COLUMNS)
+
+def main():
+    rng = np.random.default_rng(0)
+    clock = [1.7e9]
+    history = TempHistory(107.0, 3.0, max_readings=MAX_READINGS)
+    history.clock = lambda: clock[0]
+    cache = SerializedHistory(history, lambda row: json.dumps(row, separators=(',', ':'), default=str))
+
+    tracemalloc.start()
+    memory = []
+    # Each poll is checked to carry on from the last, so a count is
+    # enough (a list of every index would grow the traced memory)
+    seen = 0
+    last_seen = 0
+    next_poll = 1
+
+    for k in range(DAYS * READINGS_PER_DAY):
+        heating = 'on' if (k // 40) % 2 else 'off'
+        history.add_temp_reading(107.0 + 3 * np.sin(k / 200) + rng.normal(0, 0.25), heating)
+        clock[0] += INTERVAL
+
+        # A UI polling at irregular intervals
+        if k + 1 == next_poll:
+            new = history.temp_history_since(last_seen)
+            indexes = [reading['index'] for reading in new]
+            assert indexes == list(range(last_seen + 1, history.latest_index + 1)), (last_seen, indexes[:3])
+            seen += len(indexes)
+            last_seen = history.latest_index
+            next_poll += int(rng.integers(1, 50))
+
+        if (k + 1) % READINGS_PER_DAY == 0:
+            cache.sync()
+            assert gzip.decompress(cache.gzip_body()) == cache.body()
+            rollups = rollup_bytes(history)
+            memory.append(tracemalloc.get_traced_memory()[0] - rollups)
+            print(f'day {len(memory)}: {len(history)} readings held, '
+                  f'{len(history._temps)} capacity, {memory[-1] / 1e6:.2f} MB traced '
+                  f'+ {rollups / 1e6:.2f} MB of rollups')
+
+    tracemalloc.stop()
+
+    seen += len(history.temp_history_since(last_seen))
+    assert seen == history.latest_index == DAYS * READINGS_PER_DAY, 'a reading was missed or repeated'
+    print(f'polling saw all {seen} readings exactly once')
+
+    # A since older than the retained readings gets everything retained
+    old = history.temp_history_since(1)
+    assert old[0]['index'] == history.oldest_index and len(old) == len(history)
+    assert len(history) <= MAX_READINGS + MAX_READINGS // 8
+    for tier in history._rollups.values():
+        assert len(tier._counts) <= MAX_READINGS + MAX_READINGS // 8
+
+    # Flat from day 3, once the raw readings and caches have settled
+    settled = memory[2:]
+    spread = (max(settled) - min(settled)) / max(settled)
+    print(f'memory spread over days 3-{DAYS}: {spread:.1%}')
+    assert spread < 0.02
+    print('ok')
+
+if __name__ == '__main__':
+    main()
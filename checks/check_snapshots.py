@@ -0,0 +1,144 @@
+"""Check that readers of TempHistory, its rollups, SerializedHistory and
+MeaterHistory only ever see consistent snapshots while a writer adds
+readings at 60 Hz (far faster than the smoker does), trimming and
+clearing as it goes.  Threads are switched every 10 us rather than every
+5 ms, so a reader is likely to be interrupted mid-update if it can be.
+
+    python checks/check_snapshots.py --seconds 20
+"""
+
+import os
+import sys
+import gzip
+import json
+import time
+import argparse
+import threading
+from types import SimpleNamespace
+from collections import Counter
+from datetime import datetime, timezone
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Temp import TempHistory
+from HistoryCache import SerializedHistory
+from MeaterMonitor import MeaterHistory
+
+def temp_for(index):
+    """Each reading's temperature follows from its index, so a reader
+    can tell a temperature paired with the wrong index"""
+    return 100 + (index % 97) * 0.01
+
+def probe_reading(n, clock):
+    cook = SimpleNamespace(id=f'cook{(n // 400) % 3}', name='Brisket', state='Started',
+                           target_temperature=93, peak_temperature=n, time_remaining=1, time_elapsed=1)
+    return SimpleNamespace(id='probe', cook=cook, internal_temperature=n, ambient_temperature=n,
+                           time_updated=datetime.fromtimestamp(clock, timezone.utc))
+
+class Stress:
+    def __init__(self):
+        self.clock = 1.7e9
+        self.history = TempHistory(110, 3, max_readings=600)
+        self.history.clock = lambda: self.clock
+        self.cache = SerializedHistory(self.history, lambda row: json.dumps(row, separators=(',', ':'), default=str))
+        self.meater = MeaterHistory(max_measurements=200)
+
+        self.stop = threading.Event()
+        self.errors = []
+        self.readings = 0
+        self.reads = Counter()
+
+    def write(self):
+        period = 1 / 60
+        next_time = time.perf_counter()
+        n = 0
+        while not self.stop.is_set():
+            self.clock += 10
+            self.history.add_temp_reading(temp_for(self.history.latest_index + 1), 'on' if n % 7 < 3 else 'off')
+            if n % 4 == 0:
+                self.meater.add(probe_reading(n, self.clock))
+            if n % 2000 == 1999:
+                self.history.clear()
+                self.meater.clear()
+            n += 1
+            next_time += period
+            time.sleep(max(0, next_time - time.perf_counter()))
+        self.readings = n
+
+    def check_columns(self):
+        columns = self.history.columns()
+        indexes = columns['index']
+        assert len(set(len(v) for v in columns.values())) == 1, 'ragged columns'
+        assert np.all(np.diff(indexes) == 1), 'indexes not contiguous'
+        assert np.allclose(columns['temperature'], [temp_for(i) for i in indexes.tolist()]), 'temperature and index mismatch'
+
+    def check_since(self):
+        rows = self.history.temp_history_since(max(0, self.history.latest_index - 50))
+        indexes = [row['index'] for row in rows]
+        assert indexes == list(range(indexes[0], indexes[0] + len(indexes))) if indexes else True, 'rows not contiguous'
+        assert all(abs(row['temperature'] - temp_for(row['index'])) < 1e-9 for row in rows), 'temperature and index mismatch'
+
+    def check_rollups(self):
+        self.history.temp_history_downsampled(50)
+        self.history.rollup(points=100)
+        self.history.summary
+        for tier in self.history._rollups.values():
+            for bucket in tier.data:
+                assert bucket['min'] <= bucket['temperature'] <= bucket['max'], 'bucket mismatch'
+
+    def check_cache(self):
+        self.cache.sync()
+        body = json.loads(self.cache.body())
+        json.loads(gzip.decompress(self.cache.gzip_body()))
+        indexes = [row['index'] for row in body]
+        assert all(b - a == 1 for a, b in zip(indexes, indexes[1:])), 'cached rows not contiguous'
+
+    def check_meater(self):
+        self.meater.history
+        self.meater.history_since(5)
+        self.meater.history_downsampled(20)
+        self.meater.cooks
+        for columns in self.meater.columns().values():
+            assert np.all(np.diff(columns['index']) > 0), 'indexes not increasing'
+            assert np.array_equal(columns['internal'], columns['ambient']), 'internal and ambient mismatch'
+
+    def read(self, check):
+        while not self.stop.is_set():
+            try:
+                check()
+                self.reads[check.__name__] += 1
+            except Exception as e:
+                self.errors.append(f'{check.__name__}: {type(e).__name__}: {e}')
+
+    def run(self, seconds):
+        checks = [self.check_columns, self.check_since, self.check_rollups, self.check_cache, self.check_meater]
+        threads = [threading.Thread(target=self.read, args=(check,)) for check in checks]
+        threads.append(threading.Thread(target=self.write))
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        self.stop.set()
+        for thread in threads:
+            thread.join()
+
+def main():
+    parser = argparse.ArgumentParser(description='Check history snapshots under concurrent reads and writes')
+    parser.add_argument('--seconds', type=float, default=20)
+    args = parser.parse_args()
+
+    sys.setswitchinterval(1e-5)
+    stress = Stress()
+    stress.run(args.seconds)
+
+    print(f'writer: {stress.readings} readings in {args.seconds:.0f} s')
+    for name, count in stress.reads.items():
+        print(f'{name}: {count} reads')
+    for error, count in Counter(stress.errors).most_common(10):
+        print(f'{count} x {error}')
+    assert not stress.errors, f'{len(stress.errors)} inconsistent reads'
+    print('ok')
+
+if __name__ == '__main__':
+    main()
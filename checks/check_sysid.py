@@ -0,0 +1,66 @@
+"""Check that SystemIdentifier recovers a known FOPDT plant and that
+FOPDTModel's forecasts line the dead time up the way the fit does.
+
+    python checks/check_sysid.py
+"""
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Temp import TempHistory
+
+A, B, C, DELAY, STEP = 0.98, 0.5, 0.4, 3, 6.0
+
+def plant(readings=2000, seed=0):
+    """Temperatures and element states of an exact
+    T[k+1] = A*T[k] + B*u[k-DELAY] + C plant under a noisy relay"""
+    rng = np.random.default_rng(seed)
+    temps = np.zeros(readings)
+    heating = np.zeros(readings, dtype=np.int8)
+    temps[0] = 20.0
+    for k in range(readings):
+        low = 35 + rng.uniform(-2, 2)
+        heating[k] = 1 if temps[k] < low else (0 if temps[k] > low + 3 else heating[k - 1])
+        if k + 1 < readings:
+            temps[k + 1] = A * temps[k] + B * (heating[k - DELAY] if k >= DELAY else 0) + C
+    return temps, heating
+
+def main():
+    temps, heating = plant()
+    history = TempHistory(36, 2, max_readings=len(temps))
+    clock = [0.0]
+    history.clock = lambda: clock[0]
+    for temp, u in zip(temps, heating):
+        history.add_temp_reading(float(temp), 'on' if u else 'off')
+        clock[0] += STEP
+
+    model = history.identifier.model
+    assert model is not None, 'no model was fitted'
+    print(f'fitted a={model.a:.6f} b={model.b:.6f} c={model.c:.6f} delay={model.delay}')
+    assert model.delay == DELAY, model.delay
+    assert np.allclose((model.a, model.b, model.c), (A, B, C), atol=1e-6)
+
+    # One step ahead from every reading, with the inputs as the callers
+    # slice them
+    worst = 0.0
+    for n in range(DELAY + 1, len(temps) - 1):
+        past = heating[max(0, n - model.delay):n + 1]
+        forecast = model.forecast(temps[n], past, heating[n + 1], STEP)
+        worst = max(worst, abs(forecast - temps[n + 1]))
+    print(f'worst one step forecast error {worst:.2e}')
+    assert worst < 1e-6
+
+    # 20 steps ahead with the actual future inputs
+    n = len(temps) // 2
+    predicted = model.predict(temps[n], heating[n - model.delay:n + 1], heating[n + 1:n + 21])
+    worst = float(np.abs(predicted - temps[n + 1:n + 21]).max())
+    print(f'worst 20 step prediction error {worst:.2e}')
+    assert worst < 1e-6
+    print('ok')
+
+if __name__ == '__main__':
+    main()
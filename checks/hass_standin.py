@@ -0,0 +1,179 @@
+"""A stand-in for the parts of the Home Assistant API that SmokoTime
+uses: switch services, entity states and the websocket state_changed
+subscription.  Runs on its own event loop thread, over TLS, so a
+HASSTempSender can be pointed at it.
+
+    python checks/hass_standin.py --cert cert.pem --key key.pem --port 8123
+"""
+
+import ssl
+import json
+import asyncio
+import argparse
+import threading
+
+from aiohttp import web
+
+class HASSStandIn:
+    def __init__(self, cert: str, key: str, host: str = '127.0.0.1', port: int = 0, token: str = 'token'):
+        self.cert = cert
+        self.key = key
+        self.host = host
+        self.port = port
+        self.token = token
+
+        self.states = {}
+        # Requests by kind, e.g. 'state_get', 'state_post', 'switch'
+        self.requests = {}
+        # Client (host, port) pairs seen, so one per TCP connection
+        self.connections = set()
+        self._sockets = set()
+        self._loop = None
+        self._runner = None
+        self._thread = None
+        self._started = threading.Event()
+
+    def _count(self, kind):
+        self.requests[kind] = self.requests.get(kind, 0) + 1
+
+    @web.middleware
+    async def _track_connection(self, request, handler):
+        self.connections.add(request.transport.get_extra_info('peername'))
+        return await handler(request)
+
+    def _app(self):
+        app = web.Application(middlewares=[self._track_connection])
+        app.add_routes([web.get('/api/states/{entity_id}', self._get_state),
+                        web.post('/api/states/{entity_id}', self._post_state),
+                        web.post('/api/services/switch/{service}', self._switch),
+                        web.get('/api/websocket', self._websocket)])
+        return app
+
+    async def _get_state(self, request):
+        self._count('state_get')
+        entity_id = request.match_info['entity_id']
+        if entity_id not in self.states:
+            return web.json_response({ 'message': 'Entity not found.' }, status=404)
+        return web.json_response({ 'entity_id': entity_id, 'state': self.states[entity_id] })
+
+    async def _post_state(self, request):
+        self._count('state_post')
+        entity_id = request.match_info['entity_id']
+        self.states[entity_id] = (await request.json())['state']
+        return web.json_response({ 'entity_id': entity_id, 'state': self.states[entity_id] }, status=201)
+
+    async def _switch(self, request):
+        self._count('switch')
+        service = request.match_info['service']
+        if service not in ('turn_on', 'turn_off'):
+            return web.json_response({ 'message': 'Service not found.' }, status=400)
+        entity_id = (await request.json())['entity_id']
+        await self._change(entity_id, service[len('turn_'):])
+        return web.json_response([])
+
+    async def _websocket(self, request):
+        self._count('websocket')
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        await ws.send_json({ 'type': 'auth_required' })
+        auth = await ws.receive_json()
+        if auth.get('access_token') != self.token:
+            await ws.send_json({ 'type': 'auth_invalid' })
+            await ws.close()
+            return ws
+        await ws.send_json({ 'type': 'auth_ok' })
+
+        self._sockets.add(ws)
+        try:
+            async for message in ws:
+                data = json.loads(message.data)
+                if data.get('type') == 'subscribe_events':
+                    await ws.send_json({ 'id': data['id'], 'type': 'result', 'success': True, 'result': None })
+        finally:
+            self._sockets.discard(ws)
+        return ws
+
+    async def _change(self, entity_id, state):
+        old = self.states.get(entity_id)
+        self.states[entity_id] = state
+        event = { 'id': 1,
+                  'type': 'event',
+                  'event': { 'event_type': 'state_changed',
+                             'data': { 'entity_id': entity_id,
+                                       'old_state': { 'state': old },
+                                       'new_state': { 'state': state } } } }
+        for ws in list(self._sockets):
+            await ws.send_json(event)
+
+    def _call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def set_state(self, entity_id: str, state: str):
+        """Change an entity as if it was switched from HASS itself"""
+        self._call(self._change(entity_id, state))
+
+    def send_raw(self, text: str):
+        """Send every subscriber a raw websocket message"""
+        async def send():
+            for ws in list(self._sockets):
+                await ws.send_str(text)
+        self._call(send())
+
+    def drop_sockets(self):
+        """Close every websocket, as a HASS restart would"""
+        async def drop():
+            for ws in list(self._sockets):
+                await ws.close()
+        self._call(drop())
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._sockets)
+
+    def start(self):
+        """Start serving in a thread; returns the port"""
+        self._thread = threading.Thread(target=self._run, name='hass-standin', daemon=True)
+        self._thread.start()
+        self._started.wait()
+        return self.port
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+
+        ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        ssl_context.load_cert_chain(self.cert, self.key)
+        self._runner = web.AppRunner(self._app())
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, self.host, self.port, ssl_context=ssl_context)
+        self._loop.run_until_complete(site.start())
+        self.port = site._server.sockets[0].getsockname()[1]
+        self._started.set()
+        self._loop.run_forever()
+        self._loop.run_until_complete(self._runner.cleanup())
+        self._loop.close()
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = None
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a stand-in Home Assistant API')
+    parser.add_argument('--cert', required=True)
+    parser.add_argument('--key', required=True)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8123)
+    parser.add_argument('--token', default='token')
+    args = parser.parse_args()
+
+    standin = HASSStandIn(args.cert, args.key, args.host, args.port, args.token)
+    print(f'Serving on https://{args.host}:{standin.start()}')
+    try:
+        standin._thread.join()
+    except KeyboardInterrupt:
+        standin.stop()
+
+if __name__ == '__main__':
+    main()